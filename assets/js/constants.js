@@ -5,6 +5,8 @@
 
 // API and data URLs
 export const JSON_URL = 'events.json';
+export const INDEX_URL = 'data/index.json'; // partitioned output: index + monthly shards
+export const SEARCH_INDEX_VERSION = 1; // format of the search index referenced by index.json
 export const CACHE_URL = 'geocode_cache.json';
 
 // Map configuration
@@ -8,7 +8,8 @@ import {
   getEventDateLabel,
   getDayOfWeekName,
   getDayOfWeekFromDate,
-  getTimeAgoText,
+  getEventEndTime,
+  hasEventEnded,
   formatLocation,
   bindKeyboardActivation,
   sanitizeHtml
@@ -146,24 +147,16 @@ class EventListManager {
       if (event.date > DEVICE_TODAY) return true; // Future dates
       if (event.date < DEVICE_TODAY) return false; // Past dates
 
-      // Today's events - check if still active
-      const timeInfo = event.text ? this._extractTimeFromText(event.text) : null;
-      if (!timeInfo || !timeInfo.hasEndTime) return true; // No end time = upcoming
-
-      const timeAgoText = getTimeAgoText(event.date, timeInfo.end, timeInfo.start);
-      return !timeAgoText; // If no "ended ago" text, it's upcoming
+      // Today's events - check if still active (no end time = upcoming)
+      return !hasEventEnded(event, now);
     });
 
     this.archiveEvents = this.allEvents.filter(event => {
       if (event.date > DEVICE_TODAY) return false; // Future dates
       if (event.date < DEVICE_TODAY) return true; // Past dates
 
-      // Today's events - check if ended
-      const timeInfo = event.text ? this._extractTimeFromText(event.text) : null;
-      if (!timeInfo || !timeInfo.hasEndTime) return false; // No end time = not archive
-
-      const timeAgoText = getTimeAgoText(event.date, timeInfo.end, timeInfo.start);
-      return !!timeAgoText; // If has "ended ago" text, it's archive
+      // Today's events - check if ended (no end time = not archive)
+      return hasEventEnded(event, now);
     });
 
     // If no upcoming events but archive exists, start with archive
@@ -172,55 +165,6 @@ class EventListManager {
     }
   }
 
-  /**
-   * Extract time from text (local helper)
-   * @param {string} text - Text to parse
-   * @returns {Object|null} Time info
-   * @private
-   */
-  _extractTimeFromText(text) {
-    if (!text) return null;
-
-    const timePatterns = [
-      /(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})/,
-      /(\d{1,2}):(\d{2})/
-    ];
-
-    for (const pattern of timePatterns) {
-      const match = text.match(pattern);
-      if (match) {
-        if (match.length === 5) {
-          const startHour = parseInt(match[1]);
-          const startMin = parseInt(match[2]);
-          const endHour = parseInt(match[3]);
-          const endMin = parseInt(match[4]);
-
-          if (startHour >= 0 && startHour <= 23 && startMin >= 0 && startMin <= 59 &&
-              endHour >= 0 && endHour <= 23 && endMin >= 0 && endMin <= 59) {
-            return {
-              start: `${startHour.toString().padStart(2, '0')}:${startMin.toString().padStart(2, '0')}`,
-              end: `${endHour.toString().padStart(2, '0')}:${endMin.toString().padStart(2, '0')}`,
-              hasEndTime: true
-            };
-          }
-        } else if (match.length === 3) {
-          const hour = parseInt(match[1]);
-          const min = parseInt(match[2]);
-
-          if (hour >= 0 && hour <= 23 && min >= 0 && min <= 59) {
-            return {
-              start: `${hour.toString().padStart(2, '0')}:${min.toString().padStart(2, '0')}`,
-              end: null,
-              hasEndTime: false
-            };
-          }
-        }
-      }
-    }
-
-    return null;
-  }
-
   /**
    * Update archive button label
    * @private
@@ -282,11 +226,10 @@ class EventListManager {
 
     // Filter today's events (including recently ended)
     const todayEvents = events.filter(event => event.date === todayStr).filter(event => {
-      const timeInfo = event.text ? this._extractTimeFromText(event.text) : null;
-      if (!timeInfo || !timeInfo.hasEndTime) return true;
+      const endTime = getEventEndTime(event);
+      if (!endTime) return true;
 
       const now = new Date();
-      const endTime = new Date(`${event.date}T${timeInfo.end}:00`);
       if (endTime > now) return true;
 
       const diffInMs = now - endTime;
@@ -301,9 +244,7 @@ class EventListManager {
     if (todayEvents.length > 0) {
       this.listContainer.appendChild(this._createSectionHeader('Сегодня', true));
       todayEvents.forEach(event => {
-        const timeInfo = event.text ? this._extractTimeFromText(event.text) : null;
-        const showTimeAgo = timeInfo && timeInfo.hasEndTime &&
-                           getTimeAgoText(event.date, timeInfo.end, timeInfo.start);
+        const showTimeAgo = hasEventEnded(event);
         this.listContainer.appendChild(this._createEventItem(event, showTimeAgo, true));
       });
     }
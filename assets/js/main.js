@@ -4,7 +4,7 @@
  */
 
 import { JSON_URL, SELECTORS, DEVICE_TODAY } from './constants.js';
-import { makeEventId, extractTimeFromText, getTimeAgoText } from './utils.js';
+import { makeEventId, hasEventEnded, loadEventIndex } from './utils.js';
 import { mapManager } from './map.js';
 import { eventListManager } from './event-list.js';
 import { searchManager } from './search.js';
@@ -69,13 +69,22 @@ async function loadEvents() {
   try {
     console.log('Loading events...');
 
-    const response = await fetch(JSON_URL);
+    // Prefer the lightweight index; post texts are loaded from shards on demand
+    const index = await loadEventIndex();
+    let events;
 
-    if (!response.ok) {
-      throw new Error(`HTTP ${response.status}: ${response.statusText}`);
-    }
+    if (index) {
+      // Until the shard is loaded, text holds only the event time (enough for labels and filtering)
+      events = index.map(entry => ({ ...entry, key: entry.id, id: makeEventId(entry), text: entry.time || '' }));
+    } else {
+      const response = await fetch(JSON_URL);
 
-    const events = await response.json();
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+      }
+
+      events = await response.json();
+    }
 
     if (!Array.isArray(events)) {
       throw new Error('Invalid events data format');
@@ -93,30 +102,16 @@ async function loadEvents() {
       if (event.date > DEVICE_TODAY) return true; // Future dates - always upcoming
       if (event.date < DEVICE_TODAY) return false; // Past dates - always archive
 
-      // For today's events, check time
-      if (!event.text) return true; // No text - upcoming
-
-      const timeInfo = extractTimeFromText(event.text);
-      if (!timeInfo || !timeInfo.hasEndTime) return true; // No end time - upcoming
-
-      // Check if event has ended
-      const timeAgoText = getTimeAgoText(event.date, timeInfo.end, timeInfo.start);
-      return !timeAgoText; // If has "ended" text, archive, else upcoming
+      // For today's events, check precomputed end time (no end time - upcoming)
+      return !hasEventEnded(event);
     });
 
     appState.archiveEvents = appState.allEvents.filter(event => {
       if (event.date > DEVICE_TODAY) return false; // Future dates - not archive
       if (event.date < DEVICE_TODAY) return true; // Past dates - always archive
 
-      // For today's events, check time
-      if (!event.text) return false; // No text - not archive
-
-      const timeInfo = extractTimeFromText(event.text);
-      if (!timeInfo || !timeInfo.hasEndTime) return false; // No end time - not archive
-
-      // Check if event has ended
-      const timeAgoText = getTimeAgoText(event.date, timeInfo.end, timeInfo.start);
-      return !!timeAgoText; // If has "ended" text, archive
+      // For today's events, check precomputed end time (no end time - not archive)
+      return hasEventEnded(event);
     });
 
     console.log(`Loaded ${appState.allEvents.length} events (${appState.upcomingEvents.length} upcoming, ${appState.archiveEvents.length} archive)`);
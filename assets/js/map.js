@@ -4,7 +4,7 @@
  */
 
 import { MAP_OPTIONS, CONTROLS, SELECTORS, CLASSES, DURATIONS } from './constants.js';
-import { debounce, bindKeyboardActivation, sanitizeHtml } from './utils.js';
+import { debounce, bindKeyboardActivation, sanitizeHtml, loadEventDetails } from './utils.js';
 import { getTheme } from './theme.js';
 
 /**
@@ -383,7 +383,8 @@ class MapManager {
         onclick="window.copyShareLink('${event.id}')"
       >Поделиться</button>`;
 
-    let postText = event.text || '';
+    // Index-only events carry just the time until their shard is loaded
+    let postText = event.shard && !event.detailsLoaded ? '' : (event.text || '');
     postText = postText.replace(/#[^\s#]+/g, '').trim();
     postText = postText.replace(/^.*\n/, '').trim();
 
@@ -418,7 +419,7 @@ class MapManager {
   _setupPopupHandlers(popup, event) {
     let expanded = false;
 
-    popup.on('open', () => {
+    const bindExpand = () => {
       const popupEl = popup.getElement();
       if (!popupEl) return;
 
@@ -426,6 +427,21 @@ class MapManager {
       if (expandBtn) {
         expandBtn.onclick = () => this._togglePopupText(popupEl);
       }
+    };
+
+    popup.on('open', () => {
+      bindExpand();
+
+      // Fetch the post text from the event's shard on first open
+      if (event.shard && !event.detailsLoaded) {
+        loadEventDetails(event)
+          .then(() => {
+            if (!popup.isOpen()) return;
+            popup.setHTML(this._createPopupContent(event));
+            bindExpand();
+          })
+          .catch(error => console.error('Failed to load event details:', error));
+      }
     });
 
     popup.on('close', () => {
@@ -4,7 +4,7 @@
  */
 
 import { SELECTORS, CLASSES, MESSAGES, DURATIONS, DEVICE_TODAY } from './constants.js';
-import { debounce, generateTransliterations, sanitizeHtml } from './utils.js';
+import { debounce, generateTransliterations, sanitizeHtml, loadSearchIndex, searchEventKeys } from './utils.js';
 import { mapManager } from './map.js';
 
 /**
@@ -112,6 +112,13 @@ class SearchManager {
    */
   setEvents(events) {
     this.allEvents = events;
+
+    // Prebuilt index replaces the linear scan once loaded
+    loadSearchIndex().then(index => {
+      if (index && this.isPanelOpen && this.searchInput?.value) {
+        this._renderResults(this.searchInput.value);
+      }
+    });
   }
 
   /**
@@ -250,16 +257,23 @@ class SearchManager {
         this.searchLabel.textContent = 'Подсказки';
       }
     } else {
-      // Search with transliteration
-      const searchVariants = Array.from(generateTransliterations(query));
-
-      matches = this.allEvents.filter(event => {
-        const eventText = `${event.title} ${event.location}`.toLowerCase();
-        return searchVariants.some(variant => {
-          const normalizedVariant = variant.trim().toLowerCase();
-          return eventText.includes(normalizedVariant);
+      const keys = searchEventKeys(query);
+
+      if (keys) {
+        // Prefix lookup in the ETL search index (transliteration variants included)
+        matches = this.allEvents.filter(event => keys.has(event.key));
+      } else {
+        // Search with transliteration
+        const searchVariants = Array.from(generateTransliterations(query));
+
+        matches = this.allEvents.filter(event => {
+          const eventText = `${event.title} ${event.location}`.toLowerCase();
+          return searchVariants.some(variant => {
+            const normalizedVariant = variant.trim().toLowerCase();
+            return eventText.includes(normalizedVariant);
+          });
         });
-      });
+      }
 
       if (this.searchLabel) {
         this.searchLabel.textContent = 'Результаты';
@@ -3,7 +3,7 @@
  * Shared utility functions used across modules
  */
 
-import { DEVICE_TODAY, MESSAGES } from './constants.js';
+import { DEVICE_TODAY, MESSAGES, INDEX_URL, SEARCH_INDEX_VERSION } from './constants.js';
 
 /**
  * Debounce function calls
@@ -19,6 +19,140 @@ export function debounce(fn, delay) {
   };
 }
 
+/**
+ * Partitioned events output: lightweight index and on-demand shards
+ */
+let eventIndex = null;
+const shardRequests = new Map();
+
+/**
+ * Load events index (data/index.json)
+ * @returns {Promise<Array|null>} Index entries or null if partitioned output is unavailable
+ */
+export async function loadEventIndex() {
+  try {
+    const response = await fetch(INDEX_URL);
+    if (!response.ok) return null;
+    eventIndex = await response.json();
+    return Array.isArray(eventIndex.events) ? eventIndex.events : null;
+  } catch (error) {
+    console.warn('Events index unavailable, falling back to events.json:', error);
+    return null;
+  }
+}
+
+/**
+ * Load full event record (post text) from its monthly shard
+ * @param {Object} event - Event built from an index entry (key, shard)
+ * @returns {Promise<Object>} The same event with text filled in
+ */
+export async function loadEventDetails(event) {
+  if (event.detailsLoaded || !event.shard || !eventIndex) return event;
+
+  const name = eventIndex.shards[event.shard];
+  if (!shardRequests.has(name)) {
+    const base = INDEX_URL.slice(0, INDEX_URL.lastIndexOf('/') + 1);
+    shardRequests.set(name, fetch(base + name).then(response => {
+      if (!response.ok) throw new Error(`HTTP ${response.status}`);
+      return response.json();
+    }).catch(error => {
+      shardRequests.delete(name);
+      throw error;
+    }));
+  }
+
+  const records = await shardRequests.get(name);
+  const record = records.find(item => item.id === event.key);
+  if (record) {
+    event.text = record.text;
+    event.detailsLoaded = true;
+  }
+  return event;
+}
+
+/**
+ * Search index built by the ETL (data/search.<hash>.json): sorted terms and
+ * delta-encoded postings (positions in index.json events)
+ */
+let searchIndex = null;
+let searchIndexRequest = null;
+
+/**
+ * Load search index referenced by data/index.json
+ * @returns {Promise<Object|null>} Decoded index or null if unavailable
+ */
+export function loadSearchIndex() {
+  if (!eventIndex?.search) return Promise.resolve(null);
+  if (!searchIndexRequest) {
+    const base = INDEX_URL.slice(0, INDEX_URL.lastIndexOf('/') + 1);
+    searchIndexRequest = fetch(base + eventIndex.search)
+      .then(response => {
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        return response.json();
+      })
+      .then(data => {
+        if (data.version !== SEARCH_INDEX_VERSION || data.count !== eventIndex.events.length) {
+          console.warn('Search index version mismatch, using linear search');
+          return null;
+        }
+        // Decode postings once: deltas → absolute positions
+        data.postings = data.postings.map(deltas => {
+          let doc = 0;
+          return deltas.map(delta => (doc += delta));
+        });
+        searchIndex = data;
+        return data;
+      })
+      .catch(error => {
+        console.warn('Search index unavailable, using linear search:', error);
+        return null;
+      });
+  }
+  return searchIndexRequest;
+}
+
+/**
+ * Split text into search tokens the same way as the ETL (search_tokens)
+ * @param {string} text - Query text
+ * @returns {Array<string>} Lowercase tokens
+ */
+export function searchTokens(text) {
+  return (text || '').toLowerCase().replace(/ё/g, 'е').match(/[0-9a-zа-я]+/g) || [];
+}
+
+/**
+ * Find events whose terms start with every query token (prefix search)
+ * @param {string} query - Search query
+ * @returns {Set<string>|null} Event keys (index.json ids) or null if the index is not loaded
+ */
+export function searchEventKeys(query) {
+  if (!searchIndex) return null;
+
+  const { terms, postings } = searchIndex;
+  let result = null;
+
+  for (const token of searchTokens(query)) {
+    // Binary search for the first term >= token, then walk the prefix range
+    let lo = 0;
+    let hi = terms.length;
+    while (lo < hi) {
+      const mid = (lo + hi) >> 1;
+      if (terms[mid] < token) lo = mid + 1; else hi = mid;
+    }
+
+    const docs = new Set();
+    for (let i = lo; i < terms.length && terms[i].startsWith(token); i += 1) {
+      postings[i].forEach(doc => docs.add(doc));
+    }
+
+    result = result ? new Set([...result].filter(doc => docs.has(doc))) : docs;
+    if (!result.size) break;
+  }
+
+  if (!result) return null;
+  return new Set([...result].map(doc => eventIndex.events[doc].id));
+}
+
 /**
  * Geocode cache for coordinates
  */
@@ -281,6 +415,40 @@ export function getTimeAgoText(eventDateStr, endTimeStr, startTimeStr) {
   return `Закончилось ${hours} часов назад`;
 }
 
+/**
+ * Get event end time
+ * Uses the ISO `end` precomputed by the ETL when present, otherwise parses the time from text
+ * @param {Object} event - Event with date and either end or text
+ * @returns {Date|null} End time or null if unknown
+ */
+export function getEventEndTime(event) {
+  if (event.end) return new Date(event.end);
+
+  const timeInfo = event.text ? extractTimeFromText(event.text) : null;
+  if (!timeInfo || !timeInfo.hasEndTime || !event.date) return null;
+
+  let endDateStr = event.date;
+  if (parseInt(timeInfo.end.split(':')[0]) < parseInt(timeInfo.start.split(':')[0])) {
+    // Event ends next day
+    const date = new Date(event.date);
+    date.setDate(date.getDate() + 1);
+    endDateStr = date.toISOString().slice(0, 10);
+  }
+
+  return new Date(`${endDateStr}T${timeInfo.end}:00`);
+}
+
+/**
+ * Check whether event has already ended
+ * @param {Object} event - Event object
+ * @param {Date} now - Current time
+ * @returns {boolean} True if event end is known and has passed
+ */
+export function hasEventEnded(event, now = new Date()) {
+  const endTime = getEventEndTime(event);
+  return !!endTime && endTime <= now;
+}
+
 /**
  * Generate transliterations for search
  * @param {string} text - Text to transliterate
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пакетного геокодинга geocode_many() против каскада geocode_all()
+Запуск: python benchmarks/bench_batch_geocode.py [--addresses 300] [--delay 0.05] [--chunk 100]
+
+Локальный «ArcGIS» отвечает на одиночные запросы (GET) и на geocodeAddresses
+(POST) с задержкой --latency, пачка — дополнительно --per-address секунд
+на адрес. Одиночный провайдер ограничен token bucket с паузой --delay, как
+ARCGIS_MIN_DELAY; пакетный делит с ним тот же bucket. Доля --unmatched
+адресов пачкой не находится и уходит в каскад. Выводятся время, число
+HTTP-запросов и совпадение результатов двух прогонов.
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+import fetch_events
+from fetch_events import (CircuitBreakers, GeocodeStore, RunMetrics, TokenBucket, close_session,
+                          geocode_all, geocode_many, rate_limited)
+
+Location = namedtuple("Location", "latitude longitude")
+
+
+def point(addr: str) -> list:
+    """Детерминированная точка в области для адреса."""
+    n = int(addr.rsplit(" ", 1)[-1])
+    return [54.6 + n % 100 / 1000, 20.4 + n // 100 / 1000]
+
+
+def start_provider(latency: float, per_address: float, unmatched: int, requests: list):
+    """Сервер: GET — один адрес, POST — пачка в формате geocodeAddresses; вернуть его."""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def reply(self, data):
+            body = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            requests.append(1)
+            time.sleep(latency)
+            addr = parse_qs(self.path.split("?", 1)[1])["q"][0]
+            self.reply({"lat": point(addr)[0], "lon": point(addr)[1]})
+
+        def do_POST(self):
+            requests.append(1)
+            form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+            records = [r["attributes"] for r in json.loads(form["addresses"][0])["records"]]
+            time.sleep(latency + per_address * len(records))
+            locations = []
+            for r in records:
+                y, x = point(r["SingleLine"])
+                matched = int(r["SingleLine"].rsplit(" ", 1)[-1]) % 100 >= unmatched
+                locations.append({"location": {"x": x, "y": y}, "score": 100 if matched else 0,
+                                  "attributes": {"ResultID": r["OBJECTID"], "Status": "M" if matched else "U"}})
+            self.reply({"locations": locations})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(func, addresses: list, url: str, delay: float, tmp: Path, **kwargs) -> tuple:
+    """Геокодировать addresses с пустым кэшем; вернуть (время, результат)."""
+    def single(addr):
+        data = fetch_events.get_session().get(url, params={"q": addr}, timeout=10).json()
+        return Location(data["lat"], data["lon"])
+
+    bucket = TokenBucket.from_delay(delay)
+    fetch_events.GEOCODERS = [{"name": "ArcGIS", "func": rate_limited(single, bucket)}]
+    fetch_events.BATCH_GEOCODERS = None
+    fetch_events.geocache = GeocodeStore(tmp / f"{func.__name__}.json")
+    fetch_events.geolog = {}
+    fetch_events.breakers = CircuitBreakers()
+    fetch_events.metrics = RunMetrics()
+
+    start = time.perf_counter()
+    result = func(addresses, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--addresses", type=int, default=300)
+    parser.add_argument("--delay", type=float, default=0.05, help="пауза token bucket провайдера, с")
+    parser.add_argument("--latency", type=float, default=0.01, help="время ответа провайдера, с")
+    parser.add_argument("--per-address", type=float, default=0.0005, help="цена адреса в пачке, с")
+    parser.add_argument("--unmatched", type=int, default=10, help="процент адресов, не найденных пачкой")
+    parser.add_argument("--chunk", type=int, default=fetch_events.GEOCODE_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=fetch_events.GEOCODE_WORKERS)
+    args = parser.parse_args()
+
+    fetch_events.logger.disabled = True
+    requests = []
+    server = start_provider(args.latency, args.per_address, args.unmatched, requests)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    fetch_events.ARCGIS_TOKEN = "bench"
+    fetch_events.ARCGIS_BATCH_URL = f"{base}/geocodeAddresses"
+    fetch_events.gazetteer = None
+    fetch_events.provider_stats = None
+    addresses = [f"ул. Мира {i}" for i in range(args.addresses)]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for func, kwargs in ((geocode_all, {"workers": args.workers}),
+                             (geocode_many, {"workers": args.workers, "chunk_size": args.chunk})):
+            requests.clear()
+            elapsed, results[func.__name__] = run(func, addresses, f"{base}/find", args.delay, Path(tmp), **kwargs)
+            print(f"{func.__name__:<12}: {elapsed:6.2f} с, {args.addresses / elapsed:7.0f} адресов/с, "
+                  f"HTTP-запросов {len(requests)}")
+    close_session()
+    server.shutdown()
+    server.server_close()
+
+    same = results["geocode_all"] == results["geocode_many"]
+    print(f"Результаты {'совпадают' if same else 'РАЗЛИЧАЮТСЯ'}")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
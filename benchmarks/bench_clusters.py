@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк кластеризации маркеров cluster_points()
+Запуск: python benchmarks/bench_clusters.py [--points 10000 30000 100000]
+
+Точки — смесь нормальных «пятен» вокруг Калининграда и области плюс
+равномерный фон по REGION_BBOX фронтенда. Для каждого размера выводится
+время построения всех уровней CLUSTER_MIN_ZOOM…CLUSTER_MAX_ZOOM, скорость
+и число объектов на нескольких уровнях; сумма весов на каждом уровне
+сверяется с числом точек.
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+import fetch_events
+from fetch_events import cluster_points
+
+BBOX = (19.30, 54.00, 23.10, 55.60)  # REGION_BBOX из assets/js/constants.js
+CENTERS = [(20.51, 54.71, 0.04), (20.15, 54.95, 0.02), (21.53, 54.63, 0.02), (20.48, 54.96, 0.01)]
+
+
+def make_points(n: int, seed: int = 0) -> list:
+    """n точек: 90% — вокруг городов, 10% — равномерный фон."""
+    rng = random.Random(seed)
+    points = []
+    for i in range(n):
+        if rng.random() < 0.9:
+            lon, lat, sigma = rng.choice(CENTERS)
+            points.append((rng.gauss(lon, sigma), rng.gauss(lat, sigma / 1.7), i))
+        else:
+            points.append((rng.uniform(BBOX[0], BBOX[2]), rng.uniform(BBOX[1], BBOX[3]), i))
+    return points
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--points", type=int, nargs="+", default=[10_000, 30_000, 100_000])
+    args = parser.parse_args()
+
+    zooms = (fetch_events.CLUSTER_MIN_ZOOM, 10, 13, fetch_events.CLUSTER_MAX_ZOOM)
+    ok = True
+    print(f"Уровни {fetch_events.CLUSTER_MIN_ZOOM}…{fetch_events.CLUSTER_MAX_ZOOM}, "
+          f"радиус {fetch_events.CLUSTER_RADIUS:g} px")
+    for n in args.points:
+        points = make_points(n)
+        start = time.perf_counter()
+        levels = cluster_points(points)
+        elapsed = time.perf_counter() - start
+        conserved = all(sum(item[2] for item in level) == n for level in levels.values())
+        ok &= conserved
+        sizes = ", ".join(f"z{z}={len(levels[z])}" for z in zooms if z in levels)
+        print(f"{n:>7} точек: {elapsed:7.3f} с ({n / elapsed:9.0f} точек/с)  {sizes}"
+              f"{'' if conserved else '  ВЕСА НЕ СХОДЯТСЯ'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк полного прогона main(): VK → extract → геокодинг → запись
+Запуск без сети:  python benchmarks/bench_etl.py [--copies 5] [--vk-latency 0.05]
+Запись кассеты:   VK_TOKEN=... python benchmarks/bench_etl.py --record cassette/
+
+По умолчанию кассета синтезируется из events.json и geocode_cache.json.
+Каждый сценарий запускается во временной директории: cold — пустые кэш и
+events.json, warm — повторный запуск поверх результата cold. Для каждого
+выводится общее время, время по стадиям, пик памяти и число сетевых вызовов.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).parent))
+
+import fetch_events
+from replay import (
+    Cassette, Network, ReplaySession, replay_provider, RecordingSession, recording_provider,
+)
+
+STAGES = {
+    "vk": "vk_request",
+    "extract": "extract",
+    "geocode": "geocode_many",
+    "cache_write": "save_cache",
+    "state_write": "save_state",
+    "events_write": "publish_events",
+}
+
+
+class StageTimer:
+    """Суммарное время по стадиям; стадии подменяют функции модуля fetch_events."""
+
+    def __init__(self):
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+
+    def wrap(self, stage: str, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return wrapper
+
+
+def run_once(workdir: Path, cassette: Cassette, args) -> dict:
+    """Один прогон main() в workdir с воспроизведением кассеты."""
+    timer = StageTimer()
+    vk_net = Network(args.vk_latency, args.error_rate, args.vk_rps, seed=1)
+    geo_net = Network(args.geo_latency, args.error_rate, 0, seed=2)
+    posts = sum(len(p) for p in cassette.vk.values())
+
+    originals = {name: getattr(fetch_events, name) for name in
+                 list(STAGES.values()) + ["session", "GEOCODERS", "TOKEN", "MAX_POSTS",
+                                          "WAIT_REQ", "GEOCODE_ERROR_WAIT", "GEOCODE_HEDGE"]}
+    try:
+        for stage, name in STAGES.items():
+            setattr(fetch_events, name, timer.wrap(stage, originals[name]))
+        fetch_events.session = ReplaySession(cassette, vk_net)
+        fetch_events.GEOCODERS = [
+            {"name": name, "func": fetch_events.rate_limited(
+                replay_provider(name, cassette, geo_net), fetch_events.TokenBucket.from_delay(args.geo_delay), name)}
+            for name in ("ArcGIS", "Yandex", "Nominatim")
+        ]
+        fetch_events.TOKEN = "replay"
+        fetch_events.MAX_POSTS = posts
+        fetch_events.WAIT_REQ = args.vk_wait
+        fetch_events.GEOCODE_ERROR_WAIT = 0.0
+        fetch_events.GEOCODE_HEDGE = args.hedge
+
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            fetch_events.main()
+        except SystemExit as e:
+            if e.code:
+                raise RuntimeError(f"main() завершился с кодом {e.code}")
+        finally:
+            total = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            os.chdir(cwd)
+    finally:
+        for name, value in originals.items():
+            setattr(fetch_events, name, value)
+
+    stages = dict(timer.totals)
+    stages["other"] = max(0.0, total - sum(stages.values()))
+    return {
+        "total_s": total,
+        "stages_s": stages,
+        "peak_mem_mb": peak / 2 ** 20,
+        "network_calls": {**vk_net.calls, **geo_net.calls},
+        "metrics": fetch_events.metrics.summary(),
+        "events": len(json.loads((workdir / "events.json").read_text(encoding="utf-8")))
+        if (workdir / "events.json").exists() else 0,
+    }
+
+
+def record(out: Path) -> None:
+    """Прогнать main() с настоящей сетью и сохранить ответы в кассету."""
+    cassette = Cassette()
+    fetch_events.session = RecordingSession(fetch_events.get_session(), cassette)
+    fetch_events.GEOCODERS = [
+        {"name": p["name"], "func": recording_provider(p["name"], p["func"], cassette) if p["func"] else None}
+        for p in fetch_events.get_geocoders()
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            fetch_events.main()
+        finally:
+            os.chdir(cwd)
+    cassette.save(out)
+    print(f"Кассета сохранена в {out}: {sum(len(p) for p in cassette.vk.values())} постов, "
+          f"{sum(len(a) for a in cassette.geocode.values())} ответов геокодеров")
+
+
+def print_report(name: str, result: dict) -> None:
+    print(f"\n[{name}] {result['total_s']:.3f} с, пик памяти {result['peak_mem_mb']:.1f} МБ, "
+          f"событий {result['events']}")
+    for stage, seconds in sorted(result["stages_s"].items(), key=lambda kv: -kv[1]):
+        print(f"  {stage:13} {seconds:8.3f} с")
+    calls = ", ".join(f"{k}={v}" for k, v in sorted(result["network_calls"].items())) or "нет"
+    print(f"  сетевые вызовы: {calls}")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Регрессии относительно сохранённого результата: рост времени или числа вызовов."""
+    problems = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["total_s"] > base["total_s"] * (1 + tolerance):
+            problems.append(f"{name}: {result['total_s']:.3f} с против {base['total_s']:.3f} с")
+        for call, count in result["network_calls"].items():
+            if count > base["network_calls"].get(call, 0):
+                problems.append(f"{name}: {call}={count}, было {base['network_calls'].get(call, 0)}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк ETL с записью/воспроизведением сети")
+    parser.add_argument("--record", type=Path, help="записать кассету с настоящей сетью в директорию")
+    parser.add_argument("--cassette", type=Path, help="директория кассеты (по умолчанию — синтез из репозитория)")
+    parser.add_argument("--copies", type=int, default=1, help="размножить синтетические посты")
+    parser.add_argument("--vk-latency", type=float, default=0.0, help="задержка ответа VK, с")
+    parser.add_argument("--geo-latency", type=float, default=0.0, help="задержка ответа геокодера, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля сетевых ошибок")
+    parser.add_argument("--vk-rps", type=float, default=0.0, help="лимит VK запросов/с (0 — без лимита)")
+    parser.add_argument("--vk-wait", type=float, default=0.0, help="WAIT_REQ между страницами, с")
+    parser.add_argument("--geo-delay", type=float, default=0.0, help="min_delay провайдера, с")
+    parser.add_argument("--hedge", action="store_true", help="хеджированный геокодинг (GEOCODE_HEDGE=1)")
+    parser.add_argument("--json", type=Path, help="сохранить результат в JSON")
+    parser.add_argument("--baseline", type=Path, help="сравнить с ранее сохранённым --json")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="допустимый рост времени")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record)
+        return 0
+
+    fetch_events.logger.disabled = True
+    if args.cassette:
+        cassette = Cassette.load(args.cassette)
+    else:
+        events = json.loads((ROOT / "events.json").read_text(encoding="utf-8"))
+        cache = json.loads((ROOT / "geocode_cache.json").read_text(encoding="utf-8"))
+        cassette = Cassette.synthesize(events, cache, fetch_events.DOMAIN, args.copies)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        results["cold"] = run_once(Path(tmp), cassette, args)
+        results["warm"] = run_once(Path(tmp), cassette, args)
+    for name, result in results.items():
+        print_report(name, result)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.baseline:
+        problems = compare(results, json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+        for problem in problems:
+            print(f"РЕГРЕССИЯ {problem}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк извлечения начала, конца и возраста событий event_details()
+Запуск: python benchmarks/bench_event_times.py [--repeat 100]
+
+Корпус — тексты постов из events.json, размноженные --repeat раз. Время
+публикации каждого поста — за неделю до даты события, так что год,
+выбранный extract() по дате поста, должен совпасть с годом в events.json.
+Выводятся скорость extract() и event_details() (он вызывается при записи
+события в хранилище, а не в extract), покрытие полей по корпусу и число
+нарушений инвариантов (start ≤ дата ≤ end, конец не раньше начала, год по
+дате поста).
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+import fetch_events
+from fetch_events import EVENT_TZ, event_details, extract
+
+
+def posted_before(date: str, days: int = 7) -> int:
+    """Unix-время публикации за days дней до даты события."""
+    day = datetime.strptime(date, "%Y-%m-%d").replace(hour=12, tzinfo=EVENT_TZ)
+    return int((day - timedelta(days=days)).timestamp())
+
+
+def timed(func, items):
+    start = time.perf_counter()
+    result = [func(*item) for item in items]
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=100, help="сколько раз размножить корпус")
+    args = parser.parse_args()
+
+    fetch_events.logger.disabled = True
+    events = [e for e in json.loads((ROOT / "events.json").read_text(encoding="utf-8")) if e.get("text")]
+    posts = [(e["text"], None, posted_before(e["date"])) for e in events]
+
+    results, extract_time = timed(extract, posts * args.repeat)
+    _, details_time = timed(event_details, [(e["date"], e["text"]) for e in events] * args.repeat)
+    n = len(posts) * args.repeat
+
+    errors, stats = [], dict.fromkeys(("время", "конец по времени", "несколько дней", "до утра", "возраст"), 0)
+    for event, result in zip(events, results):
+        if result is None or result["date"] != event["date"]:
+            errors.append(f"год по дате поста: {event['date']} → {result and result['date']}")
+            continue
+        details = event_details(result["date"], result["text"])
+        start, end = details["start"], details["end"]
+        if not (start[:10] <= result["date"] <= end[:10] and start <= end):
+            errors.append(f"{result['date']}: {start} … {end}")
+        stats["время"] += start[11:16] != "00:00"
+        stats["конец по времени"] += end[11:19] != "23:59:59"
+        stats["несколько дней"] += start[:10] < end[:10] and end[11:19] == "23:59:59"
+        stats["до утра"] += start[:10] < end[:10] and end[11:19] != "23:59:59"
+        stats["возраст"] += details["age"] is not None
+
+    print(f"Постов: {n} ({len(posts)} уникальных × {args.repeat})")
+    print(f"extract       : {n / extract_time:10.0f} постов/с  ({extract_time:.3f} с)")
+    print(f"event_details : {n / details_time:10.0f} постов/с  ({details_time:.3f} с)")
+    print("Покрытие: " + ", ".join(f"{name} {count}/{len(events)}" for name, count in stats.items()))
+    print(f"Нарушений инвариантов: {len(errors)}")
+    for error in errors[:5]:
+        print(f"  {error}")
+    return 0 if not errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
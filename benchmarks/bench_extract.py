@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк extract(): скорость и совпадение с эталонной реализацией
+Запуск: python benchmarks/bench_extract.py [--repeat 600]
+
+Корпус — тексты постов из events.json, размноженные --repeat раз
+(600 повторов ≈ 10^5 постов). Эталон — прежний extract(), который
+компилировал паттерны на каждом вызове и проходил текст несколько раз.
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+import fetch_events
+from fetch_events import extract, extract_many, CITY_WORDS
+
+
+def reference_extract(text: str):
+    """Прежняя реализация extract() — эталон для проверки совпадения."""
+    if not text:
+        return None
+
+    date_match = None
+    for pattern in [r"\b(\d{2})\.(\d{2})\b", r"\b(\d{2})/(\d{2})\b", r"\b(\d{1,2})\.(\d{1,2})\b"]:
+        date_match = re.search(pattern, text)
+        if date_match:
+            break
+
+    loc_match = None
+    for pattern in [r"📍\s*(.+)", r"📍\s*([^📍\n]+)", r"место[:\s]*(.+)", r"адрес[:\s]*(.+)"]:
+        loc_match = re.search(pattern, text, re.I)
+        if loc_match:
+            break
+
+    if not (date_match and loc_match):
+        return None
+
+    date = f"{fetch_events.YEAR_DEFAULT}-{date_match.group(2).zfill(2)}-{date_match.group(1).zfill(2)}"
+    loc = loc_match.group(1).split('➡️')[0].split('\n')[0].strip()
+    if not re.search(CITY_WORDS, loc, re.I):
+        loc += ", Калининград"
+
+    lines = text.split('\n')
+    title = ""
+    for line in lines:
+        if re.search(r"\b\d{1,2}[./]\d{1,2}\b", line):
+            title = re.sub(r"^\s*\d{1,2}[./]\d{1,2}\s*\|\s*", "", line).strip()
+            break
+    if not title:
+        title = lines[0].strip() if lines else "Событие"
+
+    return {'title': title, 'date': date, 'location': loc, 'text': text}
+
+
+def mutations(texts, count, seed=0):
+    """Случайные перестановки строк и фрагментов — ловят расхождения на краях паттернов."""
+    rng = random.Random(seed)
+    pieces = ["01.12", "1.2", "12/05", "1/12", "1.12.05", "📍", "📍 ", "место:", "Адрес",
+              "МЕСТО", "\n", " | ", "➡️", "г.", "Светлогорск", "123.45", "7.7.7", ""]
+    for _ in range(count):
+        lines = rng.choice(texts).split('\n')
+        rng.shuffle(lines)
+        for _ in range(rng.randint(0, 4)):
+            pos = rng.randint(0, len(lines))
+            lines.insert(pos, rng.choice(pieces) + rng.choice(pieces))
+        yield '\n'.join(lines)
+
+
+def timed(func, texts):
+    start = time.perf_counter()
+    result = func(texts)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=100, help="сколько раз размножить корпус")
+    parser.add_argument("--fuzz", type=int, default=20000, help="число случайных вариантов для сверки")
+    args = parser.parse_args()
+
+    events = json.loads((ROOT / "events.json").read_text(encoding="utf-8"))
+    corpus = [e["text"] for e in events if e.get("text")]
+    texts = corpus * args.repeat
+
+    fetch_events.logger.disabled = True
+    mismatches = [t for t in list(mutations(corpus, args.fuzz)) + corpus if extract(t) != reference_extract(t)]
+
+    ref, ref_time = timed(lambda ts: [reference_extract(t) for t in ts], texts)
+    new, new_time = timed(extract_many, texts)
+    identical = ref == new and not mismatches
+
+    print(f"Постов: {len(texts)} ({len(corpus)} уникальных × {args.repeat}), сверка на {args.fuzz} вариантах")
+    print(f"reference : {len(texts) / ref_time:10.0f} постов/с  ({ref_time:.3f} с)")
+    print(f"extract   : {len(texts) / new_time:10.0f} постов/с  ({new_time:.3f} с)  ×{ref_time / new_time:.2f}")
+    print(f"Результат идентичен: {'да' if identical else 'НЕТ'}")
+    for text in mismatches[:5]:
+        print(f"  расхождение: {text[:120]!r}")
+    return 0 if identical else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
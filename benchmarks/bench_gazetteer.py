@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк локального газеттира: построение, загрузка индекса и задержка поиска
+Запуск: python benchmarks/bench_gazetteer.py [--osm-streets 500 --houses 100]
+
+Индекс строится из синтетической выгрузки OSM (улицы × номера домов в
+формате GeoJSON Lines) плюс адресов events.json. Запросы — варианты
+написания известных адресов: сокращения, регистр, опечатка, лишнее слово.
+Выводятся время построения, размер и время загрузки сериализованного
+индекса, медиана и p99 задержки поиска и доля правильно найденных адресов.
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+import fetch_events
+from fetch_events import Gazetteer
+
+SYLLABLES = ["ка", "ли", "нин", "гра", "дс", "кая", "бал", "тий", "ска", "мор", "ская", "лес", "на", "я", "ов", "ая"]
+
+
+def synthetic_osm(path: Path, streets: int, houses: int, seed: int = 0) -> list:
+    """Записать выгрузку OSM: streets улиц по houses домов; вернуть [(адрес, lat, lon)]."""
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < streets:
+        names.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize())
+    known = []
+    with open(path, "w", encoding="utf-8") as f:
+        for name in sorted(names):
+            lat, lon = rng.uniform(54.6, 54.8), rng.uniform(20.3, 20.6)
+            for house in range(1, houses + 1):
+                number = f"{house}{rng.choice(['', '', '', 'а', 'б'])}"
+                point = (lat + house * 1e-4, lon + house * 1e-4)
+                props = {"addr:street": f"улица {name}", "addr:housenumber": number}
+                feature = {"type": "Feature", "geometry": {"type": "Point", "coordinates": [point[1], point[0]]},
+                           "properties": props}
+                f.write(json.dumps(feature, ensure_ascii=False) + "\n")
+                known.append((f"{name} {number}", *point))
+    return known
+
+
+def variant(addr: str, rng: random.Random) -> str:
+    """Другое написание того же адреса."""
+    choice = rng.randrange(4)
+    if choice == 0:
+        return "ул. " + addr
+    if choice == 1:
+        return addr.upper() + ", Калининград"
+    if choice == 2:
+        words = addr.split()
+        i = max(range(len(words)), key=lambda k: len(words[k]))
+        w = words[i]
+        if len(w) > 5:
+            pos = rng.randrange(1, len(w) - 1)
+            words[i] = w[:pos] + w[pos + 1:]  # опечатка: пропущенная буква
+        return " ".join(words)
+    return addr.replace(" ", ", ", 1) if "," not in addr else addr
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--osm-streets", type=int, default=500)
+    parser.add_argument("--houses", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=5000)
+    args = parser.parse_args()
+
+    fetch_events.logger.disabled = True
+    rng = random.Random(1)
+    events = json.loads((ROOT / "events.json").read_text(encoding="utf-8"))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        osm = Path(tmp) / "kaliningrad.geojsonl"
+        known = synthetic_osm(osm, args.osm_streets, args.houses)
+
+        start = time.perf_counter()
+        gaz = Gazetteer.from_osm(osm)
+        for e in events:
+            gaz.add(e["location"], e["lat"], e["lon"])
+        build = time.perf_counter() - start
+
+        index = Path(tmp) / "gazetteer.pickle"
+        gaz.save(index, "bench")
+        start = time.perf_counter()
+        loaded = Gazetteer.load(index, "bench")
+        load = time.perf_counter() - start
+        size = index.stat().st_size
+
+    targets = known + [(e["location"], e["lat"], e["lon"]) for e in events]
+    queries = [(variant(a, rng), lat, lon) for a, lat, lon in rng.choices(targets, k=args.queries)]
+    times, fuzzy, correct, confident = [], [], 0, 0
+    for query, lat, lon in queries:
+        start = time.perf_counter()
+        found = loaded.match(query)
+        times.append(time.perf_counter() - start)
+        if fetch_events.canonical_address(query) not in loaded.keys:
+            fuzzy.append(times[-1])
+        if found and found[1] >= fetch_events.GAZETTEER_MIN_CONFIDENCE:
+            confident += 1
+            correct += abs(found[0][0] - lat) < 1e-6 and abs(found[0][1] - lon) < 1e-6
+
+    times.sort()
+    p50, p99 = statistics.median(times), times[int(len(times) * 0.99)]
+    print(f"Адресов в индексе: {len(loaded)}; построение {build:.2f} с; "
+          f"индекс {size / 2 ** 20:.1f} МБ, загрузка {load:.3f} с")
+    print(f"Поиск: медиана {p50 * 1e3:.3f} мс, p99 {p99 * 1e3:.3f} мс на {len(queries)} запросах")
+    if fuzzy:
+        print(f"  нечёткие ({len(fuzzy)}): медиана {statistics.median(fuzzy) * 1e3:.3f} мс")
+    print(f"Уверенных ответов: {confident / len(queries):.1%}, из них верных: {correct / max(confident, 1):.1%}")
+    return 0 if p50 < 1e-3 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк архива постов и повторного разбора extract_archive()
+Запуск: python benchmarks/bench_reprocess.py [--posts 100000] [--workers 1 4]
+
+Архив синтезируется из текстов events.json (с новыми id) плюс доля постов
+без события. Выводятся время записи и размер архива (JSON Lines и gzip),
+затем для каждого числа процессов — время разбора, скорость и пик памяти
+вызывающего процесса (tracemalloc); результаты разных прогонов сверяются.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+import fetch_events
+from fetch_events import PostArchive, extract_archive
+
+
+def write_archive(path: Path, texts: list, n: int, seed: int = 0) -> float:
+    """Записать n постов в архив; вернуть время записи."""
+    rng = random.Random(seed)
+    archive = PostArchive(path)
+    archive._digests = {}  # новый архив: не читать несуществующий файл
+    start = time.perf_counter()
+    for i in range(n):
+        text = rng.choice(texts) if rng.random() < 0.8 else f"Пост без события №{i}"
+        archive.add(fetch_events.DOMAIN, {"id": i + 1, "date": 1_700_000_000 + i, "text": text,
+                                          "likes": {"count": rng.randint(0, 50)}})
+        if (i + 1) % 10_000 == 0:
+            archive.flush()
+    archive.flush()
+    return time.perf_counter() - start
+
+
+def run(path: Path, workers: int, chunk: int) -> tuple:
+    """Разобрать архив; вернуть (время, пик памяти МБ, число событий, контрольная сумма)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    found, digest = 0, 0
+    for key, event in extract_archive(PostArchive(path), fetch_events.vk_domains(), workers, chunk):
+        if event:
+            found += 1
+            digest = (digest * 31 + hash((key, event["date"], event["title"], event["location"]))) % (1 << 61)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20, found, digest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--posts", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--chunk", type=int, default=fetch_events.REPROCESS_CHUNK)
+    args = parser.parse_args()
+
+    fetch_events.logger.disabled = True
+    events = json.loads((ROOT / "events.json").read_text(encoding="utf-8"))
+    texts = [e["text"] for e in events if e.get("text")]
+
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ("posts_archive.jsonl", "posts_archive.jsonl.gz"):
+            path = Path(tmp) / name
+            written = write_archive(path, texts, args.posts)
+            print(f"{name}: {args.posts} постов, запись {written:.2f} с, {path.stat().st_size / 2 ** 20:.1f} МБ")
+            results = set()
+            for workers in dict.fromkeys(args.workers):
+                elapsed, peak, found, digest = run(path, workers, args.chunk)
+                results.add((found, digest))
+                print(f"  процессов {workers:>2}: {elapsed:6.2f} с ({args.posts / elapsed:8.0f} постов/с), "
+                      f"событий {found}, пик памяти {peak:.1f} МБ")
+            if len(results) > 1:
+                print("  РЕЗУЛЬТАТЫ РАЗЛИЧАЮТСЯ")
+                ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк поискового индекса build_search_index()
+Запуск: python benchmarks/bench_search.py [--events 168 1000 10000]
+
+События — копии events.json с изменёнными заголовками и датами, чтобы
+словарь рос вместе с корпусом. Для каждого размера выводятся время
+построения, число термов, размер индекса (JSON и gzip) относительно
+events.json того же корпуса и задержка поиска search_lookup() по
+префиксам слов из заголовков, в том числе латиницей.
+"""
+
+import argparse
+import gzip
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+from fetch_events import TRANSLIT, build_search_index, compact_json, search_lookup, search_tokens
+
+SUFFIXES = ["фест", "лаб", "тур", "клуб", "марафон", "вечер", "шоу", "квиз", "маркет", "open"]
+
+
+def make_events(base: list, n: int, seed: int = 0) -> list:
+    """n событий: копии base с новыми словами в заголовке."""
+    rng = random.Random(seed)
+    events = []
+    for i in range(n):
+        e = base[i % len(base)]
+        title = f"{e['title']} {rng.choice(SUFFIXES)}{i // len(base) or ''}"
+        events.append(dict(e, title=title, date=f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}"))
+    return events
+
+
+def queries(events: list, n: int, seed: int = 1) -> list:
+    """Префиксы слов заголовков; каждый третий запрос — латиницей."""
+    rng = random.Random(seed)
+    result = []
+    for _ in range(n):
+        words = [w for w in search_tokens(rng.choice(events)["title"]) if len(w) > 2] or ["концерт"]
+        word = rng.choice(words)
+        prefix = word[:rng.randint(2, len(word))]
+        result.append(prefix.translate(TRANSLIT) if rng.random() < 0.33 else prefix)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, nargs="+", default=[168, 1_000, 10_000])
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    base = json.loads((ROOT / "events.json").read_text(encoding="utf-8"))
+    ok = True
+    for n in args.events:
+        events = make_events(base, n)
+        start = time.perf_counter()
+        index = build_search_index(events)
+        build = time.perf_counter() - start
+        data = compact_json(index)
+        corpus = compact_json(events)
+
+        times, hits = [], 0
+        for q in queries(events, args.queries):
+            start = time.perf_counter()
+            hits += bool(search_lookup(index, q))
+            times.append(time.perf_counter() - start)
+        times.sort()
+        p50, p99 = statistics.median(times), times[int(len(times) * 0.99)]
+        ok &= hits == len(times)
+        print(f"{n:>6} событий: построение {build:6.3f} с, термов {len(index['terms']):>6}, "
+              f"индекс {len(data) / 1024:7.0f} КБ (gzip {len(gzip.compress(data)) / 1024:5.0f} КБ, "
+              f"{len(data) / len(corpus):.0%} от events.json); поиск медиана {p50 * 1e3:.3f} мс, "
+              f"p99 {p99 * 1e3:.3f} мс, найдено {hits}/{len(times)}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
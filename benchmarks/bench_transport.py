@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк HTTP-транспорта геокодеров: собственные адаптеры geopy против общей сессии
+Запуск: python benchmarks/bench_transport.py [--calls 300] [--workers 4] [--handshake 0.05]
+
+Три локальных «провайдера» (по серверу на каждого, как ArcGIS, Yandex и
+Nominatim) отвечают с задержкой --latency; каждое новое соединение стоит
+--handshake секунд (имитация TCP + TLS до удалённого хоста). Вызовы geocode()
+идут из --workers потоков по кругу по провайдерам: клиентами geopy с
+URLLibAdapter (соединение на запрос — так geopy работает без requests), с
+RequestsAdapter по умолчанию (свой пул у каждого клиента) и через
+shared_geopy_adapter(). Выводятся время, медиана и p95 вызова и число
+принятых серверами соединений.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+import fetch_events
+from fetch_events import RunMetrics, close_session, shared_geopy_adapter, transport_summary
+
+
+def start_provider(latency: float, handshake: float, accepted: list):
+    """Сервер в стиле Nominatim /search; вернуть его."""
+    body = json.dumps([{"lat": "54.7", "lon": "20.5", "display_name": "X", "place_id": 1}]).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # иначе заголовки и тело ждут отложенного ACK (~40 мс)
+
+        def setup(self):
+            super().setup()
+            accepted.append(1)
+            time.sleep(handshake)
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(geocoders: list, calls: int, workers: int) -> tuple:
+    """Сделать calls вызовов по кругу по провайдерам; вернуть (время, задержки вызовов)."""
+    def call(i):
+        start = time.perf_counter()
+        geocoders[i % len(geocoders)].geocode(f"ул. Мира {i}")
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = sorted(pool.map(call, range(calls)))
+    return time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=fetch_events.GEOCODE_WORKERS)
+    parser.add_argument("--latency", type=float, default=0.01, help="время ответа провайдера, с")
+    parser.add_argument("--handshake", type=float, default=0.05, help="цена нового соединения, с")
+    args = parser.parse_args()
+
+    from geopy.adapters import URLLibAdapter
+    from geopy.geocoders import Nominatim
+
+    fetch_events.logger.disabled = True
+    accepted = []
+    servers = [start_provider(args.latency, args.handshake, accepted) for _ in range(3)]
+    domains = [f"127.0.0.1:{s.server_address[1]}" for s in servers]
+    variants = {
+        "geopy urllib": {"adapter_factory": URLLibAdapter},
+        "geopy requests": {},
+        "общая сессия": {"adapter_factory": shared_geopy_adapter()},
+    }
+
+    for name, options in variants.items():
+        accepted.clear()
+        fetch_events.metrics = RunMetrics()
+        geocoders = [Nominatim(user_agent="bench", domain=d, scheme="http", timeout=10, **options) for d in domains]
+        elapsed, latencies = run(geocoders, args.calls, args.workers)
+        p50, p95 = statistics.median(latencies), latencies[int(len(latencies) * 0.95)]
+        line = (f"{name:<20}: {elapsed:6.2f} с, {args.calls / elapsed:6.0f} вызовов/с, "
+                f"медиана {p50 * 1e3:6.1f} мс, p95 {p95 * 1e3:6.1f} мс, соединений {len(accepted)}")
+        if name == "общая сессия":
+            reused = sum(counts["reused"] for counts in transport_summary().values())
+            line += f" (переиспользовано {reused}/{args.calls})"
+            close_session()
+        print(line)
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
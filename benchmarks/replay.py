@@ -0,0 +1,196 @@
+"""
+Запись и воспроизведение сетевых ответов для бенчмарков fetch_events.py
+
+Кассета — директория с двумя файлами:
+- vk.json       {домен: [посты от новых к старым]} — ответы wall.get/execute
+- geocode.json  {провайдер: {адрес: [lat, lon] или null}} — ответы геокодеров
+
+Recording* оборачивают настоящие session и функции GEOCODERS и дописывают
+кассету; Replay* отдают ответы из неё с заданной задержкой, долей ошибок и
+ограничением частоты, считая сетевые вызовы.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import requests
+import geopy.exc
+
+RE_WALL_CALL = re.compile(r"API\.wall\.get\((\{.*?\})\)")
+
+
+class Cassette:
+    """Записанные ответы VK и геокодеров."""
+
+    def __init__(self, vk: dict = None, geocode: dict = None):
+        self.vk = vk or {}
+        self.geocode = geocode or {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path) -> "Cassette":
+        path = Path(path)
+        return cls(
+            json.loads((path / "vk.json").read_text(encoding="utf-8")),
+            json.loads((path / "geocode.json").read_text(encoding="utf-8")),
+        )
+
+    def save(self, path) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        (path / "vk.json").write_text(json.dumps(self.vk, ensure_ascii=False), encoding="utf-8")
+        (path / "geocode.json").write_text(json.dumps(self.geocode, ensure_ascii=False, indent=1), encoding="utf-8")
+
+    @classmethod
+    def synthesize(cls, events: list, cache: dict, domain: str = "meowafisha", copies: int = 1) -> "Cassette":
+        """Кассета без сети: посты из текстов events.json, ответы ArcGIS из geocode_cache.json.
+
+        copies > 1 размножает посты (с новыми id), чтобы получить корпус побольше.
+        """
+        texts = [e["text"] for e in events if e.get("text")] * copies
+        base = 1_700_000_000
+        posts = [{"id": len(texts) - i, "date": base - i * 3600, "text": t} for i, t in enumerate(texts)]
+        answers = {addr: coords for addr, coords in cache.items() if coords and coords[0] is not None}
+        for e in events:
+            if e.get("lat") is not None:
+                answers.setdefault(e["location"], [e["lat"], e["lon"]])
+        return cls({domain: posts}, {"ArcGIS": answers})
+
+    def record_posts(self, domain: str, items: list) -> None:
+        with self.lock:
+            known = {p["id"]: p for p in self.vk.get(domain, [])}
+            known.update({p["id"]: p for p in items if "id" in p})
+            self.vk[domain] = sorted(known.values(), key=lambda p: (not p.get("is_pinned"), -p["id"]))
+
+    def record_answer(self, provider: str, addr: str, coords) -> None:
+        with self.lock:
+            self.geocode.setdefault(provider, {})[addr] = coords
+
+
+class RecordingSession:
+    """Обёртка над requests.Session: пропускает запросы и пишет посты в кассету."""
+
+    def __init__(self, session, cassette: Cassette):
+        self.session = session
+        self.cassette = cassette
+
+    def get(self, url, params=None, **kwargs):
+        r = self.session.get(url, params=params, **kwargs)
+        try:
+            data = r.json()
+        except ValueError:
+            return r
+        response = data.get("response")
+        domain = (params or {}).get("domain")
+        if isinstance(response, dict) and domain:
+            self.cassette.record_posts(domain, response.get("items", []))
+        elif isinstance(response, list):
+            for call, page in zip(RE_WALL_CALL.findall((params or {}).get("code", "")), response):
+                if isinstance(page, dict):
+                    self.cassette.record_posts(json.loads(call)["domain"], page.get("items", []))
+        return r
+
+    def close(self):
+        self.session.close()
+
+
+def recording_provider(name: str, func, cassette: Cassette):
+    """Обернуть функцию геокодера: результат (или его отсутствие) пишется в кассету."""
+    def wrapper(addr, *args, **kwargs):
+        loc = func(addr, *args, **kwargs)
+        cassette.record_answer(name, addr, [loc.latitude, loc.longitude] if loc else None)
+        return loc
+    return wrapper
+
+
+class Network:
+    """Параметры имитации сети и счётчики вызовов."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, rps: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rps = rps
+        self.calls = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = []
+
+    def call(self, name: str) -> str:
+        """Учесть вызов и вернуть исход: 'ok', 'error' или 'throttled'."""
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            now = time.monotonic()
+            self._recent = [t for t in self._recent if now - t < 1.0]
+            throttled = self.rps > 0 and len(self._recent) >= self.rps
+            self._recent.append(now)
+            failed = self._rng.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        return "throttled" if throttled else "error" if failed else "ok"
+
+
+class ReplayResponse:
+    """Минимальный requests.Response для vk_request."""
+
+    def __init__(self, data: dict):
+        self._data = data
+        self.status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class ReplaySession:
+    """Замена session: отвечает на wall.get и execute из кассеты."""
+
+    def __init__(self, cassette: Cassette, network: Network = None):
+        self.cassette = cassette
+        self.network = network or Network()
+
+    def _wall(self, params: dict) -> dict:
+        items = self.cassette.vk.get(params.get("domain"), [])
+        offset, count = int(params.get("offset", 0)), int(params.get("count", 20))
+        return {"count": len(items), "items": items[offset:offset + count]}
+
+    def get(self, url, params=None, **kwargs):
+        params = params or {}
+        method = urlparse(url).path.rsplit("/", 1)[-1]
+        outcome = self.network.call(f"vk.{method}")
+        if outcome == "error":
+            raise requests.exceptions.ConnectionError("simulated network error")
+        if outcome == "throttled":
+            return ReplayResponse({"error": {"error_code": 6, "error_msg": "Too many requests per second"}})
+        if method == "wall.get":
+            return ReplayResponse({"response": self._wall(params)})
+        if method == "execute":
+            calls = [json.loads(c) for c in RE_WALL_CALL.findall(params.get("code", ""))]
+            return ReplayResponse({"response": [self._wall(c) for c in calls]})
+        return ReplayResponse({"error": {"error_code": 3, "error_msg": "Unknown method passed"}})
+
+    def close(self):
+        pass
+
+
+def replay_provider(name: str, cassette: Cassette, network: Network = None):
+    """Функция геокодера, отвечающая из кассеты; неизвестный адрес — «нет результата»."""
+    network = network or Network()
+    answers = cassette.geocode.get(name, {})
+
+    def geocode(addr, *args, **kwargs):
+        outcome = network.call(f"geocode.{name}")
+        if outcome == "error":
+            raise geopy.exc.GeocoderUnavailable("simulated provider outage")
+        if outcome == "throttled":
+            raise geopy.exc.GeocoderRateLimited("simulated rate limit")
+        coords = answers.get(addr)
+        return SimpleNamespace(latitude=coords[0], longitude=coords[1]) if coords else None
+    return geocode
@@ -1,19 +1,32 @@
 #!/usr/bin/env python3
 """
 MeowAfisha · fetch_events.py
-Улучшено с обработкой ошибок и логированием
-- Каскадный геокодинг: ArcGIS → Yandex → Nominatim
-- Кэш: geocode_cache.json (коммитим для экономии квот API)
-- Логирование: stdout + опционально geocode_log.json с GEOCODE_SAVE_LOG=1
-- Ограничения скорости: min_delay_seconds на провайдера (env)
+Посты групп VK → события (дата, заголовок, адрес) → координаты → events.json
+- Загрузка: инкрементально по отметкам vk_state.json, несколько групп под общим лимитом
+- Геокодинг: кэш geocode_cache.jsonl, газеттир, пакетный ArcGIS и каскад ArcGIS → Yandex → Nominatim
+- Хранилище событий events_store.jsonl и выгрузка: events.json, шарды и индекс в data/
+- Режимы: разовый прогон, наблюдение (--watch), повторный разбор архива постов (--reprocess)
 """
 
 import os
 import re
+import math
+import bisect
+import argparse
 import time
 import json
+import gzip
+import pickle
+import hashlib
 import sys
 import logging
+import queue
+import signal
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
 
 # Опциональная загрузка .env для локальной разработки
@@ -23,13 +36,8 @@ try:
 except ImportError:
     pass
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-import pandas as pd
-from geopy.geocoders import ArcGIS, Yandex, Nominatim
-from geopy.extra.rate_limiter import RateLimiter
-import geopy.exc
+# requests и geopy импортируются лениво (см. get_session/get_geocoders):
+# импорт модуля не должен стоить сотни миллисекунд тестам и короткому cron-запуску
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -44,10 +52,20 @@ if not logger.handlers:
 # ─────────── НАСТРОЙКА ───────────
 TOKEN = os.getenv("VK_TOKEN")  # Обязательный секрет VK
 DOMAIN = os.getenv("VK_DOMAIN", "meowafisha")
+VK_DOMAINS = os.getenv("VK_DOMAINS", "")  # «группа[:город], …»; пусто — только VK_DOMAIN
 MAX_POSTS = int(os.getenv("VK_MAX_POSTS", "50"))
 BATCH = 100
 WAIT_REQ = float(os.getenv("VK_WAIT_REQ", "1.1"))  # пауза между wall.get (~1 rps)
-YEAR_DEFAULT = os.getenv("YEAR_DEFAULT", "2025")
+VK_RPS = float(os.getenv("VK_RPS", "0"))  # общий лимит запросов к VK в секунду; 0 — 1 / WAIT_REQ
+VK_API = os.getenv("VK_API_URL", "https://api.vk.ru/method").rstrip("/")
+VK_VERSION = "5.199"
+VK_EXECUTE_LIMIT = 25  # максимум обращений к API внутри одного execute
+VK_EXECUTE_PAGES = int(os.getenv("VK_EXECUTE_PAGES", "1"))  # >1 — страницы пачками через execute
+VK_PREFETCH = os.getenv("VK_PREFETCH", "0") == "1"  # запрашивать следующую пачку во время разбора текущей
+YEAR_DEFAULT = os.getenv("YEAR_DEFAULT", "2025")  # год, если дата поста неизвестна
+EVENT_UTC_OFFSET = os.getenv("EVENT_UTC_OFFSET", "+02:00")  # часовой пояс событий (Калининград, без летнего времени)
+VK_RESCAN_POSTS = int(os.getenv("VK_RESCAN_POSTS", "0"))  # перечитать N уже известных постов (правки)
+VK_PENDING_DAYS = int(os.getenv("VK_PENDING_DAYS", "30"))  # сколько дней повторять посты без координат
 
 # Задержки между запросами геокодинга (секунды)
 DEFAULT_DELAYS = {
@@ -56,16 +74,297 @@ DEFAULT_DELAYS = {
     'NOMINATIM': float(os.getenv("NOMINATIM_MIN_DELAY", "1.0"))
 }
 
+# Общий HTTP-транспорт VK и геокодеров (см. init_session)
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))  # хостов, чьи соединения держатся в пуле
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))  # соединений к одному хосту; не меньше потоков геокодинга
+HTTP_KEEPALIVE = os.getenv("HTTP_KEEPALIVE", "1") == "1"  # 0 — Connection: close, новое соединение на запрос
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))  # установка соединения (с TLS), с
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))  # ожидание ответа геокодеров, с
+HTTP_TIMEOUTS = os.getenv("HTTP_TIMEOUTS", "")  # «хост=connect:read, …» — важнее таймаутов вызова
+HTTP_COMPRESSION = os.getenv("HTTP_COMPRESSION", "1") == "1"  # Accept-Encoding: gzip, deflate (и br/zstd, если есть)
+
+# Параллельный геокодинг: число потоков и повторы при ошибках сервиса
+GEOCODE_WORKERS = int(os.getenv("GEOCODE_WORKERS", "4"))
+GEOCODE_SPREAD = os.getenv("GEOCODE_SPREAD", "1") == "1"  # первые попытки делятся между провайдерами по их квотам
+GEOCODE_MAX_RETRIES = int(os.getenv("GEOCODE_MAX_RETRIES", "2"))
+GEOCODE_ERROR_WAIT = float(os.getenv("GEOCODE_ERROR_WAIT", "5.0"))
+
+# Пакетный геокодинг (geocode_many): адреса пачками в эндпоинты «много адресов за запрос»
+ARCGIS_TOKEN = os.getenv("ARCGIS_TOKEN", "")  # токен ArcGIS для geocodeAddresses; пусто — без пакетов
+ARCGIS_BATCH_URL = os.getenv(
+    "ARCGIS_BATCH_URL", "https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer/geocodeAddresses")
+GEOCODE_BATCH_SIZE = int(os.getenv("GEOCODE_BATCH_SIZE", "100"))  # адресов в одном запросе (у ArcGIS до 1000)
+GEOCODE_BATCH_MIN_SCORE = float(os.getenv("GEOCODE_BATCH_MIN_SCORE", "90"))  # ниже — адрес уходит в каскад
+
+# Срок жизни записей кэша (секунды): найденные — бессрочно при 0,
+# ненайденные — повтор через TTL, 2·TTL, 4·TTL … но не реже GEOCODE_NEGATIVE_TTL_MAX
+GEOCODE_POSITIVE_TTL = int(os.getenv("GEOCODE_POSITIVE_TTL", "0"))
+GEOCODE_NEGATIVE_TTL = int(os.getenv("GEOCODE_NEGATIVE_TTL", str(6 * 3600)))
+GEOCODE_NEGATIVE_TTL_MAX = int(os.getenv("GEOCODE_NEGATIVE_TTL_MAX", str(30 * 24 * 3600)))
+
+# Адаптивный порядок каскада: статистика провайдеров по классам адресов
+GEOCODE_ADAPTIVE = os.getenv("GEOCODE_ADAPTIVE", "1") == "1"
+GEOCODE_STATS_MIN = int(os.getenv("GEOCODE_STATS_MIN", "20"))  # меньше попыток — статический порядок
+GEOCODE_STATS_WINDOW = int(os.getenv("GEOCODE_STATS_WINDOW", "500"))  # старые попытки забываются
+GEOCODE_SPREAD_SCORE = float(os.getenv("GEOCODE_SPREAD_SCORE", "0.8"))  # GEOCODE_SPREAD — среди провайдеров с p / c не ниже этой доли лучшего
+
+# Хеджирование: следующий провайдер запускается через GEOCODE_HEDGE_DELAY с
+# (0 — p90 задержки предыдущего в этом прогоне), принимается первый ответ внутри области
+GEOCODE_HEDGE = os.getenv("GEOCODE_HEDGE", "0") == "1"
+GEOCODE_HEDGE_DELAY = float(os.getenv("GEOCODE_HEDGE_DELAY", "0"))
+GEOCODE_HEDGE_DEFAULT = float(os.getenv("GEOCODE_HEDGE_DEFAULT", "2.0"))  # пока p90 ещё не измерен
+REGION_BBOX = (19.30, 54.00, 23.10, 55.60)  # Калининградская область: lon_min, lat_min, lon_max, lat_max
+
+# Автомат отключения провайдера (circuit breaker)
+GEOCODE_BREAKER = os.getenv("GEOCODE_BREAKER", "1") == "1"
+GEOCODE_BREAKER_FAILURES = int(os.getenv("GEOCODE_BREAKER_FAILURES", "5"))  # ошибок подряд до отключения
+GEOCODE_BREAKER_COOLDOWN = float(os.getenv("GEOCODE_BREAKER_COOLDOWN", "900"))  # пауза перед пробным запросом, с
+GEOCODE_BREAKER_COOLDOWN_MAX = float(os.getenv("GEOCODE_BREAKER_COOLDOWN_MAX", str(12 * 3600)))
+
+# Локальный газеттир перед провайдерами: индекс по уже найденным адресам
+# и (опционально) выгрузке адресов OSM в формате GeoJSON Lines
+GAZETTEER = os.getenv("GAZETTEER", "1") == "1"
+GAZETTEER_MIN_CONFIDENCE = float(os.getenv("GAZETTEER_MIN_CONFIDENCE", "0.8"))
+GAZETTEER_OSM = os.getenv("GAZETTEER_OSM", "")  # путь к .geojsonl (osmium export -f geojsonseq)
+GAZETTEER_FILE = Path(os.getenv("GAZETTEER_FILE", "gazetteer.pickle"))  # сериализованный индекс OSM
+
+# Архив сырых постов VK и повторный разбор (--reprocess)
+POST_ARCHIVE = os.getenv("POST_ARCHIVE", "posts_archive.jsonl")  # .gz — сжатый; пусто — не архивировать
+REPROCESS_WORKERS = int(os.getenv("REPROCESS_WORKERS", "0"))  # процессов разбора; 0 — по числу ядер
+REPROCESS_CHUNK = int(os.getenv("REPROCESS_CHUNK", "500"))  # постов в одном задании пула
+
+# Режим наблюдения (--watch)
+WATCH_INTERVAL = float(os.getenv("WATCH_INTERVAL", "60"))  # пауза между опросами групп, с
+WATCH_HTTP = os.getenv("WATCH_HTTP", "127.0.0.1:8787")  # адрес HTTP с events.json; пусто — без сервера
+
 # Опциональный вывод лога в файл
 GEOCODE_SAVE_LOG = os.getenv("GEOCODE_SAVE_LOG", "1") == "1"
 
 OUTPUT_JSON = Path("events.json")
-CACHE_FILE = Path("geocode_cache.json")
+EVENTS_STORE = Path("events_store.jsonl")  # журнал событий по id поста; events.json — его представление
+CACHE_FILE = Path("geocode_cache.json")  # выгрузка для фронтенда
+CACHE_STORE = Path("geocode_cache.jsonl")  # журнал кэша с метаданными
+STATS_FILE = Path("geocode_stats.json")  # успехи и задержки провайдеров по классам адресов
+BREAKER_FILE = Path("geocode_breakers.json")  # разомкнутые автоматы провайдеров
 LOG_FILE = Path("geocode_log.json")
+STATE_FILE = Path("vk_state.json")  # отметки последних обработанных постов по группам
+METRICS_FILE = Path(os.getenv("METRICS_FILE", "run_metrics.json"))
+METRICS_PROM_FILE = Path(os.getenv("METRICS_PROM_FILE", "run_metrics.prom"))
+
+# Секционированная выгрузка для фронтенда: index.json + помесячные шарды с текстами
+OUTPUT_SHARDS = os.getenv("OUTPUT_SHARDS", "0") == "1"
+OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", "data"))
+OUTPUT_COMPRESS = [c for c in os.getenv("OUTPUT_COMPRESS", "gz,br").split(",") if c]  # предсжатые копии
+OUTPUT_CLUSTERS = os.getenv("OUTPUT_CLUSTERS", "0") == "1"  # кластеры маркеров рядом с шардами (фронтенд их пока не читает)
+OUTPUT_SEARCH = os.getenv("OUTPUT_SEARCH", "1") == "1"  # поисковый индекс рядом с шардами
+SEARCH_INDEX_VERSION = 1
+
+# Кластеризация маркеров (как supercluster): радиус в пикселях тайла extent×extent
+CLUSTER_MIN_ZOOM = int(os.getenv("CLUSTER_MIN_ZOOM", "6"))
+CLUSTER_MAX_ZOOM = int(os.getenv("CLUSTER_MAX_ZOOM", "16"))  # выше — отдельные маркеры
+CLUSTER_RADIUS = float(os.getenv("CLUSTER_RADIUS", "40"))
+CLUSTER_EXTENT = 512
+
+# ─────────── МЕТРИКИ ───────────
+class RunMetrics:
+    """Счётчики и гистограммы одного прогона (потокобезопасно).
+
+    Метрика адресуется именем и метками: metrics.count("cache_lookups_total",
+    result="hit"). Гистограммы хранят счётчики по фиксированным границам
+    LATENCY_BUCKETS, как в Prometheus.
+    """
+
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {"buckets": [0] * len(self.LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.LATENCY_BUCKETS):
+                if seconds <= bound:
+                    hist["buckets"][i] += 1
+            hist["sum"] += seconds
+            hist["count"] += 1
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Замерить стадию: гистограмма stage_seconds{stage=...}."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+    def quantile(self, name: str, q: float, **labels):
+        """Оценка квантиля по гистограмме (верхняя граница корзины) или None без данных."""
+        hist = self.histograms.get(self._key(name, labels))
+        if not hist or not hist["count"]:
+            return None
+        rank = q * hist["count"]
+        for bound, cumulative in zip(self.LATENCY_BUCKETS, hist["buckets"]):
+            if cumulative >= rank:
+                return bound
+        return self.LATENCY_BUCKETS[-1]
+
+    def summary(self) -> dict:
+        """Машиночитаемая сводка прогона."""
+        def labelled(key):
+            name, labels = key
+            return {"name": name, "labels": dict(labels)}
+
+        with self._lock:
+            lookups = {dict(k[1]).get("result"): v for k, v in self.counters.items() if k[0] == "cache_lookups_total"}
+            total = sum(lookups.values())
+            return {
+                "started": self.started,
+                "duration_s": time.time() - self.started,
+                "cache_hit_ratio": (lookups.get("hit", 0) + lookups.get("negative_hit", 0)) / total if total else None,
+                "counters": [dict(labelled(k), value=v) for k, v in self.counters.items()],
+                "histograms": [
+                    dict(labelled(k), buckets=dict(zip(map(str, self.LATENCY_BUCKETS), h["buckets"])),
+                         sum=h["sum"], count=h["count"])
+                    for k, h in self.histograms.items()
+                ],
+            }
+
+    def prometheus(self, prefix: str = "meowafisha_") -> str:
+        """Текст в формате Prometheus textfile collector."""
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                                  for k, v in items) + "}"
+
+        summary = self.summary()
+        lines = [
+            f"# TYPE {prefix}run_duration_seconds gauge",
+            f"{prefix}run_duration_seconds {summary['duration_s']:.6f}",
+            f"# TYPE {prefix}last_run_timestamp_seconds gauge",
+            f"{prefix}last_run_timestamp_seconds {self.started:.0f}",
+        ]
+        if summary["cache_hit_ratio"] is not None:
+            lines += [f"# TYPE {prefix}cache_hit_ratio gauge", f"{prefix}cache_hit_ratio {summary['cache_hit_ratio']:.6f}"]
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {prefix}{name} counter")
+                seen.add(name)
+            lines.append(f"{prefix}{name}{fmt(labels)} {value}")
+        for (name, labels), hist in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                seen.add(name)
+            for bound, cumulative in zip(self.LATENCY_BUCKETS, hist["buckets"]):
+                lines.append(f"{prefix}{name}_bucket{fmt(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{prefix}{name}_bucket{fmt(labels, [('le', '+Inf')])} {hist['count']}")
+            lines.append(f"{prefix}{name}_sum{fmt(labels)} {hist['sum']:.6f}")
+            lines.append(f"{prefix}{name}_count{fmt(labels)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path: Path = None, prom_path: Path = None) -> None:
+        """Сохранить сводку в JSON и в формате Prometheus (атомарно)."""
+        try:
+            if json_path:
+                atomic_write_text(json_path, json.dumps(self.summary(), ensure_ascii=False, indent=2))
+            if prom_path:
+                atomic_write_text(prom_path, self.prometheus())
+        except IOError as e:
+            logger.error(f"Не удалось сохранить метрики: {e}")
+
+metrics = RunMetrics()
 
 # ─────────── УТИЛИТЫ ───────────
-def init_session() -> requests.Session:
-    """Создать сессию requests с логикой повтора."""
+def parse_host_timeouts(value: str) -> dict:
+    """HTTP_TIMEOUTS «хост=connect:read, …» → {хост: (connect, read)}; ошибочные записи пропускаются."""
+    timeouts = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        host, _, pair = item.partition("=")
+        connect, _, read = pair.partition(":")
+        try:
+            timeouts[host.strip().lower()] = (float(connect), float(read or connect))
+        except ValueError:
+            logger.warning(f"HTTP_TIMEOUTS: пропущена запись {item!r} (ожидается хост=connect:read)")
+    return timeouts
+
+def init_session():
+    """Создать общую сессию requests для VK и геокодеров: пул, таймауты, сжатие, счётчики соединений."""
+    import socket
+    from urllib.parse import urlsplit
+
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+    from urllib3.connection import HTTPConnection
+    from urllib3.util import make_headers
+    from urllib3.util.retry import Retry
+
+    host_timeouts = parse_host_timeouts(HTTP_TIMEOUTS)
+
+    def counting(pool_class):
+        """Пул, соединения которого отмечают, открыт ли сокет заново перед запросом."""
+        class Connection(pool_class.ConnectionCls):
+            fresh = False
+
+            def connect(self):
+                self.fresh = True
+                return super().connect()
+
+            def request(self, *args, **kwargs):
+                # HTTPS подключается до request(), HTTP — внутри него
+                reused = self.sock is not None and not self.fresh
+                metrics.count("http_client_requests_total", host=self.host,
+                              connection="reused" if reused else "new")
+                try:
+                    return super().request(*args, **kwargs)
+                finally:
+                    self.fresh = False
+
+        return type(pool_class.__name__, (pool_class,), {"ConnectionCls": Connection})
+
+    pools = {"http": counting(HTTPConnectionPool), "https": counting(HTTPSConnectionPool)}
+
+    class TransportAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            if HTTP_KEEPALIVE:
+                kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+                    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = pools
+
+        def send(self, request, timeout=None, **kwargs):
+            host = (urlsplit(request.url).hostname or "").lower()
+            if host in host_timeouts:
+                timeout = host_timeouts[host]
+            elif timeout is None:
+                timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+            elif not isinstance(timeout, tuple):
+                timeout = (min(HTTP_CONNECT_TIMEOUT, timeout), timeout)
+            response = super().send(request, timeout=timeout, **kwargs)
+            if response.headers.get("Content-Encoding", "identity") != "identity":
+                metrics.count("http_client_compressed_total", host=host)
+            return response
+
     session = requests.Session()
     retry = Retry(
         total=3,
@@ -73,37 +372,316 @@ def init_session() -> requests.Session:
         status_forcelist=[500, 502, 503, 504],
         allowed_methods=["GET"],
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    # Геокодеры без повторов на уровне адаптера: их повторяет rate_limited, ошибки считает автомат
+    adapter = TransportAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
     session.mount("https://", adapter)
     session.mount("http://", adapter)
+    session.mount(VK_API, TransportAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry))
+    session.headers["Accept-Encoding"] = make_headers(accept_encoding=True)["accept-encoding"] \
+        if HTTP_COMPRESSION else "identity"
+    if not HTTP_KEEPALIVE:
+        session.headers["Connection"] = "close"
     return session
 
-session = init_session()
+def shared_geopy_adapter():
+    """Класс адаптера geopy (adapter_factory), отправляющего запросы через общую сессию get_session()."""
+    from geopy.adapters import BaseSyncAdapter, RequestsAdapter
+
+    class SharedSessionAdapter(RequestsAdapter):
+        # Ошибки сети и HTTP переводятся в исключения geopy кодом RequestsAdapter
+        def __init__(self, *, proxies, ssl_context):
+            BaseSyncAdapter.__init__(self, proxies=proxies, ssl_context=ssl_context)
+
+        @property
+        def session(self):
+            return get_session()
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            pass  # общую сессию закрывает close_session()
+
+        def __del__(self):
+            pass
+
+    return SharedSessionAdapter
+
+def transport_summary() -> dict:
+    """Запросы общей сессии по хостам из метрик прогона: {хост: {"new": n, "reused": n}}."""
+    summary = {}
+    for (name, labels), value in list(metrics.counters.items()):
+        if name == "http_client_requests_total":
+            labels = dict(labels)
+            summary.setdefault(labels["host"], {"new": 0, "reused": 0})[labels["connection"]] += int(value)
+    return summary
+
+session = None  # общая сессия VK и геокодеров, создаётся при первом запросе
+_init_lock = threading.Lock()
+
+def get_session():
+    """Общая HTTP-сессия, создаётся один раз при первом обращении."""
+    global session
+    if session is None:
+        with _init_lock:
+            if session is None:
+                session = init_session()
+    return session
+
+def close_session() -> None:
+    """Закрыть общую сессию (и её пул соединений); следующий get_session() создаст новую."""
+    global session
+    if session is not None:
+        for host, counts in sorted(transport_summary().items()):
+            total = counts["new"] + counts["reused"]
+            logger.info(f"HTTP {host}: {total} запросов, новых соединений {counts['new']}, "
+                        f"переиспользовано {counts['reused'] / total:.0%}")
+        session.close()
+        session = None
+
+class TokenBucket:
+    """Потокобезопасный token bucket: rate токенов в секунду, не более capacity в запасе.
+
+    Токены резервируются заранее (допускается «долг»), поэтому потоки,
+    ожидающие один и тот же провайдер, обслуживаются по очереди и суммарно
+    не превышают его квоту.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_delay(cls, min_delay: float) -> "TokenBucket":
+        """Bucket, пропускающий не больше одного запроса за min_delay секунд."""
+        return cls(1.0 / min_delay if min_delay > 0 else float("inf"))
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Зарезервировать токены и вернуть время ожидания в секундах."""
+        if self.rate == float("inf"):
+            return 0.0
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """Дождаться своей очереди в bucket."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self._sleep(wait)
+
+class FairLimiter:
+    """Общий лимит запросов (token bucket) с очередью по кругу между группами.
+
+    Каждая группа ждёт в своей очереди, слоты выдаются группам по очереди,
+    поэтому длинная стена одной группы не задерживает остальные больше чем
+    на один запрос за круг.
+    """
+
+    def __init__(self, interval: float, clock=time.monotonic, sleep=time.sleep):
+        self.interval = interval
+        self.bucket = TokenBucket(1.0 / interval if interval > 0 else float("inf"), clock=clock, sleep=sleep)
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._ring = deque()  # группы с ожидающими запросами, по кругу
+        self._busy = False
+
+    def acquire(self, group: str) -> None:
+        """Дождаться слота для запроса группы group."""
+        ticket = object()
+        with self._cond:
+            waiting = self._queues.setdefault(group, deque())
+            waiting.append(ticket)
+            if len(waiting) == 1:
+                self._ring.append(group)
+            while self._busy or self._ring[0] != group or waiting[0] is not ticket:
+                self._cond.wait()
+            self._busy = True
+            waiting.popleft()
+            self._ring.popleft()
+            if waiting:
+                self._ring.append(group)
+        try:
+            self.bucket.acquire()
+        finally:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+vk_limiter = None
+
+def get_vk_limiter() -> FairLimiter:
+    """Общий лимитер VK; пересоздаётся, если изменились VK_RPS/WAIT_REQ."""
+    global vk_limiter
+    interval = 1.0 / VK_RPS if VK_RPS > 0 else WAIT_REQ
+    with _init_lock:
+        if vk_limiter is None or vk_limiter.interval != interval:
+            vk_limiter = FairLimiter(interval)
+    return vk_limiter
+
+def quota_errors() -> tuple:
+    """Ошибки geopy, после которых провайдер бесполезен до конца квоты или смены ключа."""
+    import geopy.exc
+
+    return (geopy.exc.GeocoderQuotaExceeded, geopy.exc.GeocoderAuthenticationFailure,
+            geopy.exc.GeocoderInsufficientPrivileges)
+
+def rate_limited(func, bucket: TokenBucket, name: str = None):
+    """Обернуть вызов провайдера: token bucket + повторы при ошибках сервиса.
+
+    С name каждый HTTP-запрос попадает в гистограмму provider_latency_seconds
+    (без учёта ожидания в bucket), а ожидание — в provider_wait_seconds_total.
+    Обёртка принимает cancel (threading.Event): если его выставили, пока
+    шла пауза перед повтором, повтора нет и возвращается None.
+    """
+    import geopy.exc
+
+    QUOTA_ERRORS = quota_errors()
+
+    def wrapper(*args, cancel: threading.Event = None, **kwargs):
+        for attempt in range(GEOCODE_MAX_RETRIES + 1):
+            waited = time.perf_counter()
+            bucket.acquire()
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except geopy.exc.GeocoderRateLimited:
+                if attempt == GEOCODE_MAX_RETRIES:
+                    raise
+            except QUOTA_ERRORS:
+                raise  # повтор не поможет до сброса квоты или смены ключа
+            except geopy.exc.GeocoderServiceError:
+                if attempt == GEOCODE_MAX_RETRIES:
+                    raise
+            finally:
+                if name:
+                    metrics.count("provider_wait_seconds_total", start - waited, provider=name)
+                    metrics.observe("provider_latency_seconds", time.perf_counter() - start, provider=name)
+            if cancel is None:
+                time.sleep(GEOCODE_ERROR_WAIT)
+            elif cancel.wait(GEOCODE_ERROR_WAIT):
+                return None
+    wrapper.bucket = bucket
+    return wrapper
+
+def build_geocoders() -> list:
+    """Создать клиентов геокодеров и их ограничители скорости (каскад GEOCODERS).
+
+    Все клиенты ходят через общую сессию get_session() (shared_geopy_adapter).
+    """
+    from geopy.geocoders import ArcGIS, Yandex, Nominatim
+
+    transport = {"timeout": HTTP_READ_TIMEOUT, "adapter_factory": shared_geopy_adapter()}
+    arcgis = ArcGIS(**transport)
+    yandex = Yandex(api_key=os.getenv("YANDEX_KEY"), user_agent="meowafisha-script", **transport) if os.getenv("YANDEX_KEY") else None
+    nominatim_url = os.getenv("NOMINATIM_URL", "").strip()
+    if nominatim_url:
+        nominatim = Nominatim(user_agent=os.getenv("NOMINATIM_USER_AGENT", "meowafisha-bot"), domain=nominatim_url, **transport)
+    else:
+        nominatim = Nominatim(user_agent=os.getenv("NOMINATIM_USER_AGENT", "meowafisha-bot"), **transport)
+
+    # Ограничители скорости: один общий bucket на провайдера для всех потоков
+    arcgis_geocode = rate_limited(arcgis.geocode, TokenBucket.from_delay(DEFAULT_DELAYS['ARCGIS']), "ArcGIS") if arcgis else None
+    yandex_geocode = rate_limited(yandex.geocode, TokenBucket.from_delay(DEFAULT_DELAYS['YANDEX']), "Yandex") if yandex else None
+    nominatim_geocode = rate_limited(nominatim.geocode, TokenBucket.from_delay(DEFAULT_DELAYS['NOMINATIM']), "Nominatim") if nominatim else None
+
+    return [
+        {"name": "ArcGIS", "func": arcgis_geocode},
+        {"name": "Yandex", "func": yandex_geocode},
+        {"name": "Nominatim", "func": nominatim_geocode},
+    ]
 
-# Инициализация геокодеров
-arcgis = ArcGIS(timeout=10)
-yandex = Yandex(api_key=os.getenv("YANDEX_KEY"), timeout=10, user_agent="meowafisha-script") if os.getenv("YANDEX_KEY") else None
-nominatim_url = os.getenv("NOMINATIM_URL", "").strip()
-if nominatim_url:
-    nominatim = Nominatim(user_agent=os.getenv("NOMINATIM_USER_AGENT", "meowafisha-bot"), timeout=10, domain=nominatim_url)
-else:
-    nominatim = Nominatim(user_agent=os.getenv("NOMINATIM_USER_AGENT", "meowafisha-bot"), timeout=10)
+GEOCODERS = None  # строится build_geocoders() при первом геокодинге
 
-# Ограничители скорости (осторожные 1 запрос/с на сервис)
-arcgis_geocode = RateLimiter(arcgis.geocode, min_delay_seconds=DEFAULT_DELAYS['ARCGIS']) if arcgis else None
-yandex_geocode = RateLimiter(yandex.geocode, min_delay_seconds=DEFAULT_DELAYS['YANDEX']) if yandex else None
-nominatim_geocode = RateLimiter(nominatim.geocode, min_delay_seconds=DEFAULT_DELAYS['NOMINATIM']) if nominatim else None
+def arcgis_batch(addresses: list) -> list:
+    """Один запрос ArcGIS geocodeAddresses: [lat, lon] или None для каждого адреса по порядку.
 
-GEOCODERS = [
-    {"name": "ArcGIS", "func": arcgis_geocode},
-    {"name": "Yandex", "func": yandex_geocode},
-    {"name": "Nominatim", "func": nominatim_geocode},
-]
+    Совпадением считается только Status "M" со score не ниже
+    GEOCODE_BATCH_MIN_SCORE. Ошибка токена (498/499/403) — исключение
+    квоты geopy, прочие ошибки сервиса — GeocoderServiceError.
+    """
+    import geopy.exc
+    import requests
+
+    records = [{"attributes": {"OBJECTID": i, "SingleLine": addr}} for i, addr in enumerate(addresses)]
+    try:
+        r = get_session().post(ARCGIS_BATCH_URL, data={
+            "addresses": json.dumps({"records": records}, ensure_ascii=False),
+            "sourceCountry": "RUS",
+            "outSR": 4326,
+            "token": ARCGIS_TOKEN,
+            "f": "json",
+        }, timeout=HTTP_READ_TIMEOUT * 3)
+        r.raise_for_status()
+        data = r.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        raise geopy.exc.GeocoderServiceError(f"geocodeAddresses: {e}")
+    if "error" in data:
+        error = data["error"]
+        if error.get("code") in (403, 498, 499):
+            raise geopy.exc.GeocoderAuthenticationFailure(f"geocodeAddresses: {error.get('message')}")
+        raise geopy.exc.GeocoderServiceError(f"geocodeAddresses: {error}")
+
+    found = [None] * len(addresses)
+    for loc in data.get("locations", []):
+        attrs, point = loc.get("attributes") or {}, loc.get("location") or {}
+        i = attrs.get("ResultID")
+        if not isinstance(i, int) or not 0 <= i < len(addresses) or point.get("x") is None:
+            continue
+        if attrs.get("Status") == "M" and (loc.get("score") or 0) >= GEOCODE_BATCH_MIN_SCORE:
+            found[i] = [point["y"], point["x"]]
+    return found
+
+def build_batch_geocoders() -> list:
+    """Пакетные провайдеры geocode_many: [{"name", "func": адреса → [coords | None]}].
+
+    ArcGIS geocodeAddresses подключается при ARCGIS_TOKEN и делит token
+    bucket с одиночным ArcGIS: пачка стоит одного токена. У Nominatim,
+    в том числе своего за NOMINATIM_URL, пакетного эндпоинта нет — его
+    адреса идут каскадом (для своего сервера задержку снимает
+    NOMINATIM_MIN_DELAY=0).
+    """
+    providers = []
+    if ARCGIS_TOKEN:
+        single = next((p["func"] for p in get_geocoders() if p["name"] == "ArcGIS"), None)
+        bucket = getattr(single, "bucket", None) or TokenBucket.from_delay(DEFAULT_DELAYS['ARCGIS'])
+        providers.append({"name": "ArcGIS batch", "func": rate_limited(arcgis_batch, bucket)})
+    return providers
+
+BATCH_GEOCODERS = None  # строится build_batch_geocoders() при первом пакетном геокодинге
+
+def get_batch_geocoders() -> list:
+    """Пакетные провайдеры, создаются один раз при первом обращении."""
+    global BATCH_GEOCODERS
+    if BATCH_GEOCODERS is None:
+        providers = build_batch_geocoders()
+        with _init_lock:
+            if BATCH_GEOCODERS is None:
+                BATCH_GEOCODERS = providers
+    return BATCH_GEOCODERS
+
+def get_geocoders() -> list:
+    """Каскад GEOCODERS, создаётся один раз при первом обращении."""
+    global GEOCODERS
+    if GEOCODERS is None:
+        with _init_lock:
+            if GEOCODERS is None:
+                GEOCODERS = build_geocoders()
+    return GEOCODERS
 
 # Временный лог геокодинга (адрес → {'arcgis':..., 'yandex':..., 'nominatim':...})
 geolog = {}
-geocache = {}
-original_cache = {}
+_geolog_lock = threading.Lock()  # geolog пишут потоки геокодинга, читает save_run
+geocache = None  # GeocodeStore, открывается в main()
+provider_stats = None  # ProviderStats, открывается в main(); None — статический порядок
+breakers = None  # CircuitBreakers, открываются в main(); None — провайдеры не отключаются
+gazetteer = None  # Gazetteer, строится в main(); None — без локального поиска
+archive = None  # PostArchive, открывается в main(); None — сырые посты не сохраняются
 
 def log_geocoding(addr: str, provider: str, success: bool, detail: str = ""):
     """Расширенное логирование со структурными уровнями."""
@@ -115,9 +693,8 @@ def log_geocoding(addr: str, provider: str, success: bool, detail: str = ""):
     logger.log(level, msg)
 
     # Сохранить в geolog для JSON экспорта
-    if addr not in geolog:
-        geolog[addr] = {}
-    geolog[addr][provider] = {"success": success, "detail": detail}
+    with _geolog_lock:
+        geolog.setdefault(addr, {})[provider] = {"success": success, "detail": detail}
 
 def load_cache() -> dict:
     """Загрузить кэш геокодинга из файла с обработкой ошибок."""
@@ -134,19 +711,714 @@ def load_cache() -> dict:
         logger.warning(f"Не удалось загрузить кэш: {e}, начинаем с чистого")
         return {}
 
-def save_cache(cache: dict, force: bool = False) -> None:
-    """Сохранить кэш геокодинга на диск."""
-    if cache == original_cache and not force:
+def save_cache(store, force: bool = False) -> None:
+    """Дописать изменения в журнал кэша и выгрузить geocode_cache.json для фронтенда."""
+    if not store.changed and not force:
         logger.info("Кэш не изменился, пропускаем сохранение")
         return
 
     try:
-        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(cache, f, ensure_ascii=False, indent=2)
-        logger.info(f"Кэш сохранен: {len(cache)} адресов")
+        store.flush()
+        atomic_write_text(CACHE_FILE, json.dumps(store.export(), ensure_ascii=False, indent=2))
+        store.changed = False
+        logger.info(f"Кэш сохранен: {len(store.entries)} записей, {len(store)} написаний")
     except IOError as e:
         logger.error(f"Не удалось сохранить кэш: {e}")
 
+# ─────────── НОРМАЛИЗАЦИЯ АДРЕСОВ ───────────
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p',
+    'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch',
+    'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+})
+
+# Сокращения типов улиц; None — слово не несёт информации и отбрасывается
+ADDRESS_WORDS = {
+    'ул': None, 'улица': None, 'д': None, 'дом': None, 'г': None, 'гор': None, 'город': None,
+    'пр': 'проспект', 'прт': 'проспект', 'просп': 'проспект', 'проспект': 'проспект',
+    'пер': 'переулок', 'переулок': 'переулок', 'пл': 'площадь', 'площадь': 'площадь',
+    'б': 'бульвар', 'бр': 'бульвар', 'бул': 'бульвар', 'бульвар': 'бульвар',
+    'наб': 'набережная', 'набережная': 'набережная', 'ш': 'шоссе', 'шоссе': 'шоссе',
+    'пос': 'поселок', 'п': 'поселок', 'поселок': 'поселок',
+    'корп': 'к', 'корпус': 'к', 'к': 'к', 'стр': 'с', 'строение': 'с', 'лит': None, 'литера': None,
+}
+DEFAULT_CITY = 'калининград'
+
+RE_ADDR_SYMBOLS = re.compile(r"[^\w\s,-]")
+RE_ADDR_DASHED = re.compile(r"\b(пр|б)-(т|р)\b")
+RE_ADDR_TOKEN = re.compile(r"\w+")
+
+# Пометки корпуса, строения и литеры после номера дома
+HOUSE_MARKERS = {'к': 'к', 'корп': 'к', 'корпус': 'к', 'с': 'с', 'стр': 'с', 'строение': 'с', 'лит': '', 'литера': ''}
+
+def _house_suffix(tokens: list, i: int):
+    """Суффикс номера дома, начинающийся с tokens[i]: (суффикс, число токенов) или None.
+
+    «а» → «а», «корп 2» → «к2», «лит б» → «б»; вызывается только после номера дома,
+    поэтому одиночные «б», «д», «г», «п» здесь — литеры, а не сокращения.
+    """
+    tok = tokens[i]
+    nxt = tokens[i + 1] if i + 1 < len(tokens) else ""
+    marker = HOUSE_MARKERS.get(tok)
+    if marker and nxt.isdigit() or marker == '' and len(nxt) == 1 and nxt.isalpha():
+        return marker + nxt, 2
+    if len(tok) == 1 and tok.isalpha():
+        return tok, 1
+    return None
+
+def canonical_address(addr: str) -> str:
+    """Канонический ключ адреса для кэша геокодинга.
+
+    Сворачивает регистр, пробелы, пунктуацию и эмодзи, раскрывает сокращения
+    («ул.», «пр-т», «д.»), склеивает буквенные суффиксы номеров домов,
+    отбрасывает город по умолчанию и транслитерирует кириллицу, так что
+    «📍Барн, Каштановая аллея 1а» и «Barn, Каштановая аллея 1А, Калининград»
+    дают один ключ.
+    """
+    if not addr:
+        return ""
+    text = addr.lower().replace('ё', 'е')
+    text = RE_ADDR_DASHED.sub(r"\1\2", text)
+    text = RE_ADDR_SYMBOLS.sub(' ', text)
+
+    parts = []
+    for part in text.split(','):
+        raw = RE_ADDR_TOKEN.findall(part)
+        tokens = []
+        # «Ленина 5, корп. 2» — корпус относится к дому из предыдущей части
+        if parts and parts[-1][-1][:1].isdigit() and raw and (_house_suffix(raw, 0) or ("", 1))[1] == 2:
+            tokens = parts.pop()
+        i = 0
+        while i < len(raw):
+            # Буквы и корпуса склеиваются с номером дома до раскрытия сокращений
+            suffix = _house_suffix(raw, i) if tokens and tokens[-1][:1].isdigit() else None
+            if suffix:
+                tokens[-1] += suffix[0]
+                i += suffix[1]
+                continue
+            tok = raw[i]
+            i += 1
+            if tok in ADDRESS_WORDS:
+                tok = ADDRESS_WORDS[tok]
+                if tok is None:
+                    continue
+            tokens.append(tok)
+        if not tokens or tokens == [DEFAULT_CITY]:
+            continue
+        # «Ленина, 11» и «Ленина 11» — номер дома относится к предыдущей части
+        if parts and len(tokens) == 1 and tokens[0][:1].isdigit():
+            parts[-1] += tokens
+        else:
+            parts.append(tokens)
+    return ', '.join(' '.join(tokens).translate(TRANSLIT) for tokens in parts)
+
+def migrate_cache(cache: dict) -> dict:
+    """Свернуть кэш на канонические ключи: все варианты адреса получают одни координаты."""
+    groups = {}
+    for addr, coords in cache.items():
+        groups.setdefault(canonical_address(addr), []).append((addr, coords))
+
+    migrated = {}
+    for key, entries in groups.items():
+        found = [list(c) for _, c in entries if c != [None, None]]
+        coords = found[0] if found else [None, None]
+        if any(c != coords for c in found):
+            logger.warning(f"Разные координаты для вариантов адреса «{key}», оставляем {coords}")
+        for addr, _ in entries:
+            migrated[addr] = coords
+
+    collapsed = sum(1 for entries in groups.values() if len(entries) > 1)
+    logger.info(f"Миграция кэша: {len(cache)} адресов → {len(groups)} канонических ({collapsed} групп вариантов)")
+    return migrated
+
+def migrate_cache_file() -> None:
+    """Разовая миграция: свернуть geocode_cache.json в журнал и выгрузить заново."""
+    store = open_cache()
+    store.import_legacy(load_cache())
+    store.compact()
+    save_cache(store, force=True)
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Записать файл атомарно: временный файл рядом + rename."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """Записать текстовый файл атомарно (UTF-8)."""
+    atomic_write_bytes(path, text.encode("utf-8"))
+
+class JsonlJournal:
+    """Журнал JSON Lines (только дозапись, .gz — членами gzip); подклассы задают _apply и _snapshot."""
+
+    FLUSH_EVERY = 50
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.changed = False
+        self._pending = []
+        self._log_lines = 0
+        self._lock = threading.RLock()
+
+    def _open(self, mode: str):
+        if self.path.suffix == ".gz":
+            return gzip.open(self.path, mode + "t", encoding="utf-8", compresslevel=6)
+        return open(self.path, mode, encoding="utf-8")
+
+    def _read(self):
+        """Записи журнала по порядку; повреждённые строки и обрезанный хвост пропускаются."""
+        if not self.path.exists():
+            return
+        lineno = 0
+        with self._open("r") as f:
+            try:
+                for lineno, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Пропущена повреждённая строка {lineno} в {self.path}")
+            except (EOFError, OSError) as e:
+                logger.warning(f"Журнал {self.path} обрезан после строки {lineno}: {e}")
+
+    def _replay(self) -> None:
+        for rec in self._read():
+            self._load(rec)
+            self._log_lines += 1
+
+    def _load(self, rec: dict) -> None:
+        self._apply(rec)
+
+    def _apply(self, rec: dict) -> None:
+        raise NotImplementedError
+
+    def _append(self, rec: dict) -> None:
+        self._pending.append(json.dumps(rec, ensure_ascii=False, separators=(',', ':')))
+
+    def _write(self, rec: dict) -> None:
+        self._apply(rec)
+        self._append(rec)
+        self.changed = True
+        if len(self._pending) >= self.FLUSH_EVERY:
+            self.flush()
+
+    def _snapshot(self):
+        """Живые записи для компактирования; None — журнал не компактируется."""
+        return None
+
+    def flush(self) -> None:
+        """Дописать накопленные изменения в журнал, при необходимости компактировать."""
+        with self._lock:
+            if self._pending:
+                with self._open("a") as f:
+                    f.write('\n'.join(self._pending) + '\n')
+                self._log_lines += len(self._pending)
+                self._pending = []
+            live = self._snapshot()
+            if live is not None and self._log_lines > 2 * len(live) + 100:
+                self.compact()
+
+    def compact(self) -> None:
+        """Переписать журнал: по одной строке на живую запись."""
+        with self._lock:
+            lines = [json.dumps(r, ensure_ascii=False, separators=(',', ':')) for r in self._snapshot()]
+            atomic_write_text(self.path, ''.join(line + '\n' for line in lines))
+            self._log_lines = len(lines)
+            self._pending = []
+            logger.info(f"Журнал {self.path.name} компактирован: {len(lines)} записей")
+
+class GeocodeStore(JsonlJournal):
+    """Кэш геокодинга: журнал JSONL (только дозапись) + индекс в памяти.
+
+    Записи хранятся под каноническим ключом адреса (lat, lon, провайдер,
+    время, срок годности, число неудач подряд); исходные написания —
+    алиасы на ключ. Каждое изменение — одна строка в конце журнала, при
+    разрастании журнал компактируется атомарной перезаписью.
+    """
+
+    def __init__(self, path: Path, clock=time.time):
+        super().__init__(path)
+        self.entries = {}
+        self.aliases = {}
+        self._clock = clock
+        self._replay()
+
+    def _apply(self, rec: dict) -> None:
+        if "alias" in rec:
+            self.aliases[rec["alias"]] = rec["key"]
+        else:
+            self.entries[rec["key"]] = rec
+
+    def _snapshot(self) -> list:
+        return list(self.entries.values()) + [{"alias": a, "key": k} for a, k in self.aliases.items()]
+
+    def __contains__(self, addr: str) -> bool:
+        return addr in self.aliases
+
+    def __iter__(self):
+        return iter(self.aliases)
+
+    def __len__(self) -> int:
+        return len(self.aliases)
+
+    def __getitem__(self, addr: str) -> list:
+        entry = self.entries[self.aliases[addr]]
+        return [entry["lat"], entry["lon"]]
+
+    def lookup(self, addr: str):
+        """Найти запись по исходной строке или по каноническому ключу."""
+        key = self.aliases.get(addr)
+        if key is None:
+            key = canonical_address(addr)
+        return self.entries.get(key)
+
+    def alias(self, addr: str, key: str) -> None:
+        """Запомнить ещё одно написание для существующего ключа."""
+        with self._lock:
+            if self.aliases.get(addr) != key:
+                self._write({"alias": addr, "key": key})
+
+    def put(self, addr: str, coords, provider: str = None) -> dict:
+        """Сохранить найденные координаты (upsert за O(1))."""
+        now = int(self._clock())
+        entry = {
+            "key": canonical_address(addr), "lat": coords[0], "lon": coords[1],
+            "provider": provider, "ts": now,
+            "expires": now + GEOCODE_POSITIVE_TTL if GEOCODE_POSITIVE_TTL > 0 else None,
+            "failures": 0,
+        }
+        with self._lock:
+            self._write(entry)
+            self.alias(addr, entry["key"])
+        return entry
+
+    def put_negative(self, addr: str) -> dict:
+        """Сохранить неудачу; следующий повтор откладывается экспоненциально."""
+        key = canonical_address(addr)
+        now = int(self._clock())
+        with self._lock:
+            prev = self.entries.get(key)
+            failures = prev["failures"] + 1 if prev and prev["lat"] is None else 1
+            ttl = min(GEOCODE_NEGATIVE_TTL_MAX, GEOCODE_NEGATIVE_TTL * 2 ** (failures - 1))
+            entry = {
+                "key": key, "lat": None, "lon": None, "provider": None,
+                "ts": now, "expires": now + int(ttl), "failures": failures,
+            }
+            self._write(entry)
+            self.alias(addr, key)
+        return entry
+
+    def import_legacy(self, cache: dict) -> None:
+        """Перенести словарь из geocode_cache.json (адрес → [lat, lon])."""
+        for addr, coords in migrate_cache(cache).items():
+            if coords != [None, None]:
+                if canonical_address(addr) in self.entries:
+                    self.alias(addr, canonical_address(addr))
+                else:
+                    self.put(addr, coords, "legacy")
+            elif self.lookup(addr) is None:
+                self.put_negative(addr)
+
+    def export(self) -> dict:
+        """Словарь для фронтенда: каждое написание → [lat, lon] (только найденные)."""
+        out = {}
+        for addr, key in self.aliases.items():
+            entry = self.entries.get(key)
+            if entry and entry["lat"] is not None:
+                out[addr] = [entry["lat"], entry["lon"]]
+        return out
+
+def open_cache() -> GeocodeStore:
+    """Открыть журнал кэша; при первом запуске импортировать geocode_cache.json."""
+    store = GeocodeStore(CACHE_STORE)
+    if not CACHE_STORE.exists():
+        legacy = load_cache()
+        if legacy:
+            store.import_legacy(legacy)
+            logger.info(f"Импортирован кэш из {CACHE_FILE}: {len(store.entries)} записей")
+    logger.info(f"Кэш открыт: {len(store.entries)} записей, {len(store.aliases)} написаний")
+    return store
+
+def address_class(addr: str) -> str:
+    """Класс адреса для статистики провайдеров: venue/street + город области.
+
+    venue — перед адресом стоит название площадки («Пармезан, Карла Маркса 18»),
+    town — упомянут город из CITY_WORDS помимо Калининграда.
+    """
+    parts = [p.strip() for p in (addr or "").split(",") if p.strip()]
+    venue = len(parts) > 1 and not re.search(r"\d", parts[0])
+    town = re.search(CITY_WORDS, re.sub(r"калининград", "", addr or "", flags=re.I), re.I) is not None
+    return ("venue" if venue else "street") + ("+town" if town else "")
+
+class JsonState:
+    """Состояние в JSON-файле: читается целиком при запуске, пишется атомарно при изменениях."""
+
+    LABEL = "состояние"  # для предупреждения о нечитаемом файле
+
+    @classmethod
+    def load(cls, path: Path):
+        try:
+            return cls(json.loads(path.read_text(encoding="utf-8")))
+        except FileNotFoundError:
+            return cls()
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить {cls.LABEL}: {e}")
+            return cls()
+
+    def save(self, path: Path) -> None:
+        # Сериализуется под _lock подкласса: потоки геокодинга могут писать в data
+        with self._lock:
+            if not self.changed:
+                return
+            text = json.dumps(self.data, ensure_ascii=False, indent=2, sort_keys=True)
+            self.changed = False
+        atomic_write_text(path, text)
+
+class ProviderStats(JsonState):
+    """Успехи и задержки провайдеров по классам адресов; порядок каскада по ним.
+
+    Для каждого класса и провайдера хранятся попытки, успехи и суммарное
+    время вызова (с ожиданием ограничителя скорости). Порядок минимизирует
+    ожидаемую стоимость до первого успеха: провайдеры сортируются по
+    p / c, где p — сглаженная доля успехов, c — среднее время попытки, но
+    не меньше паузы провайдера из DEFAULT_DELAYS. Пока у класса меньше
+    GEOCODE_STATS_MIN попыток на провайдера, берётся общая статистика, а без
+    неё — статический порядок GEOCODERS. Счётчики делятся пополам при
+    превышении GEOCODE_STATS_WINDOW, чтобы порядок следовал за изменениями.
+    """
+
+    ALL = "*"
+    LABEL = "статистику геокодеров"
+
+    def __init__(self, data: dict = None):
+        self.data = data or {}
+        self.changed = False
+        self._lock = threading.Lock()
+
+    def record(self, addr: str, provider: str, success: bool, seconds: float) -> None:
+        """Учесть попытку провайдера для класса адреса и для общей статистики."""
+        with self._lock:
+            for cls in (address_class(addr), self.ALL):
+                st = self.data.setdefault(cls, {}).setdefault(provider, {"calls": 0, "hits": 0, "seconds": 0.0})
+                st["calls"] += 1
+                st["hits"] += int(success)
+                st["seconds"] = round(st["seconds"] + seconds, 3)
+                if st["calls"] > GEOCODE_STATS_WINDOW:
+                    st["calls"], st["hits"], st["seconds"] = st["calls"] // 2, st["hits"] // 2, round(st["seconds"] / 2, 3)
+            self.changed = True
+
+    def _score(self, st: dict, name: str) -> float:
+        p = (st["hits"] + 1) / (st["calls"] + 2)
+        c = max(st["seconds"] / st["calls"], DEFAULT_DELAYS.get(name.upper(), 0.0), 1e-3)
+        return p / c
+
+    def snapshot(self) -> "ProviderStats":
+        """Копия статистики: порядок на весь прогон не зависит от записей потоков."""
+        with self._lock:
+            return ProviderStats({cls: {n: dict(st) for n, st in stats.items()} for cls, stats in self.data.items()})
+
+    def _scores(self, providers: list, addr: str):
+        """Оценки p / c настроенных провайдеров для класса адреса (или общие); None — мало данных."""
+        names = [p["name"] for p in providers if p["func"]]
+        with self._lock:
+            for cls in (address_class(addr), self.ALL):
+                stats = self.data.get(cls, {})
+                if names and all(stats.get(n, {}).get("calls", 0) >= GEOCODE_STATS_MIN for n in names):
+                    return {n: self._score(stats[n], n) for n in names}
+        return None
+
+    def order(self, providers: list, addr: str) -> list:
+        """Провайдеры в порядке убывания p / c; при нехватке данных — как есть."""
+        scores = self._scores(providers, addr)
+        if scores is None:
+            return providers
+        # sorted стабилен: при равных оценках сохраняется статический порядок
+        return sorted(providers, key=lambda p: -scores.get(p["name"], -1.0))
+
+    def contenders(self, providers: list, addr: str) -> set:
+        """Провайдеры, с которых можно начать вместо лучшего: p / c не ниже GEOCODE_SPREAD_SCORE от лучшего.
+
+        При нехватке данных — все настроенные: порядок всё равно статический.
+        """
+        scores = self._scores(providers, addr)
+        if scores is None:
+            return {p["name"] for p in providers if p["func"]}
+        best = max(scores.values())
+        return {n for n, score in scores.items() if score >= GEOCODE_SPREAD_SCORE * best}
+
+class CircuitBreakers(JsonState):
+    """Автоматы отключения провайдеров: closed → open → half-open → closed."""
+
+    LABEL = "состояние автоматов геокодеров"
+
+    def __init__(self, data: dict = None, clock=time.time):
+        self.data = data or {}
+        self.changed = False
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._probing = set()
+        self._announced = set()
+
+    def permit(self, name: str):
+        """Можно ли вызвать провайдера: "closed", "half_open" (пробный вызов) или None."""
+        with self._lock:
+            st = self.data.get(name)
+            if not st or st["state"] == "closed":
+                return "closed"
+            remaining = st["opened"] + st["cooldown"] - self._clock()
+            if name in self._probing or remaining > 0:
+                if name not in self._announced:
+                    self._announced.add(name)
+                    logger.warning(f"[{name:9}] автомат разомкнут, провайдер пропускается"
+                                   f"{f' ещё {remaining / 60:.0f} мин' if remaining > 0 else ''}")
+                return None
+            self._probing.add(name)
+            st["state"] = "half_open"
+            self.changed = True
+            return "half_open"
+
+    def release(self, name: str) -> None:
+        """Снять пробный вызов без исхода (попытка отменена), следующий вызов снова станет пробным."""
+        with self._lock:
+            self._probing.discard(name)
+
+    def record(self, name: str, ok: bool, fatal: bool = False, probe: bool = False) -> None:
+        """Учесть исход вызова; fatal — квота или ключ, размыкает сразу."""
+        with self._lock:
+            if probe:
+                self._probing.discard(name)
+            st = self.data.get(name)
+            if ok:
+                if st:
+                    if st["state"] != "closed":
+                        logger.info(f"[{name:9}] автомат замкнут, провайдер снова отвечает")
+                    del self.data[name]
+                    self._announced.discard(name)
+                    self.changed = True
+                return
+            st = st or self.data.setdefault(name, {"state": "closed", "failures": 0, "opened": 0, "cooldown": 0})
+            if st["state"] == "open":
+                return  # ответ вызова, начатого до размыкания
+            st["failures"] += 1
+            if probe or fatal or st["failures"] >= GEOCODE_BREAKER_FAILURES:
+                cooldown = min(GEOCODE_BREAKER_COOLDOWN_MAX, st["cooldown"] * 2) if probe and st["cooldown"] \
+                    else GEOCODE_BREAKER_COOLDOWN
+                st.update(state="open", opened=round(self._clock()), cooldown=cooldown)
+                metrics.count("provider_circuit_open_total", provider=name)
+                reason = "квота или ключ" if fatal else f"ошибок подряд: {st['failures']}"
+                logger.warning(f"[{name:9}] автомат разомкнут на {cooldown / 60:.0f} мин ({reason})")
+            self.changed = True
+
+def cache_lookup(addr: str):
+    """Проверить кэш: (lat, lon) при попадании, (None, None) для свежей
+    отрицательной записи, None — если нужно спрашивать провайдеров."""
+    entry = geocache.lookup(addr)
+    if entry is None:
+        metrics.count("cache_lookups_total", result="miss")
+        return None
+
+    now = time.time()
+    expired = entry["expires"] is not None and now >= entry["expires"]
+    if entry["lat"] is None:
+        if expired:
+            metrics.count("cache_lookups_total", result="expired")
+            logger.info(f"[CACHE    ] EXP | {addr} → повторная попытка (неудач: {entry['failures']})")
+            return None
+        metrics.count("cache_lookups_total", result="negative_hit")
+        logger.info(f"[CACHE    ] HIT | {addr} → координаты не найдены, повтор через {(entry['expires'] - now) / 3600:.1f} ч")
+        return (None, None)
+
+    if expired:
+        metrics.count("cache_lookups_total", result="expired")
+        logger.info(f"[CACHE    ] EXP | {addr} → обновляем координаты")
+        return None
+    metrics.count("cache_lookups_total", result="hit")
+    if addr not in geocache:
+        geocache.alias(addr, entry["key"])
+        logger.info(f"[CACHE    ] HIT | {addr} ≈ {entry['key']} → {entry['lat']:.6f},{entry['lon']:.6f}")
+    else:
+        logger.info(f"[CACHE    ] HIT | {addr} → {entry['lat']:.6f},{entry['lon']:.6f}")
+    return (entry["lat"], entry["lon"])
+
+def in_region(coords) -> bool:
+    """Координаты внутри REGION_BBOX."""
+    lon_min, lat_min, lon_max, lat_max = REGION_BBOX
+    return lat_min <= coords[0] <= lat_max and lon_min <= coords[1] <= lon_max
+
+def try_provider(addr: str, provider: dict, region: bool = False, cancel: threading.Event = None):
+    """Одна попытка провайдера; лог, метрики и статистика.
+
+    Возвращает [lat, lon], [] — провайдер ответил, но адреса не нашёл, или
+    None — ошибка либо разомкнутый автомат (breakers), провайдер не вызван.
+    С region=True ответ вне REGION_BBOX считается ответом без результата.
+    Выставленный cancel (resolve_hedged) останавливает повторы обёртки
+    rate_limited, а исход не пишется в geolog, provider_stats и breakers.
+    """
+    import requests
+    import geopy.exc
+
+    name, func = provider["name"], provider["func"]
+    permit = breakers.permit(name) if breakers is not None else "closed"
+    if permit is None:
+        metrics.count("provider_calls_total", provider=name, outcome="circuit_open")
+        return None
+    def log(success, detail):
+        if cancel is None or not cancel.is_set():
+            log_geocoding(addr, name, success, detail)
+
+    outcome = "error"
+    started = time.perf_counter()
+    try:
+        with metrics.timer(f"geocode.{name}"):
+            loc = func(addr, cancel=cancel) if cancel is not None and hasattr(func, "bucket") else func(addr)
+        if loc:
+            coords = [loc.latitude, loc.longitude]
+            if region and not in_region(coords):
+                outcome = "out_of_region"
+                log(False, f"вне области: {coords[0]:.6f},{coords[1]:.6f}")
+                return []
+            outcome = "ok"
+            log(True, f"{coords[0]:.6f},{coords[1]:.6f}")
+            return coords
+        outcome = "no_result"
+        log(False, "no result")
+        return []
+    except requests.exceptions.RequestException as e:
+        log(False, f"HTTP error: {e}")
+    except geopy.exc.GeocoderRateLimited as e:
+        log(False, f"Geocoding error: {e}")
+    except quota_errors() as e:
+        outcome = "quota"
+        log(False, f"Quota or key error: {e}")
+    except geopy.exc.GeopyError as e:
+        log(False, f"Geocoding error: {e}")
+    except Exception as e:
+        log(False, f"Unexpected error: {e}")
+    finally:
+        if cancel is not None and cancel.is_set():
+            outcome = "cancelled"
+        metrics.count("provider_calls_total", provider=name, outcome=outcome)
+        if provider_stats is not None and outcome != "cancelled":
+            provider_stats.record(addr, name, outcome == "ok", time.perf_counter() - started)
+        if breakers is not None and outcome != "cancelled":
+            breakers.record(name, outcome not in ("error", "quota"), outcome == "quota", permit == "half_open")
+        elif breakers is not None and permit == "half_open":
+            breakers.release(name)
+    return None
+
+_hedge_pool = None
+
+def hedge_delay(name: str) -> float:
+    """Через сколько секунд запускать следующий провайдер после name."""
+    if GEOCODE_HEDGE_DELAY > 0:
+        return GEOCODE_HEDGE_DELAY
+    p90 = metrics.quantile("provider_latency_seconds", 0.9, provider=name)
+    return p90 if p90 is not None else GEOCODE_HEDGE_DEFAULT
+
+def resolve_hedged(addr: str, providers: list) -> tuple:
+    """Каскад с хеджированием: ([lat, lon] или None, провайдер) как у resolve_addr.
+
+    Первый провайдер запускается сразу, следующий — когда предыдущий не
+    ответил за hedge_delay() или ответил неудачей. Побеждает первый ответ
+    внутри REGION_BBOX; ещё не начатые попытки отменяются, уже идущие
+    получают сигнал отмены: дожидаются текущего запроса, но не повторяют
+    его и не пишут в лог и статистику. Каждый вызов проходит через
+    ограничитель скорости своего провайдера.
+    """
+    global _hedge_pool
+    with _init_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=max(1, GEOCODE_WORKERS) * 3, thread_name_prefix="hedge")
+
+    waiting = list(providers)
+    pending, answered = {}, None
+    cancel = threading.Event()
+    while waiting or pending:
+        if waiting:
+            provider = waiting.pop(0)
+            pending[_hedge_pool.submit(try_provider, addr, provider, True, cancel)] = provider["name"]
+        done, _ = wait(pending, timeout=hedge_delay(provider["name"]) if waiting else None,
+                       return_when=FIRST_COMPLETED)
+        for future in done:
+            name = pending.pop(future)
+            coords = future.result()
+            if coords:
+                cancel.set()
+                for other in pending:
+                    other.cancel()
+                metrics.count("geocode_hedge_total", outcome="primary" if name == providers[0]["name"] else "hedge")
+                return coords, name
+            if coords is not None and answered is None:
+                answered = name
+    metrics.count("geocode_hedge_total", outcome="failed")
+    return None, answered
+
+def resolve_addr(addr: str, stats: ProviderStats = None, first: str = None) -> tuple:
+    """Пройти каскад GEOCODERS без обращения к кэшу: ([lat, lon] или None, провайдер).
+
+    Если адрес не найден, провайдер — первый ответивший «нет результата»;
+    None — ни один провайдер не ответил (ошибки, разомкнутые автоматы).
+    stats — снимок статистики для порядка провайдеров (по умолчанию provider_stats),
+    first — провайдер, с которого начать (spread_starts), остальные — в прежнем
+    порядке; при адаптивном порядке он берётся, только если его оценка
+    близка к лучшей (ProviderStats.contenders), иначе каскад начинается с лучшего.
+    """
+    providers = get_geocoders()
+    stats = provider_stats if stats is None else stats
+    ranked = stats is not None and GEOCODE_ADAPTIVE
+    if ranked:
+        providers = stats.order(providers, addr)
+    if first and (not ranked or first in stats.contenders(providers, addr)):
+        providers = sorted(providers, key=lambda p: p["name"] != first)
+
+    configured = [p for p in providers if p["func"]]
+    if GEOCODE_HEDGE and len(configured) > 1:
+        return resolve_hedged(addr, configured)
+
+    answered = None
+    for provider in providers:
+        if not provider["func"]:
+            log_geocoding(addr, provider["name"], False, "key not configured")
+            continue
+        coords = try_provider(addr, provider)
+        if coords:
+            return coords, provider["name"]
+        if coords is not None and answered is None:
+            answered = provider["name"]
+    return None, answered
+
+def remember(addr: str, coords, provider) -> tuple:
+    """Записать результат каскада в кэш и вернуть координаты.
+
+    Отрицательная запись ставится, только если провайдер ответил «нет
+    результата»: сбой или разомкнутые автоматы не откладывают адрес.
+    """
+    if coords:
+        geocache.put(addr, coords, provider)
+        if gazetteer is not None and provider != "gazetteer":
+            gazetteer.add(addr, coords[0], coords[1])
+        return tuple(coords)
+
+    # Устаревшие координаты лучше, чем никаких
+    entry = geocache.lookup(addr)
+    if entry is not None and entry["lat"] is not None:
+        logger.warning(f"Все геокодеры не удались для: {addr}, оставляем прежние координаты")
+        return (entry["lat"], entry["lon"])
+
+    if provider is None:
+        metrics.count("geocode_unanswered_total")
+        logger.warning(f"Ни один геокодер не ответил для: {addr}, повторим в следующем прогоне")
+        return (None, None)
+
+    entry = geocache.put_negative(addr)
+    logger.warning(f"Все геокодеры не удались для: {addr} (неудач подряд: {entry['failures']})")
+    return (None, None)
+
 def geocode_addr(addr: str) -> tuple:
     """Каскадный геокодинг с обработкой ошибок."""
     if not addr or not addr.strip():
@@ -155,63 +1427,218 @@ def geocode_addr(addr: str) -> tuple:
 
     addr = addr.strip()
 
-    # Сначала проверить кэш
-    if addr in geocache:
-        cached_coords = geocache[addr]
-        if cached_coords != [None, None]:
-            logger.info(f"[CACHE    ] HIT | {addr} → {cached_coords[0]:.6f},{cached_coords[1]:.6f}")
-            return tuple(cached_coords)
-        else:
-            logger.info(f"[CACHE    ] HIT | {addr} → координаты не найдены")
-
-    # Попытаться использовать сервисы геокодинга
-    for provider in GEOCODERS:
-        name, func = provider["name"], provider["func"]
-        if not func:
-            log_geocoding(addr, name, False, "key not configured")
+    # Сначала проверить кэш (в том числе другие написания и отрицательные записи)
+    cached = cache_lookup(addr)
+    if cached is not None:
+        return cached
+
+    # Затем локальный газеттир — близкие написания известных адресов без сети
+    coords = gazetteer_lookup(addr)
+    if coords is not None:
+        return remember(addr, coords, "gazetteer")
+
+    coords, provider = resolve_addr(addr)
+    return remember(addr, coords, provider)
+
+def lookup_known(addresses) -> tuple:
+    """Уникальные адреса, найденные без провайдеров, и промахи.
+
+    Возвращает (уникальные адреса, {адрес: (lat, lon)} из кэша и газеттира,
+    {канонический адрес: [варианты написания]} для провайдеров).
+    """
+    unique = list(dict.fromkeys(a.strip() for a in addresses if a and a.strip()))
+    results, misses = {}, {}
+    for addr in unique:
+        cached = cache_lookup(addr)
+        if cached is not None:
+            results[addr] = cached
             continue
+        coords = gazetteer_lookup(addr)
+        if coords is not None:
+            results[addr] = remember(addr, coords, "gazetteer")
+        else:
+            misses.setdefault(canonical_address(addr), []).append(addr)
+    return unique, results, misses
+
+def remember_group(group: list, coords, provider) -> tuple:
+    """Записать результат для первого написания адреса, остальные — псевдонимами."""
+    leader = group[0]
+    result = remember(leader, coords, provider)
+    for addr in group[1:]:
+        geocache.alias(addr, canonical_address(leader))
+    return result
+
+def geocode_all(addresses, workers: int = None) -> dict:
+    """Геокодировать уникальные адреса параллельно.
+
+    Потоки проходят каскад resolve_addr; провайдеры разделяют свои token
+    bucket, поэтому пока один адрес ждёт ArcGIS, другой может уже
+    спрашивать Yandex или Nominatim. Кэш пишется только из вызывающего
+    потока в порядке входных адресов, так что результат детерминирован.
+    Варианты одного канонического адреса запрашиваются один раз.
+    Возвращает {адрес: (lat, lon)}.
+    """
+    stats = stats_snapshot()
+    unique, results, misses = lookup_known(addresses)
+    resolve_misses(misses, results, workers, stats)
+    return {addr: results[addr] for addr in unique}
+
+def spread_starts(providers: list, n: int) -> list:
+    """Первый провайдер для каждого из n адресов пропорционально скорости его token bucket.
+
+    Взвешенный круговой обход зависит только от номера адреса, поэтому
+    результат не зависит от числа потоков. Пусто, если провайдер один или у
+    кого-то нет ограничения скорости, — тогда все адреса начинают с первого.
+    """
+    buckets = [getattr(p["func"], "bucket", None) for p in providers if p["func"]]
+    if len(buckets) < 2 or any(b is None or not 0 < b.rate < float("inf") for b in buckets):
+        return []
+    names = [p["name"] for p in providers if p["func"]]
+    rates = [b.rate for b in buckets]
+    total, credit, starts = sum(rates), [0.0] * len(rates), []
+    for _ in range(n):
+        credit = [c + r for c, r in zip(credit, rates)]
+        best = credit.index(max(credit))
+        credit[best] -= total
+        starts.append(names[best])
+    return starts
+
+def stats_snapshot():
+    """Снимок provider_stats на прогон geocode_all/geocode_many или None."""
+    return provider_stats.snapshot() if provider_stats is not None and GEOCODE_ADAPTIVE else None
+
+def resolve_misses(misses: dict, results: dict, workers: int = None, stats: ProviderStats = None) -> None:
+    """Пройти каскад для промахов lookup_known параллельно; результаты — в results и кэш.
+
+    stats — снимок статистики, по которому упорядочиваются провайдеры всех адресов.
+    С GEOCODE_SPREAD и несколькими потоками первые попытки распределяются
+    между провайдерами (spread_starts), чтобы потоки не стояли в очереди
+    одного token bucket; в одном потоке очереди нет, и каскад идёт в
+    порядке статистики.
+    """
+    workers = GEOCODE_WORKERS if workers is None else workers
+    leaders = [group[0] for group in misses.values()]
+    parallel = workers > 1 and len(leaders) > 1
+    firsts = (spread_starts(get_geocoders(), len(leaders)) if GEOCODE_SPREAD and parallel else []) or [None] * len(leaders)
+
+    def resolve(addr, first):
+        return resolve_addr(addr, stats, first)
+
+    if not parallel:
+        mapped = map(resolve, leaders, firsts)
+        pool = None
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="geocode")
+        mapped = pool.map(resolve, leaders, firsts)
 
+    try:
+        for processed, (leader, (coords, provider)) in enumerate(zip(leaders, mapped), 1):
+            group = misses[canonical_address(leader)]
+            results.update(dict.fromkeys(group, remember_group(group, coords, provider)))
+            if processed % 10 == 0:
+                logger.info(f"Прогресс геокодинга: {processed}/{len(leaders)}")
+    finally:
+        if pool:
+            pool.shutdown(wait=True)
+
+    # Детерминированный порядок лога независимо от порядка завершения потоков
+    with _geolog_lock:
+        for addr in leaders:
+            if addr in geolog:
+                geolog[addr] = geolog.pop(addr)
+
+def batch_resolve(provider: dict, leaders: list, chunk_size: int) -> dict:
+    """Отправить адреса пакетному провайдеру пачками по chunk_size: {адрес: [lat, lon]}.
+
+    Совпадения вне REGION_BBOX не принимаются. Ошибка пачки или
+    разомкнутый автомат прекращают пакетную отправку: оставшиеся адреса
+    вернутся в каскад.
+    """
+    name, resolved = provider["name"], {}
+    for start in range(0, len(leaders), chunk_size):
+        chunk = leaders[start:start + chunk_size]
+        permit = breakers.permit(name) if breakers is not None else "closed"
+        if permit is None:
+            metrics.count("provider_batch_calls_total", provider=name, outcome="circuit_open")
+            break
+        outcome, started = "error", time.perf_counter()
         try:
-            loc = func(addr)
-            if loc:
-                coords = [loc.latitude, loc.longitude]
-                geocache[addr] = coords
+            with metrics.timer(f"geocode_batch.{name}"):
+                found = provider["func"](chunk)
+            outcome = "ok"
+        except quota_errors() as e:
+            outcome = "quota"
+            logger.warning(f"[{name:9}] пачка из {len(chunk)} адресов: квота или ключ: {e}")
+        except Exception as e:
+            logger.warning(f"[{name:9}] пачка из {len(chunk)} адресов не удалась: {e}")
+        finally:
+            metrics.count("provider_batch_calls_total", provider=name, outcome=outcome)
+            if breakers is not None:
+                breakers.record(name, outcome == "ok", outcome == "quota", permit == "half_open")
+        if outcome != "ok":
+            break
+
+        share = (time.perf_counter() - started) / len(chunk)
+        for addr, coords in zip(chunk, found):
+            ok = bool(coords) and in_region(coords)
+            if ok:
+                resolved[addr] = coords
                 log_geocoding(addr, name, True, f"{coords[0]:.6f},{coords[1]:.6f}")
-                return tuple(coords)
             else:
-                log_geocoding(addr, name, False, "no result")
-        except requests.exceptions.RequestException as e:
-            log_geocoding(addr, name, False, f"HTTP error: {e}")
-        except geopy.exc.GeopyError as e:
-            log_geocoding(addr, name, False, f"Geocoding error: {e}")
-        except Exception as e:
-            log_geocoding(addr, name, False, f"Unexpected error: {e}")
+                log_geocoding(addr, name, False, f"вне области: {coords[0]:.6f},{coords[1]:.6f}" if coords else "no match")
+            metrics.count("geocode_batch_addresses_total", provider=name, result="matched" if ok else "unmatched")
+            if provider_stats is not None:
+                provider_stats.record(addr, name, ok, share)
+    return resolved
+
+def geocode_many(addresses, chunk_size: int = None, workers: int = None) -> dict:
+    """Пакетный геокодинг: как geocode_all, но промахи кэша сначала идут пачками.
+
+    Адреса без записи в кэше и газеттире (по одному на канонический адрес)
+    отправляются пакетным провайдерам (build_batch_geocoders) пачками по
+    chunk_size — N вызовов с ожиданием в token bucket превращаются в
+    N / chunk_size. Не найденные пачкой проходят обычный каскад. Без
+    пакетных провайдеров равносилен geocode_all. Возвращает {адрес: (lat, lon)}.
+    """
+    chunk_size = chunk_size or GEOCODE_BATCH_SIZE
+    stats = stats_snapshot()
+    unique, results, misses = lookup_known(addresses)
+    for provider in get_batch_geocoders():
+        if not misses:
+            break
+        leaders = [group[0] for group in misses.values()]
+        logger.info(f"[{provider['name']:9}] пакетный геокодинг: {len(leaders)} адресов пачками по {chunk_size}")
+        for addr, coords in batch_resolve(provider, leaders, chunk_size).items():
+            group = misses.pop(canonical_address(addr))
+            results.update(dict.fromkeys(group, remember_group(group, coords, provider["name"])))
+    resolve_misses(misses, results, workers, stats)
+    return {addr: results[addr] for addr in unique}
 
-    # Все геокодеры не удались
-    geocache[addr] = [None, None]
-    logger.warning(f"Все геокодеры не удались для: {addr}")
-    return (None, None)
+def vk_request(method: str, params: dict, attempts: int = 3, domain: str = None) -> dict:
+    """Вызвать метод VK API с обработкой ошибок и повторами; вернуть весь ответ.
 
-def vk_wall(offset: int, attempts: int = 3):
-    """Получить посты стены VK с обработкой ошибок и повторами."""
-    params = {
-        'domain': DOMAIN,
-        'offset': offset,
-        'count': BATCH,
-        'access_token': TOKEN,
-        'v': '5.199'
-    }
+    Каждая попытка ждёт слот общего лимитера VK в очереди группы domain.
+    """
+    import requests
+
+    params = dict(params, access_token=TOKEN, v=VK_VERSION)
+    limiter = get_vk_limiter()
 
     for attempt in range(1, attempts + 1):
+        limiter.acquire(domain or DOMAIN)
+        metrics.count("vk_requests_total", method=method)
         try:
-            r = session.get("https://api.vk.ru/method/wall.get", params=params, timeout=20)
+            with metrics.timer(f"vk.{method}"):
+                r = get_session().get(f"{VK_API}/{method}", params=params, timeout=20)
             r.raise_for_status()
 
             data = r.json()
             if 'error' in data:
                 raise RuntimeError(f"VK API error: {data['error']}")
+            if 'response' not in data:
+                raise KeyError('response')
 
-            return data['response']['items']
+            return data
 
         except requests.exceptions.Timeout:
             logger.warning(f"VK request timeout (attempt {attempt}/{attempts})")
@@ -229,197 +1656,1265 @@ def vk_wall(offset: int, attempts: int = 3):
 
     raise RuntimeError(f"Failed to fetch VK data after {attempts} attempts")
 
-CITY_WORDS = r"(калининград|гурьевск|светлогорск|янтарный|зеленоградск|пионерский|балтийск|поселок|пос\.|г\.)"
+def vk_wall(offset: int, attempts: int = 3, domain: str = None):
+    """Получить посты стены VK с обработкой ошибок и повторами."""
+    domain = domain or DOMAIN
+    params = {
+        'domain': domain,
+        'offset': offset,
+        'count': BATCH,
+    }
+    try:
+        with metrics.timer("vk_wall"):
+            return vk_request("wall.get", params, attempts, domain)['response']['items']
+    except (KeyError, TypeError) as e:
+        raise RuntimeError(f"Unexpected VK response format: {e}")
+
+def vk_wall_pages(offsets: list, domain: str = None) -> list:
+    """Получить несколько страниц стены одним вызовом execute (до 25 wall.get).
+
+    Упавшие подзапросы (false в response + execute_errors) и отказ самого
+    execute перезапрашиваются обычным wall.get. Страницы после первой
+    пустой отбрасываются — стена закончилась.
+    """
+    domain = domain or DOMAIN
+    calls = ", ".join(
+        f"API.wall.get({json.dumps({'domain': domain, 'offset': o, 'count': BATCH}, ensure_ascii=False)})"
+        for o in offsets
+    )
+    try:
+        with metrics.timer("vk_wall"):
+            data = vk_request("execute", {'code': f"return [{calls}];"}, domain=domain)
+        results = data['response'] if isinstance(data['response'], list) else []
+        for err in data.get('execute_errors', []):
+            logger.warning(f"VK execute: {err.get('method')} → {err.get('error_code')} {err.get('error_msg')}")
+    except RuntimeError as e:
+        logger.warning(f"VK execute не удался ({e}), загружаем страницы по одной")
+        results = []
+
+    pages = []
+    for i, offset in enumerate(offsets):
+        result = results[i] if i < len(results) else None
+        if isinstance(result, dict) and isinstance(result.get('items'), list):
+            pages.append(result['items'])
+        else:
+            logger.info(f"Повторяем страницу со смещением {offset} через wall.get")
+            pages.append(vk_wall(offset, domain=domain))
+        if not pages[-1]:
+            break
+    return pages
+
+def iter_wall_pages(pages_per_call: int = None, prefetch: bool = None, domain: str = None):
+    """Страницы стены (списки постов) от новых к старым, до MAX_POSTS.
+
+    При pages_per_call > 1 страницы берутся пачками через execute, при
+    prefetch следующий вызов к VK уходит в фоне, пока вызывающий код
+    разбирает текущие страницы. Паузу между вызовами выдерживает общий
+    лимитер VK (get_vk_limiter).
+    """
+    pages_per_call = max(1, min(VK_EXECUTE_LIMIT, pages_per_call or VK_EXECUTE_PAGES))
+    prefetch = VK_PREFETCH if prefetch is None else prefetch
+
+    def fetch(offset):
+        n = max(1, min(pages_per_call, -(-(MAX_POSTS - offset) // BATCH)))
+        if n == 1:
+            return [vk_wall(offset, domain=domain)]
+        return vk_wall_pages([offset + i * BATCH for i in range(n)], domain=domain)
+
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vk-prefetch") if prefetch else None
+    offset = 0
+    future = pool.submit(fetch, offset) if pool else None
+    try:
+        while offset < MAX_POSTS:
+            pages = future.result() if pool else fetch(offset)
+            offset += len(pages) * BATCH
+            more = offset < MAX_POSTS and bool(pages[-1])
+            if pool and more:
+                future = pool.submit(fetch, offset)
+            for page in pages:
+                yield page
+                if not page:
+                    return
+            if not more:
+                return
+    finally:
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
 
-def extract(text: str):
-    """Извлечь данные события из текста поста VK."""
-    if not text:
-        return None
+def load_state() -> dict:
+    """Загрузить отметки инкрементальной загрузки ({группа: {last_id, last_date, pending}})."""
+    if not STATE_FILE.exists():
+        return {}
+    try:
+        return json.loads(STATE_FILE.read_text(encoding='utf-8'))
+    except (json.JSONDecodeError, IOError) as e:
+        logger.warning(f"Не удалось загрузить {STATE_FILE}: {e}, загружаем стену целиком")
+        return {}
 
-    # Попробовать разные паттерны даты
-    date_patterns = [
-        r"\b(\d{2})\.(\d{2})\b",  # DD.MM
-        r"\b(\d{2})/(\d{2})\b",   # DD/MM
-        r"\b(\d{1,2})\.(\d{1,2})\b",  # D.M или DD.MM
-    ]
+def save_state(state: dict) -> None:
+    """Сохранить отметки инкрементальной загрузки."""
+    try:
+        atomic_write_text(STATE_FILE, json.dumps(state, ensure_ascii=False, indent=2))
+    except IOError as e:
+        logger.error(f"Не удалось сохранить {STATE_FILE}: {e}")
+
+def fetch_posts(mark: dict, on_post=None, domain: str = None) -> tuple:
+    """Листать стену, пока не встретится уже обработанный пост.
+
+    mark — отметка группы из vk_state.json. Закреплённый пост стоит первым
+    вне хронологии, поэтому старый закреп пропускается и не останавливает
+    листание. После отметки дочитывается ещё VK_RESCAN_POSTS постов, чтобы
+    поймать правки. on_post вызывается для каждого принятого поста сразу,
+    пока следующая страница может догружаться в фоне. Возвращает (посты к
+    обработке, новая отметка, пройдено ли листание без ошибок).
+    """
+    last_id = mark.get("last_id", 0)
+    newest = {"last_id": last_id, "last_date": mark.get("last_date")}
+    posts, known, offset = [], 0, 0
+    pages = iter_wall_pages(domain=domain)
 
-    date_match = None
-    for pattern in date_patterns:
-        date_match = re.search(pattern, text)
-        if date_match:
-            break
+    try:
+        for items in pages:
+            if not items:
+                logger.info("Больше постов не найдено")
+                break
 
-    # Попробовать разные маркеры местоположения
-    loc_patterns = [
-        r"📍\s*(.+)",      # 📍
-        r"📍\s*([^📍\n]+)", # 📍 до следующего эмодзи или новой строки
-        r"место[:\s]*(.+)", # "место:"
-        r"адрес[:\s]*(.+)", # "адрес:"
-    ]
+            for item in items:
+                post_id = item.get("id", 0)
+                if post_id > newest["last_id"]:
+                    newest = {"last_id": post_id, "last_date": item.get("date")}
+                if last_id and post_id <= last_id:
+                    if item.get("is_pinned"):
+                        continue
+                    known += 1
+                    if known > VK_RESCAN_POSTS:
+                        logger.info(f"Дошли до обработанного поста {post_id}, дальше не листаем")
+                        return posts, newest, True
+                posts.append(item)
+                if on_post:
+                    on_post(item)
+
+            offset += BATCH
+    except Exception as e:
+        logger.error(f"Не удалось обработать батч с смещением {offset}: {e}")
+        return posts, newest, False
+    finally:
+        pages.close()
+
+    return posts, newest, True
+
+def vk_domains() -> dict:
+    """Группы для загрузки: {группа: город по умолчанию для extract}."""
+    domains = {}
+    for item in (VK_DOMAINS or DOMAIN).split(","):
+        name, _, city = item.strip().partition(":")
+        if name:
+            domains[name] = city.strip() or DEFAULT_EVENT_CITY
+    return domains
+
+def fetch_domains(marks: dict, on_post=None) -> dict:
+    """Загрузить несколько групп параллельно под общим лимитом VK.
+
+    Каждая группа листается в своём потоке (fetch_posts), запросы всех
+    групп делят FairLimiter и обслуживаются по кругу. on_post(группа, пост)
+    вызывается в вызывающем потоке по мере поступления постов. Возвращает
+    {группа: (посты, новая отметка, полный проход)} в порядке marks.
+    """
+    if len(marks) <= 1:
+        return {
+            domain: fetch_posts(mark, (lambda item, d=domain: on_post(d, item)) if on_post else None, domain)
+            for domain, mark in marks.items()
+        }
+
+    inbox, done = queue.Queue(), object()
+
+    def run(domain, mark):
+        try:
+            return fetch_posts(mark, lambda item: inbox.put((domain, item)), domain)
+        finally:
+            inbox.put((domain, done))
+
+    with ThreadPoolExecutor(max_workers=len(marks), thread_name_prefix="vk") as pool:
+        futures = {domain: pool.submit(run, domain, mark) for domain, mark in marks.items()}
+        remaining = len(futures)
+        while remaining:
+            domain, item = inbox.get()
+            if item is done:
+                remaining -= 1
+            elif on_post:
+                on_post(domain, item)
+        return {domain: future.result() for domain, future in futures.items()}
+
+DEFAULT_EVENT_CITY = "Калининград"  # дописывается к адресу без города
+CITY_WORDS = r"(калининград|гурьевск|светлогорск|янтарный|зеленоградск|пионерский|балтийск|поселок|пос\.|г\.)"
 
-    loc_match = None
-    for pattern in loc_patterns:
-        loc_match = re.search(pattern, text, re.I)
-        if loc_match:
+# Паттерны извлечения компилируются один раз при импорте. Первая
+# «датоподобная» позиция находится одним поиском и служит сразу и строкой
+# заголовка, и (в типичном посте «DD.MM | …») самой датой; остальные
+# паттерны даты ищутся только от неё и только если она не DD.MM.
+RE_DATE_ANY = re.compile(r"\b(\d{1,2})([./])(\d{1,2})\b")
+RE_DATES = (
+    re.compile(r"\b(\d{2})\.(\d{2})\b"),      # DD.MM
+    re.compile(r"\b(\d{2})/(\d{2})\b"),        # DD/MM
+    re.compile(r"\b(\d{1,2})\.(\d{1,2})\b"),  # D.M или DD.MM
+)
+RE_PIN = re.compile(r"📍\s*(.+)")                  # 📍
+RE_PLACES = (
+    re.compile(r"место[:\s]*(.+)", re.I),  # "место:"
+    re.compile(r"адрес[:\s]*(.+)", re.I),  # "адрес:"
+)
+RE_CITY = re.compile(CITY_WORDS, re.I)
+RE_TITLE_PREFIX = re.compile(r"^\s*\d{1,2}[./]\d{1,2}\s*\|\s*")
+RE_DATE_RANGE = re.compile(r"\b(\d{1,2})(?:\.(\d{1,2}))?\s*[-–—]\s*(\d{1,2})\.(\d{1,2})\b")  # 17-18.10, 31.10 - 03.11
+RE_AGE = re.compile(r"(?<![\d.,:+-])(0|6|12|16|18)\+(?!\d)")  # возрастная маркировка 0+ … 18+
+EVENT_TZ = datetime.strptime(EVENT_UTC_OFFSET, "%z").tzinfo
+EVENT_TZ_SUFFIX = datetime(2000, 1, 1, tzinfo=EVENT_TZ).isoformat()[19:]  # «+02:00» для start/end
+
+def _scan_post(text: str) -> tuple:
+    """Найти дату, место и позицию строки заголовка: ((день, месяц), match места, позиция) или Nones."""
+    first = RE_DATE_ANY.search(text)
+    if first is None:
+        return None, None, None
+
+    day, sep, month = first.groups()
+    if sep == '.' and len(day) == 2 and len(month) == 2:
+        date = (day, month)
+    else:
+        date = None
+        for pattern in RE_DATES:
+            m = pattern.search(text, first.start())
+            if m:
+                date = m.groups()
+                break
+        if date is None:
+            return None, None, first.start()
+
+    # 📍 ищем подстрокой — это быстрее регулярки без литерального префикса
+    place = None
+    pos = text.find('📍')
+    while pos != -1 and place is None:
+        place = RE_PIN.match(text, pos)
+        pos = text.find('📍', pos + 1)
+    for pattern in RE_PLACES:
+        if place is not None:
             break
+        place = pattern.search(text)
+
+    return date, place, first.start()
+
+def extract(text: str, default_city: str = None, posted: int = None):
+    """Извлечь данные события из текста поста VK.
+
+    default_city дописывается к адресу без города (по умолчанию Калининград).
+    posted — время публикации поста (unix): по нему выбирается год события
+    (event_year), без него берётся YEAR_DEFAULT. Начало, конец и возраст
+    (event_details) досчитываются при записи в EventStore, а не здесь.
+    """
+    if not text:
+        return None
 
+    date_match, loc_match, title_pos = _scan_post(text)
     if not (date_match and loc_match):
         logger.debug(f"No date or location found in post: {text[:100]}...")
         return None
 
-    date = f"{YEAR_DEFAULT}-{date_match.group(2).zfill(2)}-{date_match.group(1).zfill(2)}"
+    year = event_year(int(date_match[1]), int(date_match[0]), posted)
+    date = f"{year}-{date_match[1].zfill(2)}-{date_match[0].zfill(2)}"
     loc = loc_match.group(1).split('➡️')[0].split('\n')[0].strip()
 
     # Добавить город если отсутствует
-    if not re.search(CITY_WORDS, loc, re.I):
-        loc += ", Калининград"
-
-    # Заголовок: строка с датой без "DD.MM |"
-    lines = text.split('\n')
-    title = ""
-    for line in lines:
-        if re.search(r"\b\d{1,2}[./]\d{1,2}\b", line):
-            title = re.sub(r"^\s*\d{1,2}[./]\d{1,2}\s*\|\s*", "", line).strip()
-            break
+    if not RE_CITY.search(loc):
+        loc += f", {default_city or DEFAULT_EVENT_CITY}"
+
+    # Заголовок: строка с первой датой без "DD.MM |"
+    start = text.rfind('\n', 0, title_pos) + 1
+    end = text.find('\n', title_pos)
+    line = text[start:end] if end != -1 else text[start:]
+    title = RE_TITLE_PREFIX.sub("", line, count=1).strip()
 
     # Если заголовок пустой, взять первую строку
     if not title:
-        title = lines[0].strip() if lines else "Событие"
+        title = text.split('\n', 1)[0].strip()
 
     return {
         'title': title,
         'date': date,
         'location': loc,
-        'text': text
+        'text': text,
     }
 
-def main():
-    """Основной обработчик с полной обработкой ошибок."""
-    logger.info(f"VK_TOKEN present: {bool(TOKEN)}")
-    logger.info(f"DOMAIN: {DOMAIN}")
-    if not TOKEN:
-        logger.critical("VK_TOKEN не задан (секрет репозитория или .env требуется)")
-        sys.exit(1)
-
+def extract_many(texts, default_city: str = None) -> list:
+    """Пакетное извлечение: список результатов extract() в порядке входных текстов."""
+    return [extract(text, default_city) for text in texts]
+
+def event_year(month: int, day: int, posted: int = None) -> int:
+    """Год даты «день.месяц» из поста, опубликованного в момент posted (unix).
+
+    Дата считается лежащей в окне от 90 дней до публикации (отчёт о
+    прошедшем событии) до ~9 месяцев после неё (анонс): пост от 20 декабря
+    про «05.01» — январь следующего года. Без posted — YEAR_DEFAULT.
+    """
+    if not posted:
+        return int(YEAR_DEFAULT)
+    published = datetime.fromtimestamp(posted, EVENT_TZ).replace(tzinfo=None)
+    published = published.replace(hour=0, minute=0, second=0, microsecond=0)
+    for year in (published.year, published.year + 1, published.year - 1):
+        try:
+            delta = (datetime(year, month, day) - published).days
+        except ValueError:
+            continue
+        if -90 <= delta < 276:
+            return year
+    return published.year
+
+def event_details(date: str, text: str) -> dict:
+    """Начало и конец события (ISO 8601 со смещением EVENT_UTC_OFFSET) и возраст: {"start", "end", "age"}.
+
+    date — дата события из extract() с уже выбранным годом. Диапазон дат
+    на месте первой даты поста («17-18.10», «31.10 - 03.11») задаёт первый
+    и последний день, время как в event_time — часы; конец раньше начала
+    переносится на следующие сутки. Без времени событие занимает дни
+    целиком: с 00:00 первого до 23:59:59 последнего. age — наибольшая
+    маркировка «N+» в тексте (int) или None. Некорректная дата — start и
+    end None.
+    """
+    text = text or ""
+    details = {"start": None, "end": None, "age": None}
+    # «+» в постах редок: маркировку проверяем только перед ним, а не регуляркой по всему тексту
+    pos = text.find('+')
+    while pos != -1:
+        m = RE_AGE.search(text, max(0, pos - 2), pos + 2)
+        if m and m.end() == pos + 1:
+            details["age"] = max(details["age"] or 0, int(m.group(1)))
+        pos = text.find('+', pos + 1)
     try:
-        logger.info("Запуск обработки событий...")
-
-        # Загрузить существующие события
-        existing_events = []
-        if OUTPUT_JSON.exists():
+        day = datetime(int(date[:4]), int(date[5:7]), int(date[8:10]))
+    except (TypeError, ValueError):
+        return details
+    first = last = day
+
+    found = RE_DATE_ANY.search(text)
+    if found and (int(found.group(1)), int(found.group(3))) == (day.day, day.month):
+        # Диапазон ищется только в окне вокруг первой даты
+        span = RE_DATE_RANGE.search(text, max(0, found.start() - 8), found.start() + 16)
+        if span and span.start() <= found.start() < span.end():
+            d1, m1, d2, m2 = span.groups()
             try:
-                existing_events = json.loads(OUTPUT_JSON.read_text(encoding='utf-8'))
-                logger.info(f"Загружено {len(existing_events)} существующих событий")
-            except Exception as e:
-                logger.warning(f"Не удалось загрузить существующие события: {e}")
-
-        # Создать set ключей для проверки дубликатов
-        existing_keys = set()
-        for event in existing_events:
-            key = f"{event['date']}|{event['title']}|{event['location']}"
-            existing_keys.add(key)
-
-        # Загрузить кэш
-        global geocache, original_cache, geolog
-        geocache = load_cache()
-        original_cache = geocache.copy()
-        geolog = {}
-
-        # Собрать посты
-        records, offset = [], 0
-        logger.info(f"Загружаем до {MAX_POSTS} постов из группы VK '{DOMAIN}'")
-
-        while offset < MAX_POSTS:
-            try:
-                items = vk_wall(offset)
-                if not items:
-                    logger.info("Больше постов не найдено")
-                    break
-
-                for item in items:
-                    text = item.get("text") or ""
-                    logger.debug(f"Processing post: {text[:200]}...")
-                    event = extract(text)
-                    if event:
-                        # Проверить, новое ли событие
-                        event_key = f"{event['date']}|{event['title']}|{event['location']}"
-                        if event_key not in existing_keys:
-                            records.append(event)
-                            existing_keys.add(event_key)  # Добавить в set чтобы не дублировать в рамках одного запуска
-                        else:
-                            logger.debug(f"Событие уже существует: {event['title']}")
-
-                offset += BATCH
-
-                if offset < MAX_POSTS:
-                    time.sleep(WAIT_REQ)
-
-            except Exception as e:
-                logger.error(f"Не удалось обработать батч с смещением {offset}: {e}")
+                if m1 is None:  # «17-18.10»: дата события — последний день
+                    first = datetime(last.year, last.month, int(d1))
+                elif found.start() == span.start():  # «31.10 - 03.11»: дата события — первый день
+                    last = datetime(first.year, int(m2), int(d2))
+                    if last < first:
+                        last = last.replace(year=first.year + 1)
+            except ValueError:
+                first = last = day
+            if first > last:
+                first = last = day
+
+    start, end = first, last.replace(hour=23, minute=59, second=59)
+    hours = event_time(text)
+    if hours:
+        begin, _, finish = hours.partition("-")
+        h1, m1 = map(int, begin.split(":"))
+        start = first.replace(hour=h1, minute=m1)
+        if finish:
+            h2, m2 = map(int, finish.split(":"))
+            end = last.replace(hour=h2, minute=m2)
+            if (h2, m2) < (h1, m1):  # «22:00 - 04:00» — до утра следующих суток
+                end += timedelta(days=1)
+    details["start"] = start.isoformat() + EVENT_TZ_SUFFIX
+    details["end"] = end.isoformat() + EVENT_TZ_SUFFIX
+    return details
+
+# ─────────── ГАЗЕТТИР ───────────
+class Gazetteer:
+    """Локальный индекс адресов для поиска без сети: триграммы слов, номера домов и города области."""
+
+    VERSION = 4
+    RARE_DF = 200  # триграммы с большим постинг-листом не порождают кандидатов
+    MAX_CANDIDATES = 64
+    TOWNS = frozenset(w.translate(TRANSLIT) for w in re.findall(r"[а-я]{4,}", CITY_WORDS)
+                      if w not in (DEFAULT_CITY, "поселок"))
+
+    def __init__(self):
+        self.docs = []  # [(ключ, lat, lon)]
+        self.keys = {}
+        self.postings = {}  # триграмма → array('I') номеров документов
+        self.houses = {}  # номер дома → array('I') номеров документов
+        self.no_house = None  # array('I') документов без номера дома
+        self._no_house_set = None
+        self._parsed = {}
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    @classmethod
+    def _split(cls, key: str) -> tuple:
+        words, houses, towns = [], set(), set()
+        for tok in key.replace(',', ' ').split():
+            if tok[:1].isdigit():
+                houses.add(tok)
+            else:
+                words.append(tok)
+                if tok in cls.TOWNS:
+                    towns.add(tok)
+        grams = set()
+        for word in words:
+            padded = f" {word} "
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+        return frozenset(houses), frozenset(towns), frozenset(grams)
+
+    def _doc(self, i: int) -> tuple:
+        parsed = self._parsed.get(i)
+        if parsed is None:
+            parsed = self._parsed[i] = self._split(self.docs[i][0])
+        return parsed
+
+    def add(self, addr: str, lat: float, lon: float) -> None:
+        """Добавить адрес (любое написание) с координатами; повтор ключа обновляет координаты."""
+        from array import array
+
+        key = canonical_address(addr)
+        parsed = self._split(key)
+        if not parsed[2]:
+            return
+        if key in self.keys:
+            self.docs[self.keys[key]] = (key, lat, lon)
+            return
+        i = self.keys[key] = len(self.docs)
+        self.docs.append((key, lat, lon))
+        self._parsed[i] = parsed
+        for index, tokens in ((self.postings, parsed[2]), (self.houses, parsed[0])):
+            for tok in tokens:
+                posting = index.get(tok)
+                if posting is None:
+                    posting = index[tok] = array('I')
+                posting.append(i)
+        if not parsed[0]:
+            if self.no_house is None:
+                self.no_house = array('I')
+            self.no_house.append(i)
+            if self._no_house_set is not None:
+                self._no_house_set.add(i)
+
+    def match(self, addr: str):
+        """Лучшее совпадение: ([lat, lon], уверенность, ключ) или None."""
+        key = canonical_address(addr)
+        houses, towns, grams = self._split(key)
+        if not grams:
+            return None
+        if key in self.keys:
+            doc = self.docs[self.keys[key]]
+            return [doc[1], doc[2]], 1.0, key
+
+        lists = sorted((self.postings.get(g, ()) for g in grams), key=len)
+        candidates = set()
+        for used, posting in enumerate(lists):
+            if candidates and (len(posting) > self.RARE_DF or (used >= 3 and len(candidates) >= self.MAX_CANDIDATES)):
                 break
+            candidates.update(posting)
+        if houses:
+            if self._no_house_set is None:
+                self._no_house_set = set(self.no_house or ())
+            same = set().union(*(self.houses.get(h, ()) for h in houses))
+            candidates = (candidates & same) | (candidates & self._no_house_set)
+
+        best, runner_up = None, 0.0
+        for i in candidates:
+            dhouses, dtowns, dgrams = self._doc(i)
+            if towns != dtowns:
+                continue
+            score = 2 * len(grams & dgrams) / (len(grams) + len(dgrams))
+            if houses and dhouses:
+                if not houses & dhouses:
+                    continue
+            elif houses or dhouses:
+                score *= 0.8
+            dkey, lat, lon = self.docs[i]
+            if best is None or score > best[1]:
+                if best is not None and (abs(best[0][0] - lat) > 1e-3 or abs(best[0][1] - lon) > 1e-3):
+                    runner_up = max(runner_up, best[1])
+                best = ([lat, lon], score, dkey)
+            elif abs(best[0][0] - lat) > 1e-3 or abs(best[0][1] - lon) > 1e-3:
+                runner_up = max(runner_up, score)
+        if best is None or best[1] - runner_up < 0.05:
+            return None
+        return best
+
+    @classmethod
+    def from_osm(cls, path: Path) -> "Gazetteer":
+        """Индекс по выгрузке OSM: GeoJSON-объект на строку (точки, для контуров — первая вершина)."""
+        gaz = cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip().lstrip('\x1e')  # geojsonseq допускает разделитель RS
+                if not line:
+                    continue
+                try:
+                    feature = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                props = feature.get("properties") or {}
+                geometry = feature.get("geometry") or {}
+                coords = geometry.get("coordinates")
+                while isinstance(coords, list) and coords and isinstance(coords[0], list):
+                    coords = coords[0]
+                if not coords or len(coords) < 2:
+                    continue
+                street = " ".join(filter(None, (props.get("addr:street"), props.get("addr:housenumber"))))
+                parts = [p for p in (props.get("name"), street, props.get("addr:city")) if p]
+                if street or props.get("name"):
+                    gaz.add(", ".join(parts), coords[1], coords[0])
+        return gaz
+
+    def save(self, path: Path, signature: str) -> None:
+        data = pickle.dumps((self.VERSION, signature, self.docs, self.keys, self.postings, self.houses, self.no_house),
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        atomic_write_bytes(path, data)
+
+    @classmethod
+    def load(cls, path: Path, signature: str):
+        """Загрузить сохранённый индекс или None, если он от другой версии/выгрузки."""
+        try:
+            version, saved, docs, keys, postings, houses, no_house = pickle.loads(path.read_bytes())
+        except Exception:
+            return None
+        if version != cls.VERSION or saved != signature:
+            return None
+        gaz = cls()
+        gaz.docs, gaz.keys, gaz.postings, gaz.houses, gaz.no_house = docs, keys, postings, houses, no_house
+        return gaz
+
+def open_gazetteer(store) -> Gazetteer:
+    """Газеттир: индекс выгрузки OSM (из GAZETTEER_FILE, если не устарел) + найденные адреса кэша."""
+    gaz = Gazetteer()
+    if GAZETTEER_OSM and Path(GAZETTEER_OSM).exists():
+        st = Path(GAZETTEER_OSM).stat()
+        signature = f"{Path(GAZETTEER_OSM).resolve()}:{st.st_size}:{int(st.st_mtime)}"
+        gaz = Gazetteer.load(GAZETTEER_FILE, signature)
+        if gaz is None:
+            gaz = Gazetteer.from_osm(Path(GAZETTEER_OSM))
+            gaz.save(GAZETTEER_FILE, signature)
+            logger.info(f"Газеттир OSM построен: {len(gaz)} адресов → {GAZETTEER_FILE}")
+    for addr, key in store.aliases.items():
+        entry = store.entries.get(key)
+        if entry and entry["lat"] is not None and entry["provider"] != "gazetteer":
+            gaz.add(addr, entry["lat"], entry["lon"])
+    logger.info(f"Газеттир: {len(gaz)} адресов")
+    return gaz
+
+def gazetteer_lookup(addr: str):
+    """Найти адрес в газеттире без сети: (lat, lon) при достаточной уверенности или None."""
+    if gazetteer is None:
+        return None
+    found = gazetteer.match(addr)
+    if found is None or found[1] < GAZETTEER_MIN_CONFIDENCE:
+        metrics.count("gazetteer_lookups_total", result="miss")
+        return None
+    coords, confidence, key = found
+    metrics.count("gazetteer_lookups_total", result="hit")
+    log_geocoding(addr, "Gazetteer", True, f"{coords[0]:.6f},{coords[1]:.6f} ≈ {key} ({confidence:.2f})")
+    return coords
+
+# ─────────── КЛАСТЕРЫ ───────────
+def mercator(lon: float, lat: float) -> tuple:
+    """Долгота/широта → координаты Web Mercator в [0, 1]."""
+    s = math.sin(math.radians(lat))
+    y = 0.5 - 0.25 * math.log((1 + s) / (1 - s)) / math.pi if -1 < s < 1 else (0.0 if s > 0 else 1.0)
+    return lon / 360 + 0.5, min(1.0, max(0.0, y))
+
+def unmercator(x: float, y: float) -> tuple:
+    """Координаты Web Mercator в [0, 1] → долгота/широта."""
+    return (x - 0.5) * 360, math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+def cluster_points(points: list, min_zoom: int = None, max_zoom: int = None, radius: float = None) -> dict:
+    """Иерархическая кластеризация точек [(lon, lat, id)] по уровням масштаба.
+
+    Алгоритм supercluster: начиная с max_zoom, каждая ещё не поглощённая
+    точка собирает соседей в радиусе radius пикселей (поиск по сетке с
+    ячейкой в радиус) и становится кластером с взвешенным центром; кластеры
+    уровня z — вход для уровня z-1. Возвращает {zoom: [[lon, lat, count, id]]},
+    где id — id события для одиночной точки и None для кластера.
+    """
+    min_zoom = CLUSTER_MIN_ZOOM if min_zoom is None else min_zoom
+    max_zoom = CLUSTER_MAX_ZOOM if max_zoom is None else max_zoom
+    radius = CLUSTER_RADIUS if radius is None else radius
+
+    # Текущий уровень: параллельные списки x, y, вес, id
+    xs, ys, counts, ids = [], [], [], []
+    for lon, lat, pid in points:
+        x, y = mercator(lon, lat)
+        xs.append(x)
+        ys.append(y)
+        counts.append(1)
+        ids.append(pid)
+
+    levels = {}
+    for zoom in range(max_zoom, min_zoom - 1, -1):
+        r = radius / (CLUSTER_EXTENT * 2 ** zoom)
+        grid = {}
+        for i in range(len(xs)):
+            grid.setdefault((int(xs[i] / r), int(ys[i] / r)), []).append(i)
+
+        visited = [False] * len(xs)
+        nxs, nys, ncounts, nids = [], [], [], []
+        r2 = r * r
+        for i in range(len(xs)):
+            if visited[i]:
+                continue
+            visited[i] = True
+            x, y = xs[i], ys[i]
+            cx, cy = int(x / r), int(y / r)
+            wx, wy, total = x * counts[i], y * counts[i], counts[i]
+            for gx in (cx - 1, cx, cx + 1):
+                for gy in (cy - 1, cy, cy + 1):
+                    for j in grid.get((gx, gy), ()):
+                        if not visited[j] and (xs[j] - x) ** 2 + (ys[j] - y) ** 2 <= r2:
+                            visited[j] = True
+                            wx += xs[j] * counts[j]
+                            wy += ys[j] * counts[j]
+                            total += counts[j]
+            if total == counts[i]:
+                nxs.append(x)
+                nys.append(y)
+                ncounts.append(counts[i])
+                nids.append(ids[i])
+            else:
+                nxs.append(wx / total)
+                nys.append(wy / total)
+                ncounts.append(total)
+                nids.append(None)
+        xs, ys, counts, ids = nxs, nys, ncounts, nids
+
+        level = []
+        for x, y, count, pid in zip(xs, ys, counts, ids):
+            lon, lat = unmercator(x, y)
+            level.append([round(lon, 5), round(lat, 5), count, pid])
+        levels[zoom] = level
+    return levels
+
+def build_clusters(events: list) -> dict:
+    """Кластеры по дням: {date: {zoom: [[lon, lat, count, id]]}} (id — event_id)."""
+    days = {}
+    for event in events:
+        if event.get("lat") is not None and event.get("lon") is not None:
+            days.setdefault(event["date"], []).append((event["lon"], event["lat"], event_id(event)))
+    return {day: cluster_points(points) for day, points in sorted(days.items())}
+
+# ─────────── ВЫГРУЗКА ───────────
+RE_TIME_RANGE = re.compile(r"(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})")
+RE_TIME = re.compile(r"(\d{1,2}):(\d{2})")
+
+def event_time(text: str):
+    """Время из текста поста как в extractTimeFromText фронтенда: 'ЧЧ:ММ-ЧЧ:ММ', 'ЧЧ:ММ' или None.
+
+    Совпадения ищутся только у двоеточий (начало — за 1-2 символа до него):
+    результат тот же, что у поиска регуляркой по всему тексту, но без
+    прохода по каждому символу поста.
+    """
+    if not text:
+        return None
+    first = span = None
+    pos = text.find(':')
+    while pos != -1 and span is None:
+        for start in (pos - 2, pos - 1):
+            if start < 0:
+                continue
+            span = RE_TIME_RANGE.match(text, start)
+            if first is None:
+                first = RE_TIME.match(text, start)
+            if span:
+                break
+        pos = text.find(':', pos + 1)
+    if span:
+        h1, m1, h2, m2 = map(int, span.groups())
+        if h1 <= 23 and m1 <= 59 and h2 <= 23 and m2 <= 59:
+            return f"{h1:02d}:{m1:02d}-{h2:02d}:{m2:02d}"
+    if first:
+        h, mi = map(int, first.groups())
+        if h <= 23 and mi <= 59:
+            return f"{h:02d}:{mi:02d}"
+    return None
+
+def event_id(event: dict) -> str:
+    """Стабильный id события по тому же ключу, что и дедупликация в main()."""
+    key = f"{event['date']}|{event['title']}|{event['location']}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+def short_location(location: str) -> str:
+    """Адрес без хвоста ', Калининград' (как formatLocation во фронтенде)."""
+    return re.sub(r",?\s*Калининград\s*$", "", location or "", flags=re.I)
+
+def compact_json(data) -> bytes:
+    """Минифицированный JSON в UTF-8."""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def compressors() -> dict:
+    """Доступные предсжатия из OUTPUT_COMPRESS: {расширение: функция}."""
+    available = {"gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+        available["br"] = lambda data: brotli.compress(data, quality=11)
+    except ImportError:
+        pass
+    return {ext: available[ext] for ext in OUTPUT_COMPRESS if ext in available}
+
+def write_output_file(path: Path, data: bytes, packers: dict) -> None:
+    """Записать файл и его предсжатые копии (path.gz, path.br)."""
+    atomic_write_bytes(path, data)
+    for ext, pack in packers.items():
+        atomic_write_bytes(path.with_name(f"{path.name}.{ext}"), pack(data))
+
+# Латиница → кириллица для поиска: сначала длинные сочетания (shch раньше sh и h)
+LATIN_TO_CYRILLIC = {
+    'shch': 'щ', 'sch': 'щ', 'yo': 'е', 'zh': 'ж', 'kh': 'х', 'ts': 'ц', 'ch': 'ч', 'sh': 'ш',
+    'yu': 'ю', 'ya': 'я', 'ye': 'е', 'a': 'а', 'b': 'б', 'v': 'в', 'g': 'г', 'd': 'д', 'e': 'е',
+    'z': 'з', 'i': 'и', 'y': 'й', 'k': 'к', 'l': 'л', 'm': 'м', 'n': 'н', 'o': 'о', 'p': 'п',
+    'r': 'р', 's': 'с', 't': 'т', 'u': 'у', 'f': 'ф', 'h': 'х', 'c': 'к', 'w': 'в', 'q': 'к',
+    'j': 'дж', 'x': 'кс',
+}
+RE_LATIN_CHUNK = re.compile("|".join(sorted(LATIN_TO_CYRILLIC, key=len, reverse=True)))
+RE_SEARCH_TOKEN = re.compile(r"[0-9a-zа-я]+")
+
+def search_tokens(text: str) -> list:
+    """Слова для поиска: нижний регистр, ё → е (так же нормализует запрос клиент)."""
+    return RE_SEARCH_TOKEN.findall((text or "").lower().replace("ё", "е"))
+
+def search_terms(text: str, variants: bool = True) -> set:
+    """Термы индекса: слова текста (кроме однобуквенных) и, с variants, их транслитерация."""
+    terms = set()
+    for token in search_tokens(text):
+        if len(token) < 2 and not token.isdigit():
+            continue
+        terms.add(token)
+        if not variants:
+            continue
+        if re.search("[а-я]", token):
+            terms.add(token.translate(TRANSLIT))
+        elif re.search("[a-z]", token):
+            terms.add(RE_LATIN_CHUNK.sub(lambda m: LATIN_TO_CYRILLIC[m.group()], token))
+    return terms
+
+def build_search_index(events: list) -> dict:
+    """Инвертированный индекс поиска; номера документов — позиции в events.
+
+    Термы (search_terms заголовка, короткого адреса и текста поста)
+    отсортированы; у каждого — номера событий по возрастанию, записанные
+    разностями. Латинские варианты кириллических слов заголовка и адреса
+    и наоборот уже в индексе, так что клиент не транслитерирует запрос, а
+    поиск по префиксу — двоичный поиск диапазона термов: O(длина запроса ·
+    log V). Слова текста поста индексируются как написаны: с вариантами
+    индекс был бы почти вдвое больше.
+    """
+    postings = {}
+    for doc, event in enumerate(events):
+        terms = search_terms(f"{event['title']} {short_location(event['location'])}")
+        terms |= search_terms(event.get("text"), variants=False)
+        for term in terms:
+            postings.setdefault(term, []).append(doc)
+    terms = sorted(postings)
+    return {
+        "version": SEARCH_INDEX_VERSION,
+        "count": len(events),
+        "terms": terms,
+        "postings": [[p[0]] + [b - a for a, b in zip(p, p[1:])] for p in (postings[t] for t in terms)],
+    }
 
-        logger.info(f"Извлечено {len(records)} событий")
-
-        if not records:
-            logger.warning("Новые события не найдены, сохраняем существующие")
-            # Не перезаписываем файл, оставляем существующие события
+def search_lookup(index: dict, query: str) -> list:
+    """Номера событий, где каждое слово запроса — префикс какого-то терма (как в клиенте)."""
+    terms, result = index["terms"], None
+    for token in search_tokens(query):
+        docs = set()
+        i = bisect.bisect_left(terms, token)
+        while i < len(terms) and terms[i].startswith(token):
+            doc = 0
+            for delta in index["postings"][i]:
+                doc += delta
+                docs.add(doc)
+            i += 1
+        result = docs if result is None else result & docs
+        if not result:
+            return []
+    return sorted(result or ())
+
+def write_partitioned(events: list, out_dir: Path = None) -> dict:
+    """Выгрузить события как index.json + помесячные шарды events-YYYY-MM.<хэш>.json.
+
+    Индекс (id, дата, время, начало и конец, возраст, координаты, заголовок,
+    короткий адрес, шард)
+    достаточен для карты, списка и календаря; полные записи с текстом поста
+    лежат в шардах и загружаются по требованию. Имя шарда содержит хэш
+    содержимого, поэтому шарды можно кэшировать навсегда; неизменившиеся
+    шарды не перезаписываются, устаревшие удаляются. При OUTPUT_CLUSTERS
+    рядом пишутся clusters-YYYY-MM.<хэш>.json с кластерами по дням и уровням
+    масштаба (build_clusters), при OUTPUT_SEARCH — search.<хэш>.json с
+    поисковым индексом по событиям в порядке index.json (build_search_index).
+    Возвращает индекс.
+    """
+    out_dir = out_dir or OUTPUT_DIR
+    out_dir.mkdir(parents=True, exist_ok=True)
+    packers = compressors()
+
+    months = {}
+    for event in events:
+        if "start" not in event:
+            event = dict(event, **event_details(event["date"], event.get("text")))
+        months.setdefault(event["date"][:7], []).append(event)
+
+    shards, clusters, entries = {}, {}, []
+    for month in sorted(months):
+        records = [dict(event, id=event_id(event)) for event in months[month]]
+        data = compact_json(records)
+        name = f"events-{month}.{hashlib.sha1(data).hexdigest()[:10]}.json"
+        shards[month] = name
+        if not (out_dir / name).exists():
+            write_output_file(out_dir / name, data, packers)
+        if OUTPUT_CLUSTERS:
+            data = compact_json(build_clusters(months[month]))
+            clusters[month] = f"clusters-{month}.{hashlib.sha1(data).hexdigest()[:10]}.json"
+            if not (out_dir / clusters[month]).exists():
+                write_output_file(out_dir / clusters[month], data, packers)
+        for event in records:
+            entries.append({
+                "id": event["id"],
+                "date": event["date"],
+                "time": event_time(event.get("text")),
+                "start": event["start"],
+                "end": event["end"],
+                "age": event["age"],
+                "lat": event["lat"],
+                "lon": event["lon"],
+                "title": event["title"],
+                "location": short_location(event["location"]),
+                "shard": month,
+            })
+
+    index = {"version": 1, "shards": shards, "events": entries}
+    if OUTPUT_CLUSTERS:
+        index["clusters"] = clusters
+    live = set(shards.values()) | set(clusters.values())
+    if OUTPUT_SEARCH:
+        data = compact_json(build_search_index([e for month in sorted(months) for e in months[month]]))
+        index["search"] = f"search.{hashlib.sha1(data).hexdigest()[:10]}.json"
+        live.add(index["search"])
+        if not (out_dir / index["search"]).exists():
+            write_output_file(out_dir / index["search"], data, packers)
+    write_output_file(out_dir / "index.json", compact_json(index), packers)
+
+    # Удалить шарды, на которые индекс больше не ссылается
+    for pattern in ("events-*.json*", "clusters-*.json*", "search.*.json*"):
+        for path in out_dir.glob(pattern):
+            if path.name.split(".json")[0] + ".json" not in live:
+                path.unlink()
+    return index
+
+# ─────────── ХРАНИЛИЩЕ СОБЫТИЙ ───────────
+class EventStore(JsonlJournal):
+    """События по ключу «домен:id поста»: журнал JSONL + индекс в памяти в порядке (date, seq)."""
+
+    FIELDS = ("title", "date", "location", "lat", "lon", "text", "start", "end", "age")
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self.records = {}
+        self.by_fields = {}  # event_id (дата|заголовок|адрес) → ключ
+        self.order = []  # [(date, seq, key)] по возрастанию
+        self._seq = 0
+        self._fragments = {}
+        self._replay()
+
+    def _load(self, rec: dict) -> None:
+        event = rec.get("event")
+        if event is not None and "start" not in event:
+            event.update(event_details(event.get("date"), event.get("text")))
+        self._apply(rec)
+
+    def _apply(self, rec: dict) -> None:
+        # Компактированный журнал уже идёт в порядке дат, поэтому при
+        # чтении вставка приходится в конец списка, без пересортировки.
+        key = rec["key"]
+        old = self.records.pop(key, None)
+        if old:
+            self._fragments.pop(key, None)
+            if self.by_fields.get(event_id(old["event"])) == key:
+                del self.by_fields[event_id(old["event"])]
+            pos = bisect.bisect_left(self.order, (old["event"]["date"], old["seq"], key))
+            del self.order[pos]
+        if rec.get("deleted"):
             return
+        self.records[key] = rec
+        self.by_fields[event_id(rec["event"])] = key
+        self._seq = max(self._seq, rec["seq"] + 1)
+        bisect.insort(self.order, (rec["event"]["date"], rec["seq"], key))
+
+    def _snapshot(self) -> list:
+        """Живые события в порядке дат."""
+        return [self.records[key] for _, _, key in self.order]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def get(self, key: str):
+        """Событие по ключу или None."""
+        rec = self.records.get(key)
+        return rec["event"] if rec else None
+
+    def find(self, event: dict):
+        """Ключ события с теми же датой, заголовком и адресом или None."""
+        return self.by_fields.get(event_id(event))
+
+    def put(self, key: str, event: dict):
+        """Вставить или обновить событие; вернуть "insert", "update" или None (без изменений).
+
+        Событие с теми же датой, заголовком и адресом под другим ключом
+        (например, импортированное из старого events.json) заменяется:
+        старая запись удаляется, новая занимает её место в порядке.
+        """
+        if "start" not in event:
+            event = dict(event, **event_details(event.get("date"), event.get("text")))
+        event = {k: event.get(k) for k in self.FIELDS}
+        digest = hashlib.sha1(compact_json(event)).hexdigest()[:16]
+        with self._lock:
+            old = self.records.get(key)
+            if old and old["hash"] == digest:
+                return None
+            seq = old["seq"] if old else None
+            owner = self.find(event)
+            if owner and owner != key:
+                seq = self.records[owner]["seq"] if seq is None else seq
+                self.delete(owner)
+            self._write({"key": key, "hash": digest, "seq": self._seq if seq is None else seq, "event": event})
+        return "update" if old or owner else "insert"
+
+    def delete(self, key: str) -> bool:
+        """Удалить событие (tombstone в журнале)."""
+        with self._lock:
+            if key not in self.records:
+                return False
+            self._write({"key": key, "deleted": True})
+        return True
+
+    def events(self) -> list:
+        """События в порядке дат (при равной дате — в порядке появления)."""
+        return [self.records[key]["event"] for _, _, key in self.order]
+
+    def render_json(self) -> str:
+        """events.json в прежнем формате (indent=2).
+
+        Фрагменты кэшируются только в памяти процесса: в режиме watch
+        повторная выгрузка сериализует лишь изменённые события, а запуск
+        по расписанию сериализует и переписывает файл целиком.
+        """
+        parts = []
+        for _, _, key in self.order:
+            fragment = self._fragments.get(key)
+            if fragment is None:
+                fragment = "  " + json.dumps(self.records[key]["event"], ensure_ascii=False, indent=2).replace("\n", "\n  ")
+                self._fragments[key] = fragment
+            parts.append(fragment)
+        return "[\n" + ",\n".join(parts) + "\n]" if parts else "[]"
+
+    def import_legacy(self, events: list) -> None:
+        """Перенести события из events.json; ключ — хэш даты, заголовка и адреса."""
+        for event in events:
+            self.put(f"legacy:{event_id(event)}", event)
+
+def open_events() -> EventStore:
+    """Открыть хранилище событий; при первом запуске импортировать events.json."""
+    store = EventStore(EVENTS_STORE)
+    if not EVENTS_STORE.exists() and OUTPUT_JSON.exists():
+        try:
+            store.import_legacy(json.loads(OUTPUT_JSON.read_text(encoding='utf-8')))
+            logger.info(f"Импортированы события из {OUTPUT_JSON}: {len(store)}")
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить существующие события: {e}")
+    logger.info(f"Хранилище событий открыто: {len(store)} событий")
+    return store
+
+def publish_events(store: EventStore) -> None:
+    """Сохранить журнал и атомарно перезаписать events.json (и шарды при OUTPUT_SHARDS).
+
+    За O(изменений) обходится только дозапись в журнал; events.json —
+    один файл и переписывается целиком, а шарды с хэшем в имени
+    записываются заново лишь при изменении содержимого месяца.
+    """
+    store.flush()
+    atomic_write_text(OUTPUT_JSON, store.render_json())
+    if OUTPUT_SHARDS:
+        index = write_partitioned(store.events())
+        logger.info(f"Секционированная выгрузка: {len(index['shards'])} шардов в {OUTPUT_DIR}/")
+    store.changed = False
+
+# ─────────── АРХИВ ПОСТОВ ───────────
+class PostArchive(JsonlJournal):
+    """Архив сырых постов VK: append-only JSON Lines, ключ — «группа:id».
+
+    Запись {"key", "hash", "post"} добавляется, только если содержимое поста
+    изменилось (первое появление или правка), поэтому последняя запись по
+    ключу — актуальная версия. Счётчики лайков и просмотров не хранятся.
+    Путь с суффиксом .gz пишется сжатым: каждый flush дописывает отдельный
+    член gzip. Без сжатия файл хорошо дельтуется git'ом.
+    """
+
+    VOLATILE = ("likes", "reposts", "views", "comments")
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self._digests = None  # ключ → hash последней версии; читается при первой записи
+
+    def records(self):
+        """Записи архива по порядку; читается потоково, память не зависит от размера."""
+        return self._read()
+
+    def add(self, domain: str, item: dict) -> bool:
+        """Запомнить пост; False — такая версия уже в архиве."""
+        post = {k: v for k, v in item.items() if k not in self.VOLATILE}
+        digest = hashlib.sha1(compact_json(post)).hexdigest()[:16]
+        key = f"{domain}:{post.get('id')}"
+        with self._lock:
+            if self._digests is None:
+                self._digests = {rec["key"]: rec["hash"] for rec in self.records()}
+            if self._digests.get(key) == digest:
+                return False
+            self._digests[key] = digest
+            self._append({"key": key, "hash": digest, "post": post})
+        return True
+
+    def flush(self) -> None:
+        """Дописать новые записи в конец архива (архив не компактируется)."""
+        with self._lock:
+            added = len(self._pending)
+            super().flush()
+        if added:
+            logger.info(f"Архив постов: +{added} записей в {self.path}")
+
+def _extract_chunk(chunk: list) -> list:
+    """Задание пула reprocess: [(ключ, город, текст, время поста)] → [(ключ, событие или None)]."""
+    return [(key, extract(text, city, posted)) for key, city, text, posted in chunk]
+
+def extract_archive(store: PostArchive, domains: dict, workers: int = None, chunk_size: int = None):
+    """(ключ, событие или None) для последней версии каждого поста, в порядке архива.
+
+    Архив читается дважды: первый проход запоминает номер последней записи
+    по ключу, второй разбирает только её, так что исправленный в посте
+    адрес не уходит в геокодинг в старом написании. Записи идут кусками по
+    chunk_size постов в пул из workers процессов; в работе не больше
+    2 × workers кусков, и память зависит от числа постов, а не от размера
+    архива.
+    """
+    workers = workers or REPROCESS_WORKERS or os.cpu_count() or 1
+    chunk_size = chunk_size or REPROCESS_CHUNK
+    latest = {rec["key"]: i for i, rec in enumerate(store.records())}
+
+    def chunks():
+        chunk = []
+        for i, rec in enumerate(store.records()):
+            if latest.get(rec["key"]) != i:
+                continue
+            city = domains.get(rec["key"].rpartition(":")[0], DEFAULT_EVENT_CITY)
+            chunk.append((rec["key"], city, rec["post"].get("text") or "", rec["post"].get("date")))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    if workers <= 1:
+        for chunk in chunks():
+            yield from _extract_chunk(chunk)
+        return
 
-        # Дедупликация и сортировка
-        df = pd.DataFrame(records).drop_duplicates()
-        logger.info(f"После дедупликации: {len(df)} уникальных событий")
-
-        # Геокодинг с отслеживанием прогресса
-        lats, lons = [], []
-        processed = 0
-
-        for addr in df["location"]:
-            if processed % 10 == 0:
-                logger.info(f"Прогресс геокодинга: {processed}/{len(df)}")
-
-            lat, lon = geocode_addr(addr)
-            lats.append(lat)
-            lons.append(lon)
-            processed += 1
-
-        df["lat"] = lats
-        df["lon"] = lons
-
-        # Сообщить о пропущенных координатах
-        missing = df[df["lat"].isna()]
-        missing_count = len(missing)
-        if missing_count > 0:
-            missing_addrs = ", ".join(sorted(set(missing["location"].tolist())))
-            logger.warning(f"Отсутствуют координаты для {missing_count} адресов: {missing_addrs[:800]}{'...' if len(missing_addrs) > 800 else ''}")
-
-        # Фильтровать события без координат
-        df = df.dropna(subset=["lat", "lon"])
-        logger.info(f"Финальный датасет: {len(df)} новых событий с координатами")
-
-        # Объединить с существующими событиями
-        new_events = df[["title", "date", "location", "lat", "lon", "text"]].to_dict('records')
-        all_events = existing_events + new_events
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = deque()
+        for chunk in chunks():
+            running.append(pool.submit(_extract_chunk, chunk))
+            if len(running) >= 2 * workers:
+                yield from running.popleft().result()
+        while running:
+            yield from running.popleft().result()
+
+def open_run() -> EventStore:
+    """Открыть хранилище событий, кэш, статистику и автоматы провайдеров, газеттир."""
+    global geocache, geolog, provider_stats, breakers, gazetteer, archive
+    # Открыть хранилище событий
+    with metrics.timer("events_load"):
+        events = open_events()
+
+    # Загрузить кэш
+    with metrics.timer("cache_load"):
+        geocache = open_cache()
+        provider_stats = ProviderStats.load(STATS_FILE)
+        breakers = CircuitBreakers.load(BREAKER_FILE) if GEOCODE_BREAKER else None
+        gazetteer = open_gazetteer(geocache) if GAZETTEER else None
+    archive = PostArchive(Path(POST_ARCHIVE)) if POST_ARCHIVE else None
+    geolog = {}
+    return events
+
+def ingest(events: EventStore, state: dict, domains: dict) -> int:
+    """Один проход: новые посты групп → extract → геокодинг → хранилище.
+
+    state (отметки групп) обновляется на месте. Возвращает число
+    вставленных, обновлённых и удалённых событий.
+    """
+    marks = {domain: state.get(domain, {}) for domain in domains}
+    for domain, mark in marks.items():
+        logger.info(f"Загружаем до {MAX_POSTS} постов из группы VK '{domain}' (после поста {mark.get('last_id', 0)})")
+    records, post_dates, removed = [], {}, 0
+
+    def process(domain, item):
+        nonlocal removed
+        text = item.get("text") or ""
+        logger.debug(f"Processing post: {text[:200]}...")
+        with metrics.timer("extract"):
+            event = extract(text, domains[domain], item.get("date"))
+        metrics.count("posts_processed_total")
+        key = f"{domain}:{item.get('id')}"
+        if not event:
+            # Пост отредактировали так, что события в нём больше нет
+            if events.delete(key):
+                removed += 1
+            return
+        current = events.get(key)
+        if current and all(current[k] == event[k] for k in ("title", "date", "location", "text")):
+            return
+        owner = events.find(event)
+        if owner and owner != key and not owner.startswith("legacy:"):
+            logger.debug(f"Событие уже существует: {event['title']}")
+            return
+        event["domain"], event["post_id"] = domain, item.get("id")
+        post_dates[domain, event["post_id"]] = item.get("date")
+        records.append(event)
+
+    def on_post(domain, item):
+        if archive is not None:
+            archive.add(domain, item)
+        process(domain, item)
+
+    # Группы листаются параллельно под общим лимитом VK, посты разбираются здесь по мере прихода
+    fetched = fetch_domains(marks, on_post=on_post)
+
+    total = 0
+    for domain, (posts, newest, complete) in fetched.items():
+        mark = marks[domain]
+        # Посты, для которых в прошлый раз не нашлись координаты, разбираем снова без запроса к VK
+        fetched_ids = {item.get("id") for item in posts}
+        for post_id, item in mark.get("pending", {}).items():
+            if int(post_id) not in fetched_ids:
+                posts.append({"id": int(post_id), **item})
+                process(domain, posts[-1])
+        total += len(posts)
+        # Отметку двигаем только после полного прохода, иначе пропущенные посты потеряются
+        state[domain] = dict(newest if complete else mark, pending={})
+
+    logger.info(f"Получено {total} постов, извлечено {len(records)} новых или изменённых событий")
+
+    # Один пост — одно событие: при повторе (pending) остаётся последняя версия;
+    # одно событие из нескольких групп достаётся первой группе в VK_DOMAINS
+    # (а в группе — раннему посту) независимо от того, чей поток успел первым
+    rank = {domain: i for i, domain in enumerate(domains)}
+    records = sorted({(r["domain"], r["post_id"]): r for r in records}.values(),
+                     key=lambda r: (rank[r["domain"]], r["post_id"] or 0))
+    unique = {}
+    for record in records:
+        unique.setdefault(event_id(record), record)
+    records = list(unique.values())
+
+    # Геокодинг уникальных адресов параллельно
+    with metrics.timer("geocode"):
+        coords = geocode_many([r["location"] for r in records]) if records else {}
+    for record in records:
+        record["lat"], record["lon"] = coords.get((record["location"] or "").strip(), (None, None))
+
+    # Сообщить о пропущенных координатах
+    missing = [r for r in records if r["lat"] is None or r["lon"] is None]
+    missing_count = len(missing)
+    if missing_count > 0:
+        missing_addrs = ", ".join(sorted({r["location"] for r in missing}))
+        logger.warning(f"Отсутствуют координаты для {missing_count} адресов: {missing_addrs[:800]}{'...' if len(missing_addrs) > 800 else ''}")
+
+    # Запомнить такие посты, чтобы повторить их в следующих запусках
+    horizon = time.time() - VK_PENDING_DAYS * 86400
+    for record in missing:
+        post = record["domain"], record["post_id"]
+        if (post_dates.get(post) or 0) >= horizon:
+            state[post[0]]["pending"][str(post[1])] = {"date": post_dates[post], "text": record["text"]}
+
+    # События с координатами — в хранилище (вставка или обновление по id поста)
+    outcomes = [events.put(f"{r['domain']}:{r['post_id']}", r) for r in records if r not in missing]
+    inserted, updated = outcomes.count("insert"), outcomes.count("update")
+    logger.info(f"Общий датасет: {len(events)} событий ({inserted} новых, {updated} обновлено, {removed} удалено)")
+
+    metrics.count("events_new_total", inserted)
+    metrics.count("events_updated_total", updated)
+    metrics.count("events_removed_total", removed)
+    metrics.count("events_missing_coords_total", missing_count)
+    return inserted + updated + removed
+
+def save_run(events: EventStore, state: dict, quiet: bool = False) -> None:
+    """Опубликовать события (если изменились), сохранить кэш, статистику, архив и отметки.
+
+    quiet — не предупреждать об отсутствии новых событий и не перезаписывать
+    лог геокодинга пустым (итерации режима наблюдения). state=None — отметки
+    групп не трогать (повторный разбор архива).
+    """
+    # Сохранить результат (только если что-то изменилось)
+    with metrics.timer("write_events"):
+        if events.changed or not OUTPUT_JSON.exists():
+            publish_events(events)
+        else:
+            if not quiet:
+                logger.warning("Новые события не найдены, сохраняем существующие")
+            if OUTPUT_SHARDS and not (OUTPUT_DIR / "index.json").exists():
+                write_partitioned(events.events())
 
-        # Сортировать по дате
-        all_events.sort(key=lambda x: x['date'])
+    # Сохранить кэш и отметку загрузки
+    with metrics.timer("write_cache"):
+        save_cache(geocache)
+        provider_stats.save(STATS_FILE)
+        if breakers is not None:
+            breakers.save(BREAKER_FILE)
+    if archive is not None:
+        with metrics.timer("write_archive"):
+            archive.flush()
+    if state is not None:
+        with metrics.timer("write_state"):
+            save_state(state)
+
+    # Сохранить детальный лог если включено
+    if GEOCODE_SAVE_LOG and (geolog or not quiet):
+        try:
+            with metrics.timer("write_geolog"):
+                with _geolog_lock:
+                    snapshot = {addr: dict(entries) for addr, entries in geolog.items()}
+                LOG_FILE.write_text(json.dumps(snapshot, ensure_ascii=False, indent=2), encoding="utf-8")
+        except Exception as e:
+            logger.error(f"Не удалось сохранить лог геокодинга: {e}")
 
-        logger.info(f"Общий датасет: {len(all_events)} событий ({len(existing_events)} существующих + {len(new_events)} новых)")
+def main():
+    """Основной обработчик с полной обработкой ошибок."""
+    logger.info(f"VK_TOKEN present: {bool(TOKEN)}")
+    domains = vk_domains()
+    logger.info(f"DOMAINS: {', '.join(domains)}")
+    if not TOKEN:
+        logger.critical("VK_TOKEN не задан (секрет репозитория или .env требуется)")
+        sys.exit(1)
 
-        # Сохранить результат
-        OUTPUT_JSON.write_text(
-            json.dumps(all_events, ensure_ascii=False, indent=2),
-            encoding="utf-8"
-        )
+    global metrics
+    metrics = RunMetrics()
 
-        # Сохранить кэш
-        save_cache(geocache)
+    try:
+        logger.info("Запуск обработки событий...")
+        events = open_run()
 
-        # Сохранить детальный лог если включено
-        if GEOCODE_SAVE_LOG:
-            try:
-                LOG_FILE.write_text(json.dumps(geolog, ensure_ascii=False, indent=2), encoding="utf-8")
-            except Exception as e:
-                logger.error(f"Не удалось сохранить лог геокодинга: {e}")
+        # Собрать посты новее отметки прошлого запуска
+        state = load_state()
+        ingest(events, state, domains)
+        save_run(events, state)
 
         logger.info("Обработка событий завершена успешно")
 
@@ -427,9 +2922,225 @@ def main():
         logger.critical(f"Критическая ошибка в main: {e}", exc_info=True)
         sys.exit(1)
     finally:
-        # Всегда закрывать сессию
-        session.close()
+        # Всегда закрывать сессию и сохранять метрики (в том числе упавшего прогона)
+        close_session()
         logger.info("Сессия закрыта")
+        metrics.write(METRICS_FILE, METRICS_PROM_FILE)
+
+def reprocess(workers: int = None, chunk_size: int = None) -> None:
+    """Повторно разобрать архив постов текущим extract() без запросов к VK.
+
+    Разбор идёт в пуле процессов (extract_archive), геокодинг и запись в
+    хранилище — кусками в этом процессе: адреса из кэша и газеттира
+    находятся без сети, к провайдерам уходят только новые. Отметки групп
+    не меняются.
+    """
+    global metrics
+    metrics = RunMetrics()
+    chunk_size = chunk_size or REPROCESS_CHUNK
+    try:
+        events = open_run()
+        source = PostArchive(Path(POST_ARCHIVE or "posts_archive.jsonl"))
+        if not source.path.exists():
+            logger.critical(f"Архив постов {source.path} не найден")
+            sys.exit(1)
+        totals = {"posts": 0, "insert": 0, "update": 0, "removed": 0, "missing": 0}
+
+        def apply(batch):
+            records = []
+            for key, event in batch:
+                if event is None:
+                    totals["removed"] += events.delete(key)
+                    continue
+                owner = events.find(event)
+                if owner and owner != key and not owner.startswith("legacy:"):
+                    continue
+                records.append((key, event))
+            with metrics.timer("geocode"):
+                coords = geocode_many([e["location"] for _, e in records]) if records else {}
+            for key, event in records:
+                event["lat"], event["lon"] = coords.get((event["location"] or "").strip(), (None, None))
+                if event["lat"] is None:
+                    totals["missing"] += 1
+                    continue
+                outcome = events.put(key, event)
+                if outcome:
+                    totals[outcome] += 1
+
+        started = time.perf_counter()
+        batch = []
+        with metrics.timer("reprocess"):
+            for item in extract_archive(source, vk_domains(), workers, chunk_size):
+                totals["posts"] += 1
+                batch.append(item)
+                if len(batch) >= chunk_size:
+                    apply(batch)
+                    batch = []
+                    logger.info(f"Разобрано постов: {totals['posts']}")
+            apply(batch)
+        elapsed = time.perf_counter() - started
+        logger.info(f"Повторный разбор: {totals['posts']} постов за {elapsed:.1f} с "
+                    f"({totals['posts'] / max(elapsed, 1e-9):.0f} постов/с); событий {len(events)}: "
+                    f"{totals['insert']} новых, {totals['update']} обновлено, {totals['removed']} удалено, "
+                    f"без координат {totals['missing']}")
+        metrics.count("events_new_total", totals["insert"])
+        metrics.count("events_updated_total", totals["update"])
+        metrics.count("events_removed_total", totals["removed"])
+        save_run(events, None)
+    except Exception as e:
+        logger.critical(f"Критическая ошибка в reprocess: {e}", exc_info=True)
+        sys.exit(1)
+    finally:
+        close_session()
+        metrics.write(METRICS_FILE, METRICS_PROM_FILE)
+
+# ─────────── РЕЖИМ НАБЛЮДЕНИЯ ───────────
+class EventFeed:
+    """Текущий events.json в памяти: тело, gzip-копия и ETag для HTTP."""
+
+    def __init__(self, text: str = "[]"):
+        self._lock = threading.Lock()
+        self.etag = None
+        self.update(text)
+
+    def update(self, text: str) -> bool:
+        """Заменить содержимое; False — если оно не изменилось."""
+        body = text.encode("utf-8")
+        etag = hashlib.sha1(body).hexdigest()[:16]
+        if etag == self.etag:
+            return False
+        gzipped = gzip.compress(body, 6, mtime=0)
+        with self._lock:
+            self.etag, self.body, self.gzipped = etag, body, gzipped
+        return True
+
+    def snapshot(self) -> tuple:
+        """(etag, тело, gzip-копия) одной версии."""
+        with self._lock:
+            return self.etag, self.body, self.gzipped
+
+def serve_events(feed: EventFeed, address: str):
+    """Раздавать feed по HTTP (GET/HEAD /events.json) в фоновом потоке; вернуть сервер.
+
+    Ответ несёт ETag версии: клиент с совпадающим If-None-Match получает
+    304 без тела. При Accept-Encoding: gzip отдаётся заранее сжатая копия
+    (ETag с суффиксом -gz, Vary: Accept-Encoding).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._respond(send_body=True)
+
+        def do_HEAD(self):
+            self._respond(send_body=False)
+
+        def _respond(self, send_body: bool):
+            if self.path.split("?", 1)[0] not in ("/", "/events.json"):
+                self.send_error(404)
+                return
+            etag, body, gzipped = feed.snapshot()
+            use_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+            known = {
+                re.sub(r'^(W/)?"?(.*?)(-gz)?"?$', r"\2", t.strip())
+                for t in self.headers.get("If-None-Match", "").split(",")
+            }
+            status = 304 if etag in known or "*" in known else 200
+            metrics.count("http_responses_total", status=str(status), encoding="gzip" if use_gzip else "identity")
+            payload = gzipped if use_gzip else body
+            self.send_response(status)
+            self.send_header("ETag", f'"{etag}-gz"' if use_gzip else f'"{etag}"')
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Vary", "Accept-Encoding")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            if status == 200:
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                if use_gzip:
+                    self.send_header("Content-Encoding", "gzip")
+            self.end_headers()
+            if status == 200 and send_body:
+                self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logger.debug(f"HTTP {self.address_string()} {format % args}")
+
+    host, _, port = address.rpartition(":")
+    server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, args=(0.2,), daemon=True, name="events-http").start()
+    logger.info(f"events.json по HTTP: http://{server.server_address[0]}:{server.server_address[1]}/events.json")
+    return server
+
+def watch(interval: float = None, http: str = None, stop: threading.Event = None, feed: EventFeed = None) -> None:
+    """Режим наблюдения: опрашивать группы раз в interval секунд и раздавать события по HTTP.
+
+    Хранилище, кэш, HTTP-сессия VK и клиенты геокодеров создаются один раз и
+    живут между итерациями; итерация без новых постов стоит одного wall.get
+    на группу. Ошибка итерации логируется, цикл продолжается до stop.
+    """
+    interval = WATCH_INTERVAL if interval is None else interval
+    http = WATCH_HTTP if http is None else http
+    stop = stop or threading.Event()
+    domains = vk_domains()
+    if not TOKEN:
+        logger.critical("VK_TOKEN не задан (секрет репозитория или .env требуется)")
+        sys.exit(1)
+
+    global metrics, geolog
+    metrics = RunMetrics()
+    events = open_run()
+    state = load_state()
+    feed = feed or EventFeed()
+    feed.update(events.render_json())
+    server = serve_events(feed, http) if http else None
+    logger.info(f"Режим наблюдения: {', '.join(domains)}, опрос каждые {interval:g} с")
+
+    try:
+        while not stop.is_set():
+            started = time.monotonic()
+            geolog = {}
+            try:
+                with metrics.timer("watch_iteration"):
+                    ingest(events, state, domains)
+                    save_run(events, state, quiet=True)
+                if feed.update(events.render_json()):
+                    logger.info(f"Опубликована новая версия events.json: {len(events)} событий")
+            except Exception as e:
+                metrics.count("watch_errors_total")
+                logger.error(f"Ошибка итерации наблюдения: {e}", exc_info=True)
+            metrics.write(METRICS_FILE, METRICS_PROM_FILE)
+            stop.wait(max(0.0, interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+        close_session()
+        metrics.write(METRICS_FILE, METRICS_PROM_FILE)
+        logger.info("Режим наблюдения остановлен")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="MeowAfisha: сбор событий из VK и геокодинг")
+    parser.add_argument("--migrate-cache", action="store_true",
+                        help="свернуть geocode_cache.json на канонические ключи адресов и выйти")
+    parser.add_argument("--reprocess", action="store_true",
+                        help="заново разобрать архив постов без запросов к VK и обновить события")
+    parser.add_argument("--workers", type=int, help="процессов для --reprocess (по умолчанию — по числу ядер)")
+    parser.add_argument("--watch", action="store_true",
+                        help="работать постоянно: опрашивать группы и раздавать events.json по HTTP")
+    parser.add_argument("--interval", type=float, help=f"пауза между опросами, с (WATCH_INTERVAL={WATCH_INTERVAL:g})")
+    parser.add_argument("--http", help=f"адрес HTTP host:port, пустая строка — без сервера (WATCH_HTTP={WATCH_HTTP})")
+    args = parser.parse_args()
+
+    if args.migrate_cache:
+        migrate_cache_file()
+    elif args.reprocess:
+        reprocess(args.workers)
+    elif args.watch:
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        watch(args.interval, args.http, stop)
+    else:
+        main()
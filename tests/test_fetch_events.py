@@ -9,6 +9,8 @@ import pytest
 import json
 import os
 import tempfile
+import threading
+import time
 from unittest.mock import patch, mock_open, MagicMock
 import sys
 from pathlib import Path
@@ -16,7 +18,23 @@ from pathlib import Path
 # Добавляем корневую директорию в путь для импорта
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from fetch_events import extract, load_cache, save_cache, geocode_addr
+from vk_stub import VKStub
+
+from fetch_events import (
+    extract, extract_many, load_cache, save_cache, geocode_addr, geocode_all, TokenBucket,
+    canonical_address, migrate_cache, GeocodeStore, fetch_posts, RunMetrics, cache_lookup,
+    write_partitioned, event_time, EventStore, cluster_points, build_clusters,
+    ProviderStats, address_class, Gazetteer, fetch_domains, vk_domains, CircuitBreakers,
+    EventFeed, serve_events, watch, PostArchive, extract_archive, reprocess,
+    search_terms, build_search_index, search_lookup, event_year, event_details, EVENT_TZ,
+    parse_host_timeouts, shared_geopy_adapter, transport_summary, geocode_many, ingest,
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Пустой журнал кэша во временной директории."""
+    return GeocodeStore(tmp_path / "geocode_cache.jsonl")
 
 
 class TestExtractFunction:
@@ -53,6 +71,13 @@ class TestExtractFunction:
         assert result is not None
         assert "Калининград" in result['location']
 
+    def test_extract_default_city_of_group(self):
+        """Город группы дописывается вместо Калининграда, явный город не трогается."""
+        text = "📍 ул. Ленина, 1\n01.12 | Концерт в центре"
+        assert extract(text, "Светлогорск")['location'] == "ул. Ленина, 1, Светлогорск"
+        text = "📍 ул. Ленина, 1, Калининград\n01.12 | Концерт в центре"
+        assert extract(text, "Светлогорск")['location'] == "ул. Ленина, 1, Калининград"
+
     def test_extract_different_date_formats(self):
         """Тест различных форматов дат."""
         test_cases = [
@@ -72,6 +97,29 @@ class TestExtractFunction:
         result = extract(text)
         assert result['title'] == "Концерт с пробелами"
 
+    def test_extract_date_priority(self):
+        """DD.MM дальше по тексту важнее D/M и D.M в строке заголовка."""
+        text = "1/12 | Заголовок\n📍 Бар\nначало 5.6, финал 05.07"
+        result = extract(text)
+        assert result['date'] == "2025-07-05"
+        assert result['title'] == "Заголовок"
+
+    def test_extract_overlapping_dates(self):
+        """Перекрывающиеся кандидаты «1.12.05» разбираются как раньше."""
+        result = extract("📍 Бар\nсбор 1.12.05")
+        assert result['date'] == "2025-05-12"
+        assert result['title'] == "сбор 1.12.05"
+
+    def test_extract_place_marker_fallback(self):
+        """Без 📍 место берётся из «Место:», пустой 📍 пропускается."""
+        result = extract("01.12 | Лекция\nМесто: Гаражная 2\n📍")
+        assert result['location'] == "Гаражная 2, Калининград"
+
+    def test_extract_many(self):
+        """Пакетный API сохраняет порядок и пропуски."""
+        texts = ["📍 Бар\n01.12 | Раз", "без даты", "📍 Клуб\n02.12 | Два"]
+        assert [r and r['title'] for r in extract_many(texts)] == ["Раз", None, "Два"]
+
 
 class TestCacheFunctions:
     """Тесты для функций работы с кэшем геокодинга."""
@@ -97,20 +145,48 @@ class TestCacheFunctions:
                 assert cache == {}
                 mock_logger.warning.assert_called()
 
-    def test_save_cache_no_changes(self):
+    def test_save_cache_no_changes(self, store):
         """Тест сохранения кэша без изменений."""
-        original_cache = {"test": [1, 2]}
-        with patch('fetch_events.original_cache', original_cache):
-            with patch('builtins.open', mock_open()) as mock_file:
-                save_cache(original_cache, force=False)
-                mock_file.assert_not_called()
+        with patch('builtins.open', mock_open()) as mock_file:
+            save_cache(store, force=False)
+            mock_file.assert_not_called()
 
-    def test_save_cache_with_changes(self):
+    def test_save_cache_with_changes(self, store, tmp_path):
         """Тест сохранения кэша с изменениями."""
-        new_cache = {"test": [1, 2]}
-        with patch('builtins.open', mock_open()) as mock_file:
-            save_cache(new_cache, force=True)
-            mock_file.assert_called_once()
+        store.put("test", [1, 2], "ArcGIS")
+        export = tmp_path / "geocode_cache.json"
+        with patch('fetch_events.CACHE_FILE', export):
+            save_cache(store)
+        assert json.loads(export.read_text(encoding='utf-8')) == {"test": [1, 2]}
+        assert not store.changed
+
+    def test_store_replay(self, store):
+        """Журнал переживает перезапуск: записи, алиасы и метаданные."""
+        store.put("Мира 41, Калининград", [54.72, 20.48], "Yandex")
+        store.alias("Мира 41", canonical_address("Мира 41"))
+        store.flush()
+        reopened = GeocodeStore(store.path)
+        assert reopened["Мира 41"] == [54.72, 20.48]
+        assert reopened.lookup("Мира 41, Калининград")["provider"] == "Yandex"
+
+    def test_store_compaction(self, store):
+        """Компактирование оставляет по одной строке на запись и алиас."""
+        for i in range(5):
+            store.put("Мира 41", [54.72, 20.48 + i], "ArcGIS")
+        store.flush()
+        store.compact()
+        assert len(store.path.read_text(encoding='utf-8').splitlines()) == 2
+        assert GeocodeStore(store.path)["Мира 41"] == [54.72, 24.48]
+
+    def test_negative_backoff(self, store):
+        """Неудачи откладывают повтор экспоненциально."""
+        with patch('fetch_events.GEOCODE_NEGATIVE_TTL', 100):
+            first = store.put_negative("nowhere")
+            second = store.put_negative("nowhere")
+        assert first["expires"] - first["ts"] == 100
+        assert second["expires"] - second["ts"] == 200
+        assert second["failures"] == 2
+        assert store.export() == {}
 
 
 class TestGeocoding:
@@ -121,12 +197,33 @@ class TestGeocoding:
         result = geocode_addr("")
         assert result == (None, None)
 
-    def test_geocode_from_cache(self):
+    def test_geocode_from_cache(self, store):
         """Тест получения координат из кэша."""
-        with patch('fetch_events.geocache', {"cached address": [54.71, 20.51]}):
+        store.put("cached address", [54.71, 20.51])
+        with patch('fetch_events.geocache', store):
             result = geocode_addr("cached address")
             assert result == (54.71, 20.51)
 
+    def test_geocode_negative_hit_skips_providers(self, store):
+        """Свежая отрицательная запись не вызывает провайдеров повторно."""
+        store.put_negative("nowhere")
+        provider = MagicMock()
+        with patch('fetch_events.geocache', store), \
+             patch('fetch_events.GEOCODERS', [{"name": "ArcGIS", "func": provider}]):
+            assert geocode_addr("nowhere") == (None, None)
+        provider.assert_not_called()
+
+    def test_geocode_expired_negative_retries(self, store):
+        """Просроченная отрицательная запись снова идёт в каскад."""
+        store.put_negative("somewhere")
+        store.entries[canonical_address("somewhere")]["expires"] = 0
+        provider = MagicMock(return_value=MagicMock(latitude=54.7, longitude=20.5))
+        with patch('fetch_events.geocache', store), \
+             patch('fetch_events.geolog', {}), \
+             patch('fetch_events.GEOCODERS', [{"name": "ArcGIS", "func": provider}]):
+            assert geocode_addr("somewhere") == (54.7, 20.5)
+        assert store.lookup("somewhere")["provider"] == "ArcGIS"
+
     @pytest.mark.skip(reason="Геокодинг тесты требуют сложного мокирования реальных сервисов")
     def test_geocode_success_arcgis(self):
         """Тест успешного геокодинга через ArcGIS."""
@@ -138,6 +235,1407 @@ class TestGeocoding:
         pass
 
 
+class TestCanonicalAddress:
+    """Тесты для канонических ключей адресов."""
+
+    def test_spelling_variants_share_key(self):
+        """Эмодзи, регистр, транслитерация и город по умолчанию не влияют на ключ."""
+        assert canonical_address("📍Барн, Каштановая аллея 1а") == \
+            canonical_address("Barn, Каштановая аллея 1А, Калининград")
+
+    def test_street_abbreviations(self):
+        """Сокращения типов улиц и номера домов приводятся к одной форме."""
+        assert canonical_address("ул. Ленина, д. 1 а") == canonical_address("Ленина 1-А")
+        assert canonical_address("пр-т Мира 10 корп. 2") == canonical_address("проспект Мира 10к2")
+
+    def test_house_letters_not_expanded(self):
+        """Буква после номера дома — литера, а не «бульвар», «дом» или «город»."""
+        assert canonical_address("Ленина 1 б") == canonical_address("Ленина 1б") == "lenina 1b"
+        assert canonical_address("Ленина 10 д") == "lenina 10d" != canonical_address("Ленина 10")
+        assert canonical_address("Ленина, 3 г") == "lenina 3g"
+        assert canonical_address("б. Победы 10") == "bulvar pobedy 10"
+
+    def test_building_after_comma(self):
+        """Корпус и литера через запятую склеиваются с номером дома."""
+        assert canonical_address("Ленина 5, корп. 2") == canonical_address("Ленина 5к2") == "lenina 5k2"
+        assert canonical_address("Ленина 5, лит. А") == "lenina 5a"
+        assert canonical_address("Мира 5, к/т Заря") == "mira 5, k t zarya"
+
+    def test_other_town_kept(self):
+        """Город, отличный от Калининграда, остаётся частью ключа."""
+        assert canonical_address("Ленина 11, Светлогорск") != canonical_address("Ленина 11")
+
+    def test_migrate_cache_collapses_variants(self):
+        """Миграция даёт всем вариантам адреса одни координаты."""
+        cache = {
+            "Barn, Каштановая аллея 1а, Калининград": [54.71, 20.46],
+            "📍Барн, Каштановая аллея 1А": [None, None],
+            "Мира 41": [54.72, 20.48],
+        }
+        migrated = migrate_cache(cache)
+        assert list(migrated) == list(cache)
+        assert migrated["📍Барн, Каштановая аллея 1А"] == [54.71, 20.46]
+        assert migrated["Мира 41"] == [54.72, 20.48]
+
+    def test_geocode_canonical_hit(self, store):
+        """Вариант написания берётся из кэша и сохраняется как алиас."""
+        store.import_legacy({"Barn, Каштановая аллея 1а, Калининград": [54.71, 20.46]})
+        with patch('fetch_events.geocache', store), \
+             patch('fetch_events.GEOCODERS', []):
+            assert geocode_addr("Барн, каштановая аллея 1А") == (54.71, 20.46)
+        assert store.export()["Барн, каштановая аллея 1А"] == [54.71, 20.46]
+
+
+class FakeClock:
+    """Управляемые часы для тестов ограничителей скорости."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestConcurrentGeocoding:
+    """Тесты для token bucket и параллельного геокодинга."""
+
+    def test_token_bucket_spacing(self):
+        """Bucket пропускает первый запрос сразу, следующие — через min_delay."""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1.0, clock=clock, sleep=clock.sleep)
+        for _ in range(3):
+            bucket.acquire()
+        assert clock.sleeps == [1.0, 1.0]
+
+    def test_token_bucket_refills(self):
+        """После паузы токен восстанавливается без ожидания."""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2.0, clock=clock, sleep=clock.sleep)
+        bucket.acquire()
+        clock.now += 0.5
+        assert bucket.reserve() == 0.0
+
+    def test_token_bucket_zero_delay(self):
+        """Нулевая задержка отключает ограничение."""
+        assert TokenBucket.from_delay(0).reserve() == 0.0
+
+    def test_geocode_all_deterministic(self, store):
+        """Параллельный результат совпадает с последовательным, порядок кэша стабилен."""
+        def arcgis(addr):
+            return None if addr.startswith("x") else MagicMock(latitude=len(addr), longitude=1.0)
+
+        def nominatim(addr):
+            return MagicMock(latitude=2.0, longitude=2.0)
+
+        providers = [{"name": "ArcGIS", "func": arcgis}, {"name": "Nominatim", "func": nominatim}]
+        addrs = ["b1", " x2", "b1", "ccc3", "x4 ", ""]
+        with patch('fetch_events.GEOCODERS', providers), \
+             patch('fetch_events.geocache', store), \
+             patch('fetch_events.geolog', {}):
+            result = geocode_all(addrs, workers=4)
+            assert list(store) == ["b1", "x2", "ccc3", "x4"]
+
+        assert result == {"b1": (2, 1.0), "x2": (2.0, 2.0), "ccc3": (4, 1.0), "x4": (2.0, 2.0)}
+
+    def providers(self, calls, delays=(0.01, 0.01, 0.02)):
+        """Три провайдера с token bucket; каждый вызов пишется в calls."""
+        from fetch_events import rate_limited
+
+        def provider(name, lat, delay):
+            def geocode(addr):
+                calls.append(name)
+                return MagicMock(latitude=lat, longitude=20.5)
+            return {"name": name, "func": rate_limited(geocode, TokenBucket.from_delay(delay))}
+        return [provider(name, lat, delay) for (name, lat), delay
+                in zip([("ArcGIS", 54.7), ("Yandex", 54.71), ("Nominatim", 54.72)], delays)]
+
+    def test_first_attempts_spread_across_providers(self, monkeypatch, tmp_path):
+        """Потоки начинают с разных провайдеров по их квотам; в одном потоке — все с первого."""
+        from fetch_events import spread_starts
+        calls = []
+        providers = self.providers(calls)
+        assert spread_starts(providers, 5) == ["ArcGIS", "Yandex", "Nominatim", "ArcGIS", "Yandex"]
+        monkeypatch.setattr("fetch_events.GEOCODERS", providers)
+        monkeypatch.setattr("fetch_events.provider_stats", None)
+        monkeypatch.setattr("fetch_events.geolog", {})
+        addrs = [f"ул. Мира {i}" for i in range(15)]
+
+        def run(spread, workers, name):
+            monkeypatch.setattr("fetch_events.GEOCODE_SPREAD", spread)
+            monkeypatch.setattr("fetch_events.geocache", GeocodeStore(tmp_path / f"{name}.jsonl"))
+            calls.clear()
+            result = geocode_all(addrs, workers=workers)
+            return {name: calls.count(name) for name in ("ArcGIS", "Yandex", "Nominatim")}, result
+
+        counts, result = run(True, 4, "spread")
+        assert counts == {"ArcGIS": 6, "Yandex": 6, "Nominatim": 3}
+        assert run(True, 4, "again")[1] == result
+        assert run(False, 4, "static")[0] == {"ArcGIS": 15, "Yandex": 0, "Nominatim": 0}
+        assert run(True, 1, "sequential")[0] == {"ArcGIS": 15, "Yandex": 0, "Nominatim": 0}
+
+    def test_spread_keeps_learned_order(self, monkeypatch, tmp_path):
+        """С адаптивным порядком первые попытки делятся только между провайдерами с оценкой рядом с лучшей."""
+        monkeypatch.setattr("fetch_events.GEOCODE_STATS_MIN", 5)
+        stats = ProviderStats()
+        for i in range(10):
+            stats.record("ул. Мира 1", "ArcGIS", i < 2, 2.0)
+            stats.record("ул. Мира 1", "Yandex", True, 2.0)
+            stats.record("ул. Мира 1", "Nominatim", i < 9, 2.0)
+        calls = []
+        monkeypatch.setattr("fetch_events.GEOCODERS", self.providers(calls, delays=(0.01,) * 3))
+        monkeypatch.setattr("fetch_events.provider_stats", stats)
+        monkeypatch.setattr("fetch_events.GEOCODE_SPREAD", True)
+        monkeypatch.setattr("fetch_events.geocache", GeocodeStore(tmp_path / "cache.jsonl"))
+        monkeypatch.setattr("fetch_events.geolog", {})
+        assert stats.contenders(self.providers([]), "ул. Мира 2") == {"Yandex", "Nominatim"}
+
+        geocode_all([f"ул. Мира {i}" for i in range(15)], workers=4)
+        assert {name: calls.count(name) for name in ("ArcGIS", "Yandex", "Nominatim")} == \
+            {"ArcGIS": 0, "Yandex": 10, "Nominatim": 5}
+
+
+def wall_pages(ids, pinned=None, page=2):
+    """Страницы wall.get по убыванию id; pinned — id закреплённого поста."""
+    items = ([{"id": pinned, "date": pinned, "is_pinned": 1}] if pinned else [])
+    items += [{"id": i, "date": i, "text": f"post {i}"} for i in ids]
+    return lambda offset, domain=None: items[offset // 100 * page:(offset // 100 + 1) * page]
+
+
+class TestIncrementalFetch:
+    """Тесты инкрементальной загрузки стены по отметке."""
+
+    def test_stops_at_known_post(self):
+        """Листание останавливается на первом уже обработанном посте."""
+        with patch('fetch_events.vk_wall', wall_pages([10, 9, 8, 7, 6])), \
+             patch('fetch_events.MAX_POSTS', 1000), patch('fetch_events.WAIT_REQ', 0):
+            posts, newest, complete = fetch_posts({"last_id": 8})
+        assert [p["id"] for p in posts] == [10, 9]
+        assert newest == {"last_id": 10, "last_date": 10}
+        assert complete
+
+    def test_old_pinned_post_does_not_stop(self):
+        """Старый закреплённый пост пропускается, а не обрывает листание."""
+        with patch('fetch_events.vk_wall', wall_pages([10, 9, 8], pinned=3)), \
+             patch('fetch_events.MAX_POSTS', 1000), patch('fetch_events.WAIT_REQ', 0):
+            posts, newest, _ = fetch_posts({"last_id": 8})
+        assert [p["id"] for p in posts] == [10, 9]
+        assert newest["last_id"] == 10
+
+    def test_rescan_window(self):
+        """VK_RESCAN_POSTS дочитывает известные посты ради правок."""
+        with patch('fetch_events.vk_wall', wall_pages([10, 9, 8, 7, 6])), \
+             patch('fetch_events.MAX_POSTS', 1000), patch('fetch_events.WAIT_REQ', 0), \
+             patch('fetch_events.VK_RESCAN_POSTS', 2):
+            posts, _, _ = fetch_posts({"last_id": 9})
+        assert [p["id"] for p in posts] == [10, 9, 8]
+
+    def test_failed_page_keeps_mark(self):
+        """Ошибка посреди листания помечает проход незавершённым."""
+        def wall(offset, domain=None):
+            if offset:
+                raise RuntimeError("VK down")
+            return [{"id": 10, "date": 10}]
+        with patch('fetch_events.vk_wall', wall), \
+             patch('fetch_events.MAX_POSTS', 1000), patch('fetch_events.WAIT_REQ', 0):
+            posts, _, complete = fetch_posts({})
+        assert [p["id"] for p in posts] == [10]
+        assert not complete
+
+
+@pytest.fixture
+def vk_stub():
+    """Stub VK API с 350 постами группы meowafisha."""
+    posts = [{"id": i, "date": i, "text": f"post {i}"} for i in range(350, 0, -1)]
+    with VKStub({"meowafisha": posts}) as stub:
+        with patch('fetch_events.VK_API', stub.url), patch('fetch_events.TOKEN', 'token'), \
+             patch('fetch_events.DOMAIN', 'meowafisha'), patch('fetch_events.WAIT_REQ', 0), \
+             patch('fetch_events.MAX_POSTS', 400):
+            yield stub
+
+
+class TestExecuteBatching:
+    """Тесты пакетной загрузки стены через execute."""
+
+    def test_single_execute_call(self, vk_stub):
+        """Все страницы приходят одним вызовом execute."""
+        with patch('fetch_events.VK_EXECUTE_PAGES', 25):
+            posts, newest, complete = fetch_posts({})
+        assert [p["id"] for p in posts] == list(range(350, 0, -1))
+        assert vk_stub.methods() == ["execute"]
+        assert newest["last_id"] == 350 and complete
+
+    def test_failed_subcall_refetched(self, vk_stub):
+        """Упавший подзапрос перезапрашивается отдельным wall.get."""
+        vk_stub.failing_offsets = {100}
+        with patch('fetch_events.VK_EXECUTE_PAGES', 25):
+            posts, _, complete = fetch_posts({})
+        assert len(posts) == 350 and complete
+        assert vk_stub.methods() == ["execute", "wall.get"]
+        assert vk_stub.calls[1][1]["offset"] == "100"
+
+    def test_execute_error_falls_back(self, vk_stub):
+        """Ошибка execute целиком — страницы грузятся по одной."""
+        vk_stub.execute_error = True
+        with patch('fetch_events.VK_EXECUTE_PAGES', 25):
+            posts, _, _ = fetch_posts({})
+        assert len(posts) == 350
+        assert vk_stub.methods()[1:] == ["wall.get"] * 4
+
+    def test_prefetch_pipeline(self, vk_stub):
+        """С предзагрузкой порядок постов и число вызовов не меняются."""
+        with patch('fetch_events.VK_EXECUTE_PAGES', 2), patch('fetch_events.VK_PREFETCH', True):
+            posts, _, _ = fetch_posts({})
+        assert [p["id"] for p in posts] == list(range(350, 0, -1))
+        assert vk_stub.methods() == ["execute", "execute"]
+
+    def test_stops_at_mark_with_plain_wall_get(self, vk_stub):
+        """Без execute обычный wall.get останавливается на отметке."""
+        posts, _, _ = fetch_posts({"last_id": 300})
+        assert len(posts) == 50
+        assert vk_stub.methods() == ["wall.get"]
+
+
+@pytest.fixture
+def vk_two_groups():
+    """Stub VK API с двумя группами: 350 и 150 постов."""
+    posts = {
+        "meowafisha": [{"id": i, "date": i, "text": f"post {i}"} for i in range(350, 0, -1)],
+        "svetlogorsk": [{"id": i, "date": i, "text": f"svet {i}"} for i in range(150, 0, -1)],
+    }
+    with VKStub(posts) as stub:
+        with patch('fetch_events.VK_API', stub.url), patch('fetch_events.TOKEN', 'token'), \
+             patch('fetch_events.VK_RPS', 100.0), patch('fetch_events.MAX_POSTS', 400):
+            yield stub
+
+
+class TestMultiDomain:
+    """Тесты загрузки нескольких групп под общим лимитом VK."""
+
+    def test_vk_domains_config(self):
+        """VK_DOMAINS: группы с необязательным городом; пусто — только VK_DOMAIN."""
+        with patch('fetch_events.VK_DOMAINS', "meowafisha, svetlogorsk:Светлогорск"):
+            assert vk_domains() == {"meowafisha": "Калининград", "svetlogorsk": "Светлогорск"}
+        with patch('fetch_events.VK_DOMAINS', ""), patch('fetch_events.DOMAIN', "meowafisha"):
+            assert vk_domains() == {"meowafisha": "Калининград"}
+
+    def test_groups_fetched_in_round_robin(self, vk_two_groups):
+        """Запросы групп чередуются, общий темп не выше VK_RPS."""
+        start = time.monotonic()
+        result = fetch_domains({"meowafisha": {}, "svetlogorsk": {}})
+        elapsed = time.monotonic() - start
+
+        assert [p["id"] for p in result["meowafisha"][0]] == list(range(350, 0, -1))
+        assert [p["id"] for p in result["svetlogorsk"][0]] == list(range(150, 0, -1))
+        assert all(complete for _, _, complete in result.values())
+        order = [params["domain"] for _, params in vk_two_groups.calls]
+        rounds = order.count("svetlogorsk")
+        for i in range(0, 2 * rounds, 2):
+            assert set(order[i:i + 2]) == {"meowafisha", "svetlogorsk"}
+        assert set(order[2 * rounds:]) == {"meowafisha"}
+        assert elapsed >= (len(order) - 1) / 100 * 0.9
+
+    def test_posts_delivered_in_caller_thread(self, vk_two_groups):
+        """on_post вызывается в вызывающем потоке для постов всех групп."""
+        seen = []
+        fetch_domains({"meowafisha": {"last_id": 340}, "svetlogorsk": {"last_id": 145}},
+                      on_post=lambda domain, item: seen.append((domain, threading.current_thread())))
+        assert {d for d, _ in seen} == {"meowafisha", "svetlogorsk"}
+        assert len(seen) == 15
+        assert all(t is threading.current_thread() for _, t in seen)
+
+    def test_duplicate_owned_by_first_listed_group(self, monkeypatch, tmp_path):
+        """Событие из двух групп достаётся первой в VK_DOMAINS, даже если вторая пришла раньше."""
+        import fetch_events
+        text = "📍 ул. Мира, 1\n01.12 | Концерт"
+
+        def fetch(marks, on_post=None):
+            on_post("b", {"id": 2, "date": 2, "text": text})
+            on_post("a", {"id": 1, "date": 1, "text": text})
+            return {d: ([], {"last_id": 0}, True) for d in marks}
+        ok = MagicMock(latitude=54.7, longitude=20.5)
+        for name, value in [("fetch_domains", fetch), ("GEOCODERS", [{"name": "ArcGIS", "func": lambda a: ok}]),
+                            ("BATCH_GEOCODERS", []), ("geocache", GeocodeStore(tmp_path / "c.jsonl")),
+                            ("geolog", {}), ("provider_stats", None), ("breakers", None), ("gazetteer", None),
+                            ("archive", None), ("metrics", RunMetrics())]:
+            monkeypatch.setattr(fetch_events, name, value)
+        events = EventStore(tmp_path / "events.jsonl")
+        assert ingest(events, {}, {"a": "Калининград", "b": "Калининград"}) == 1
+        assert events.get("a:1") is not None and events.get("b:2") is None
+
+
+class TestWatchMode:
+    """Тесты режима наблюдения и HTTP-раздачи events.json."""
+
+    @pytest.fixture
+    def server(self):
+        feed = EventFeed('[{"title": "A"}]')
+        srv = serve_events(feed, "127.0.0.1:0")
+        yield feed, f"http://127.0.0.1:{srv.server_address[1]}/events.json"
+        srv.shutdown()
+        srv.server_close()
+
+    def test_etag_and_not_modified(self, server):
+        """Повтор с If-None-Match — 304 без тела; после обновления — новое тело."""
+        import requests
+        feed, url = server
+        first = requests.get(url, headers={"Accept-Encoding": "identity"})
+        assert first.status_code == 200 and first.json() == [{"title": "A"}]
+        again = requests.get(url, headers={"If-None-Match": first.headers["ETag"], "Accept-Encoding": "identity"})
+        assert again.status_code == 304 and again.content == b""
+
+        assert feed.update('[{"title": "B"}]')
+        assert not feed.update('[{"title": "B"}]')
+        changed = requests.get(url, headers={"If-None-Match": first.headers["ETag"], "Accept-Encoding": "identity"})
+        assert changed.status_code == 200 and changed.json() == [{"title": "B"}]
+
+    def test_gzip_variant(self, server):
+        """С Accept-Encoding: gzip отдаётся сжатая копия, её ETag тоже даёт 304."""
+        import requests
+        _, url = server
+        r = requests.get(url)
+        assert r.headers["Content-Encoding"] == "gzip" and r.headers["ETag"].endswith('-gz"')
+        assert r.json() == [{"title": "A"}]
+        assert requests.get(url, headers={"If-None-Match": r.headers["ETag"]}).status_code == 304
+
+    def test_new_posts_picked_up_between_polls(self, monkeypatch, tmp_path):
+        """Новый пост появляется в ленте со следующим опросом; холостой опрос — один wall.get."""
+        posts = {"meowafisha": [{"id": 1, "date": 1, "text": "📍 ул. Мира, 1\n01.12 | Концерт"}]}
+        ok = MagicMock(latitude=54.7, longitude=20.5)
+        monkeypatch.chdir(tmp_path)
+        for name, value in [("TOKEN", "token"), ("DOMAIN", "meowafisha"), ("VK_DOMAINS", ""),
+                            ("WAIT_REQ", 0), ("MAX_POSTS", 100), ("GAZETTEER", False),
+                            ("GEOCODERS", [{"name": "ArcGIS", "func": lambda a: ok}]),
+                            ("geocache", None), ("provider_stats", None), ("breakers", None),
+                            ("gazetteer", None), ("metrics", RunMetrics())]:
+            monkeypatch.setattr(f"fetch_events.{name}", value)
+        feed, stop = EventFeed(), threading.Event()
+
+        def wait_for(predicate):
+            deadline = time.monotonic() + 5
+            while not predicate() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert predicate()
+
+        with VKStub(posts) as stub:
+            monkeypatch.setattr("fetch_events.VK_API", stub.url)
+            thread = threading.Thread(target=watch, args=(0.05, "", stop, feed))
+            thread.start()
+            try:
+                wait_for(lambda: len(json.loads(feed.body)) == 1)
+                polls = len(stub.calls)
+                wait_for(lambda: len(stub.calls) >= polls + 2)
+                assert stub.methods()[-1] == "wall.get"
+                stub.posts["meowafisha"].insert(0, {"id": 2, "date": 2, "text": "📍 ул. Мира, 2\n02.12 | Спектакль"})
+                wait_for(lambda: len(json.loads(feed.body)) == 2)
+            finally:
+                stop.set()
+                thread.join(5)
+        assert json.loads((tmp_path / "events.json").read_text(encoding="utf-8"))[1]["title"] == "Спектакль"
+
+
+class TestPostArchive:
+    """Тесты архива сырых постов и повторного разбора."""
+
+    POST = {"id": 7, "date": 1, "text": "📍 ул. Мира, 1\n01.12 | Концерт", "likes": {"count": 1}}
+
+    @pytest.mark.parametrize("name", ["posts.jsonl", "posts.jsonl.gz"])
+    def test_append_only_versions(self, tmp_path, name):
+        """Неизменённый пост не дублируется, правка дописывается; счётчики не хранятся."""
+        archive = PostArchive(tmp_path / name)
+        assert archive.add("meowafisha", self.POST)
+        archive.flush()
+        reopened = PostArchive(tmp_path / name)
+        assert not reopened.add("meowafisha", dict(self.POST, likes={"count": 5}))
+        assert reopened.add("meowafisha", dict(self.POST, text="📍 ул. Мира, 2\n01.12 | Концерт"))
+        reopened.flush()
+        records = list(PostArchive(tmp_path / name).records())
+        assert [r["key"] for r in records] == ["meowafisha:7", "meowafisha:7"]
+        assert "likes" not in records[0]["post"] and records[1]["post"]["text"].startswith("📍 ул. Мира, 2")
+
+    def test_truncated_gzip_tolerated(self, tmp_path):
+        """Оборванный последний член gzip не мешает прочитать предыдущие записи."""
+        archive = PostArchive(tmp_path / "posts.jsonl.gz")
+        archive.add("meowafisha", self.POST)
+        archive.flush()
+        first = archive.path.stat().st_size
+        archive.add("meowafisha", dict(self.POST, id=8))
+        archive.flush()
+        archive.path.write_bytes(archive.path.read_bytes()[:first + 20])
+        assert [r["key"] for r in PostArchive(archive.path).records()] == ["meowafisha:7"]
+
+    def test_process_pool_keeps_order(self, tmp_path):
+        """Пул процессов даёт те же результаты в порядке архива; город берётся из группы."""
+        archive = PostArchive(tmp_path / "posts.jsonl")
+        for i in range(30):
+            archive.add("svetlogorsk" if i % 3 else "meowafisha",
+                        {"id": i, "date": i, "text": f"📍 ул. Мира, {i}\n01.12 | Событие {i}" if i % 5 else "реклама"})
+        archive.flush()
+        domains = {"meowafisha": "Калининград", "svetlogorsk": "Светлогорск"}
+        serial = list(extract_archive(archive, domains, workers=1, chunk_size=4))
+        parallel = list(extract_archive(archive, domains, workers=2, chunk_size=4))
+        assert parallel == serial
+        assert [key for key, _ in serial] == [f"{'svetlogorsk' if i % 3 else 'meowafisha'}:{i}" for i in range(30)]
+        assert serial[0][1] is None and serial[1][1]["location"] == "ул. Мира, 1, Светлогорск"
+
+    def test_only_latest_version_extracted(self, tmp_path):
+        """Из нескольких версий поста разбирается только последняя, в порядке её появления."""
+        archive = PostArchive(tmp_path / "posts.jsonl")
+        archive.add("meowafisha", dict(self.POST, text="📍 ул. Мра, 1\n01.12 | Концерт"))
+        archive.add("meowafisha", dict(self.POST, id=8))
+        archive.add("meowafisha", self.POST)
+        archive.flush()
+        results = list(extract_archive(archive, {"meowafisha": "Калининград"}, workers=1, chunk_size=1))
+        assert [key for key, _ in results] == ["meowafisha:8", "meowafisha:7"]
+        assert results[1][1]["location"] == "ул. Мира, 1, Калининград"
+
+    def test_reprocess_updates_store(self, monkeypatch, tmp_path):
+        """reprocess без VK: новое событие вставляется, пост без события удаляет старое."""
+        monkeypatch.chdir(tmp_path)
+        ok = MagicMock(latitude=54.7, longitude=20.5)
+        for name, value in [("GAZETTEER", False), ("GEOCODERS", [{"name": "ArcGIS", "func": lambda a: ok}]),
+                            ("geocache", None), ("provider_stats", None), ("breakers", None),
+                            ("gazetteer", None), ("archive", None), ("metrics", RunMetrics()),
+                            ("VK_DOMAINS", ""), ("DOMAIN", "meowafisha")]:
+            monkeypatch.setattr(f"fetch_events.{name}", value)
+        store = EventStore(tmp_path / "events_store.jsonl")
+        store.put("meowafisha:8", {"title": "Старое", "date": "2025-12-02", "location": "Площадь",
+                                   "lat": 54.7, "lon": 20.5, "text": "старое"})
+        store.flush()
+        archive = PostArchive(tmp_path / "posts_archive.jsonl")
+        archive.add("meowafisha", self.POST)
+        archive.add("meowafisha", {"id": 8, "date": 2, "text": "пост без события"})
+        archive.flush()
+
+        reprocess(workers=1)
+        events = json.loads((tmp_path / "events.json").read_text(encoding="utf-8"))
+        assert [e["title"] for e in events] == ["Концерт"]
+
+
+class TestRunMetrics:
+    """Тесты для метрик прогона."""
+
+    def test_histogram_and_quantile(self):
+        """Гистограмма накапливает значения по корзинам, квантиль — верхняя граница."""
+        m = RunMetrics()
+        for seconds in (0.03, 0.2, 0.2, 3.0):
+            m.observe("provider_latency_seconds", seconds, provider="ArcGIS")
+        assert m.quantile("provider_latency_seconds", 0.5, provider="ArcGIS") == 0.25
+        assert m.quantile("provider_latency_seconds", 0.9, provider="ArcGIS") == 5.0
+        assert m.quantile("provider_latency_seconds", 0.9, provider="Yandex") is None
+
+    def test_prometheus_format(self):
+        """Текст для textfile collector: counter и histogram с метками."""
+        m = RunMetrics()
+        m.count("cache_lookups_total", result="hit")
+        m.count("cache_lookups_total", result="miss")
+        with m.timer("extract"):
+            pass
+        text = m.prometheus()
+        assert 'meowafisha_cache_lookups_total{result="hit"} 1' in text
+        assert "meowafisha_cache_hit_ratio 0.500000" in text
+        assert 'meowafisha_stage_seconds_bucket{stage="extract",le="+Inf"} 1' in text
+        assert "# TYPE meowafisha_stage_seconds histogram" in text
+
+    def test_write_json(self, tmp_path):
+        """Сводка сохраняется в JSON."""
+        m = RunMetrics()
+        m.count("posts_processed_total", 3)
+        m.write(tmp_path / "run_metrics.json", tmp_path / "run_metrics.prom")
+        summary = json.loads((tmp_path / "run_metrics.json").read_text(encoding='utf-8'))
+        assert summary["counters"] == [{"name": "posts_processed_total", "labels": {}, "value": 3}]
+        assert (tmp_path / "run_metrics.prom").exists()
+
+    def test_cache_lookup_counters(self, store):
+        """Попадания, промахи и отрицательные попадания считаются отдельно."""
+        store.put("есть", [54.7, 20.5])
+        store.put_negative("нет")
+        m = RunMetrics()
+        with patch('fetch_events.geocache', store), patch('fetch_events.metrics', m):
+            cache_lookup("есть")
+            cache_lookup("нет")
+            cache_lookup("новый")
+        results = {dict(labels)["result"]: v for (name, labels), v in m.counters.items()}
+        assert results == {"hit": 1, "negative_hit": 1, "miss": 1}
+
+
+class TestStartup:
+    """Тесты быстрого старта: тяжёлые зависимости не импортируются заранее."""
+
+    def test_import_is_cheap(self):
+        """Импорт модуля не тянет pandas/geopy/requests и укладывается в бюджет."""
+        import subprocess
+        code = (
+            "import sys, time; t = time.perf_counter(); import fetch_events; t = time.perf_counter() - t; "
+            "print(t, *(m for m in ('pandas', 'geopy', 'requests') if m in sys.modules))"
+        )
+        out = subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parent.parent,
+                             capture_output=True, text=True, check=True).stdout.split()
+        assert out[1:] == []
+        assert float(out[0]) < float(os.getenv("IMPORT_BUDGET", "0.15"))
+
+    def test_clients_created_once(self, monkeypatch):
+        """Геокодеры и сессия создаются при первом обращении и переиспользуются."""
+        import fetch_events
+        monkeypatch.setattr(fetch_events, "GEOCODERS", None)
+        monkeypatch.setattr(fetch_events, "session", None)
+        geocoders = fetch_events.get_geocoders()
+        assert [p["name"] for p in geocoders] == ["ArcGIS", "Yandex", "Nominatim"]
+        assert fetch_events.get_geocoders() is geocoders
+        session = fetch_events.get_session()
+        assert fetch_events.get_session() is session
+        fetch_events.close_session()
+        assert fetch_events.session is None
+
+
+class TestPartitionedOutput:
+    """Тесты секционированной выгрузки: индекс + помесячные шарды."""
+
+    EVENTS = [
+        {"title": "Концерт", "date": "2025-06-01", "location": "ул. Мира 1, Калининград",
+         "lat": 54.7, "lon": 20.5, "text": "01.06 | Концерт\n19:00 - 21:30\n📍 ул. Мира 1"},
+        {"title": "Лекция", "date": "2025-07-02", "location": "Светлогорск",
+         "lat": 54.9, "lon": 20.1, "text": "02.07 | Лекция\nНачало в 18:00"},
+    ]
+
+    def test_index_and_shards(self, tmp_path):
+        """Индекс без текстов ссылается на шарды с полными записями и их gzip-копиями."""
+        import gzip
+        index = write_partitioned(self.EVENTS, tmp_path)
+        assert sorted(index["shards"]) == ["2025-06", "2025-07"]
+        first = index["events"][0]
+        assert first["location"] == "ул. Мира 1"
+        assert first["time"] == "19:00-21:30"
+        assert "text" not in first
+        assert json.loads((tmp_path / "index.json").read_text(encoding="utf-8")) == index
+
+        shard = tmp_path / index["shards"][first["shard"]]
+        records = json.loads(shard.read_text(encoding="utf-8"))
+        assert records[0]["id"] == first["id"] and records[0]["text"] == self.EVENTS[0]["text"]
+        assert gzip.decompress(shard.with_name(shard.name + ".gz").read_bytes()) == shard.read_bytes()
+        assert "\n " not in shard.read_text(encoding="utf-8")  # минифицировано
+
+    def test_changed_month_replaces_shard(self, tmp_path):
+        """Изменился месяц — новый хэш в имени, старый шард удалён, другой не тронут."""
+        before = write_partitioned(self.EVENTS, tmp_path)
+        changed = [dict(self.EVENTS[0], title="Концерт (перенос)"), self.EVENTS[1]]
+        after = write_partitioned(changed, tmp_path)
+        assert after["shards"]["2025-07"] == before["shards"]["2025-07"]
+        assert after["shards"]["2025-06"] != before["shards"]["2025-06"]
+        assert not (tmp_path / before["shards"]["2025-06"]).exists()
+        assert not (tmp_path / (before["shards"]["2025-06"] + ".gz")).exists()
+
+    def test_event_time_matches_frontend(self):
+        """Время извлекается как в extractTimeFromText: диапазон, одно время, не дата."""
+        assert event_time("с 9:05 - 18:00") == "09:05-18:00"
+        assert event_time("в 25:00-26:00, потом 20:15") is None  # фронтенд смотрит только первое совпадение
+        assert event_time("Начало 18:00") == "18:00"
+        assert event_time("01.06 без времени") is None
+
+
+class TestSearchIndex:
+    """Тесты поискового индекса выгрузки."""
+
+    EVENTS = TestPartitionedOutput.EVENTS + [
+        {"title": "Jazz Ёлка", "date": "2025-07-03", "location": "Бар «Пармезан», Калининград",
+         "lat": 54.7, "lon": 20.5, "text": "03.07 | Jazz Ёлка\nвход свободный"},
+    ]
+
+    def test_terms_and_transliteration(self):
+        """Нижний регистр, ё → е, варианты в обе стороны; однобуквенные слова отброшены."""
+        assert search_terms("Jazz Ёлка в 5") == {"jazz", "джазз", "елка", "elka", "5"}
+        assert search_terms("Щука", variants=False) == {"щука"}
+
+    def test_prefix_and_all_words(self):
+        """Каждое слово запроса — префикс терма; латиница находит кириллицу и наоборот."""
+        index = build_search_index(self.EVENTS)
+        assert index["version"] == 1 and index["count"] == 3
+        assert search_lookup(index, "конц") == [0]
+        assert search_lookup(index, "parmez") == [2]
+        assert search_lookup(index, "джаз ёлк") == [2]
+        assert search_lookup(index, "свободн") == [2]  # слово из текста поста
+        assert search_lookup(index, "концерт лекция") == []
+        assert search_lookup(index, "мира 1") == [0]
+
+    def test_written_with_partitioned_output(self, tmp_path):
+        """index.json ссылается на файл индекса; номера документов — позиции в index.events."""
+        index = write_partitioned(self.EVENTS, tmp_path)
+        search = json.loads((tmp_path / index["search"]).read_text(encoding="utf-8"))
+        assert search["count"] == len(index["events"])
+        assert [index["events"][d]["title"] for d in search_lookup(search, "jazz")] == ["Jazz Ёлка"]
+
+        write_partitioned(self.EVENTS[:2], tmp_path)
+        assert not (tmp_path / index["search"]).exists()
+
+
+class TestEventStore:
+    """Тесты хранилища событий по id поста."""
+
+    def event(self, title="Концерт", date="2025-06-01", **extra):
+        return {"title": title, "date": date, "location": "Мира 1, Калининград",
+                "lat": 54.7, "lon": 20.5, "text": f"{title}\n📍 Мира 1", **extra}
+
+    def test_edited_post_updates_in_place(self, tmp_path):
+        """Правка поста обновляет событие под тем же ключом, повтор без изменений — no-op."""
+        store = EventStore(tmp_path / "events.jsonl")
+        assert store.put("g:1", self.event()) == "insert"
+        assert store.put("g:2", self.event("Лекция", "2025-05-01")) == "insert"
+        assert store.put("g:1", self.event("Концерт (перенос)")) == "update"
+        assert store.put("g:1", self.event("Концерт (перенос)")) is None
+        assert [e["title"] for e in store.events()] == ["Лекция", "Концерт (перенос)"]
+
+    def test_tombstone_survives_replay(self, tmp_path):
+        """Удаление пишется в журнал и восстанавливается при следующем открытии."""
+        path = tmp_path / "events.jsonl"
+        store = EventStore(path)
+        store.put("g:1", self.event())
+        store.put("g:2", self.event("Лекция"))
+        assert store.delete("g:1") and not store.delete("g:1")
+        store.flush()
+        reopened = EventStore(path)
+        assert "g:1" not in reopened and [e["title"] for e in reopened.events()] == ["Лекция"]
+
+    def test_legacy_event_adopted_by_post(self, tmp_path):
+        """Событие из старого events.json переходит под ключ поста и сохраняет место в порядке."""
+        store = EventStore(tmp_path / "events.jsonl")
+        store.import_legacy([self.event("А"), self.event("Б"), self.event("В")])
+        assert store.put("g:7", self.event("Б")) == "update"
+        assert len(store) == 3 and store.find(self.event("Б")) == "g:7"
+        assert [e["title"] for e in store.events()] == ["А", "Б", "В"]
+
+    def test_render_matches_full_dump(self, tmp_path):
+        """events.json из фрагментов совпадает с полной сериализацией, в том числе после правок."""
+        store = EventStore(tmp_path / "events.jsonl")
+        for i in range(5):
+            store.put(f"g:{i}", self.event(f"Событие {i}", f"2025-06-0{5 - i}"))
+        store.render_json()
+        store.put("g:3", self.event("Правка", "2025-07-01"))
+        store.delete("g:0")
+        assert store.render_json() == json.dumps(store.events(), ensure_ascii=False, indent=2)
+        assert EventStore(tmp_path / "x.jsonl").render_json() == "[]"
+
+    def test_compaction_keeps_live_events(self, tmp_path):
+        """Компактирование оставляет по строке на живое событие в порядке дат."""
+        path = tmp_path / "events.jsonl"
+        store = EventStore(path)
+        for i in range(120):
+            store.put("g:1", self.event(f"Версия {i}"))
+        store.put("g:0", self.event("Раньше", "2025-01-01"))
+        store.flush()
+        lines = path.read_text(encoding="utf-8").splitlines()
+        assert len(lines) <= 2 * len(store) + 100
+        store.compact()
+        assert [json.loads(line)["key"] for line in path.read_text(encoding="utf-8").splitlines()] == ["g:0", "g:1"]
+        assert EventStore(path).get("g:1")["title"] == "Версия 119"
+
+    def test_replay_keeps_order_after_moves(self, tmp_path):
+        """Перенос события на другую дату и удаление в журнале восстанавливают тот же порядок."""
+        path = tmp_path / "events.jsonl"
+        store = EventStore(path)
+        for i in range(5):
+            store.put(f"g:{i}", self.event(f"Событие {i}", f"2025-06-0{i + 1}"))
+        store.put("g:4", self.event("Перенос", "2025-05-01"))
+        store.put("g:1", self.event("Позже", "2025-07-01"))
+        store.delete("g:2")
+        store.flush()
+        reopened = EventStore(path)
+        assert reopened.order == sorted(reopened.order) == store.order
+        assert [e["title"] for e in reopened.events()] == ["Перенос", "Событие 0", "Событие 3", "Позже"]
+
+
+class TestClusters:
+    """Тесты предрассчитанных кластеров маркеров."""
+
+    def test_close_points_merge_on_low_zoom(self):
+        """Соседние точки — кластер на мелком масштабе и отдельные маркеры на крупном."""
+        points = [(20.5100, 54.7100, "a"), (20.5105, 54.7102, "b"), (21.5, 54.6, "c")]
+        levels = cluster_points(points, min_zoom=8, max_zoom=16)
+        assert sorted(item[3] for item in levels[16]) == ["a", "b", "c"]
+        assert sorted((item[2], item[3]) for item in levels[8]) == [(1, "c"), (2, None)]
+        merged = next(item for item in levels[8] if item[3] is None)
+        assert merged[0] == pytest.approx(20.51025, abs=1e-4) and merged[1] == pytest.approx(54.7101, abs=1e-4)
+
+    def test_weights_conserved(self):
+        """Сумма весов на каждом уровне равна числу точек."""
+        import random
+        rng = random.Random(1)
+        points = [(rng.gauss(20.5, 0.05), rng.gauss(54.7, 0.03), i) for i in range(500)]
+        for level in cluster_points(points).values():
+            assert sum(item[2] for item in level) == 500
+
+    def test_build_clusters_by_day(self):
+        """События группируются по дате, события без координат пропускаются."""
+        events = [
+            {"title": "А", "date": "2025-06-01", "location": "x", "lat": 54.7, "lon": 20.5},
+            {"title": "Б", "date": "2025-06-02", "location": "x", "lat": 54.7, "lon": 20.5},
+            {"title": "В", "date": "2025-06-02", "location": "y", "lat": None, "lon": None},
+        ]
+        clusters = build_clusters(events)
+        assert list(clusters) == ["2025-06-01", "2025-06-02"]
+        assert all(len(level) == 1 for level in clusters["2025-06-02"].values())
+
+
+class TestProviderStats:
+    """Тесты адаптивного порядка геокодеров."""
+
+    PROVIDERS = [{"name": "ArcGIS", "func": len}, {"name": "Yandex", "func": len}, {"name": "Nominatim", "func": len}]
+
+    def test_address_class(self):
+        """Название площадки и город области различаются, Калининград городом не считается."""
+        assert address_class("Пармезан, Карла Маркса 18, Калининград") == "venue"
+        assert address_class("ул. Мира 1, Калининград") == "street"
+        assert address_class("Янтарь-холл, Светлогорск") == "venue+town"
+
+    def test_static_order_without_data(self, monkeypatch):
+        """Пока попыток меньше порога — статический порядок."""
+        monkeypatch.setattr("fetch_events.GEOCODE_STATS_MIN", 5)
+        stats = ProviderStats()
+        for _ in range(4):
+            stats.record("ул. Мира 1", "ArcGIS", False, 1.0)
+            stats.record("ул. Мира 1", "Yandex", True, 1.0)
+            stats.record("ул. Мира 1", "Nominatim", True, 1.0)
+        assert [p["name"] for p in stats.order(self.PROVIDERS, "ул. Мира 1")] == ["ArcGIS", "Yandex", "Nominatim"]
+
+    def test_reorders_by_success_per_cost(self, monkeypatch):
+        """Частые неудачи уводят провайдера вниз; класс адреса учитывается отдельно."""
+        monkeypatch.setattr("fetch_events.GEOCODE_STATS_MIN", 5)
+        stats = ProviderStats()
+        for i in range(10):
+            stats.record("ул. Мира 1", "ArcGIS", i < 2, 1.0)
+            stats.record("ул. Мира 1", "Yandex", True, 1.0)
+            stats.record("ул. Мира 1", "Nominatim", i < 5, 1.0)
+            stats.record("Бар, Светлогорск", "ArcGIS", True, 1.0)
+            stats.record("Бар, Светлогорск", "Yandex", False, 1.0)
+            stats.record("Бар, Светлогорск", "Nominatim", True, 3.0)
+        assert [p["name"] for p in stats.order(self.PROVIDERS, "ул. Ленина 5")] == ["Yandex", "Nominatim", "ArcGIS"]
+        assert [p["name"] for p in stats.order(self.PROVIDERS, "Кафе, Светлогорск")] == ["ArcGIS", "Nominatim", "Yandex"]
+
+    def test_resolve_skips_wasted_attempt(self, monkeypatch, tmp_path):
+        """Каскад начинает с лучшего провайдера и не тратит вызов на худший; статистика сохраняется."""
+        monkeypatch.setattr("fetch_events.GEOCODE_STATS_MIN", 3)
+        stats = ProviderStats()
+        for _ in range(3):
+            stats.record("ул. Мира 1", "ArcGIS", False, 1.0)
+            stats.record("ул. Мира 1", "Yandex", True, 1.0)
+        calls = []
+        ok = MagicMock(latitude=54.7, longitude=20.5)
+        monkeypatch.setattr("fetch_events.GEOCODERS", [
+            {"name": "ArcGIS", "func": lambda a: calls.append("ArcGIS")},
+            {"name": "Yandex", "func": lambda a: calls.append("Yandex") or ok},
+        ])
+        monkeypatch.setattr("fetch_events.provider_stats", stats)
+        from fetch_events import resolve_addr
+        assert resolve_addr("ул. Мира 2") == ([54.7, 20.5], "Yandex")
+        assert calls == ["Yandex"]
+        stats.save(tmp_path / "stats.json")
+        assert ProviderStats.load(tmp_path / "stats.json").data["street"]["Yandex"]["calls"] == 4
+
+    def test_order_fixed_for_run(self, monkeypatch, store):
+        """Порядок берётся из снимка на начало прогона: неудачи потоков его не меняют."""
+        monkeypatch.setattr("fetch_events.GEOCODE_STATS_MIN", 2)
+        stats = ProviderStats()
+        for i in range(2):
+            stats.record("ул. Мира 1", "ArcGIS", True, 0.5)
+            stats.record("ул. Мира 1", "Nominatim", i == 0, 0.5)
+        calls = []
+        ok = MagicMock(latitude=54.7, longitude=20.5)
+        monkeypatch.setattr("fetch_events.GEOCODERS", [
+            {"name": "Nominatim", "func": lambda a: calls.append("Nominatim") or ok},
+            {"name": "ArcGIS", "func": lambda a: calls.append("ArcGIS")},
+        ])
+        for name, value in [("provider_stats", stats), ("geocache", store), ("geolog", {})]:
+            monkeypatch.setattr(f"fetch_events.{name}", value)
+        geocode_all([f"ул. Мира {i}" for i in range(10)], workers=4)
+        assert calls.count("ArcGIS") == 10
+        assert stats.data["street"]["ArcGIS"]["calls"] == 12
+
+
+class TestHedgedGeocoding:
+    """Тесты хеджированного геокодинга."""
+
+    @pytest.fixture
+    def hedged(self, monkeypatch):
+        monkeypatch.setattr("fetch_events.GEOCODE_HEDGE", True)
+        monkeypatch.setattr("fetch_events.GEOCODE_HEDGE_DELAY", 0.05)
+        release = threading.Event()
+        yield release
+        release.set()
+
+    def provider(self, name, coords, calls, release=None):
+        def geocode(addr):
+            calls.append(name)
+            if release is not None:
+                release.wait(5)
+            return MagicMock(latitude=coords[0], longitude=coords[1]) if coords else None
+        return {"name": name, "func": geocode}
+
+    def test_slow_primary_is_hedged(self, monkeypatch, hedged):
+        """Медленный первый провайдер не задерживает ответ: побеждает следующий."""
+        calls = []
+        monkeypatch.setattr("fetch_events.GEOCODERS", [
+            self.provider("ArcGIS", (54.70, 20.50), calls, release=hedged),
+            self.provider("Yandex", (54.71, 20.51), calls),
+        ])
+        from fetch_events import resolve_addr
+        start = time.perf_counter()
+        assert resolve_addr("ул. Мира 1") == ([54.71, 20.51], "Yandex")
+        assert time.perf_counter() - start < 1.0
+        assert calls == ["ArcGIS", "Yandex"]
+
+    def test_fast_primary_not_hedged(self, monkeypatch, hedged):
+        """Быстрый ответ первого провайдера — второй не вызывается."""
+        calls = []
+        monkeypatch.setattr("fetch_events.GEOCODERS", [
+            self.provider("ArcGIS", (54.70, 20.50), calls),
+            self.provider("Yandex", (54.71, 20.51), calls),
+        ])
+        from fetch_events import resolve_addr
+        assert resolve_addr("ул. Мира 1") == ([54.70, 20.50], "ArcGIS")
+        assert calls == ["ArcGIS"]
+
+    def test_out_of_region_result_rejected(self, monkeypatch, hedged):
+        """Ответ вне Калининградской области не принимается, каскад идёт дальше."""
+        calls = []
+        monkeypatch.setattr("fetch_events.GEOCODERS", [
+            self.provider("ArcGIS", (55.75, 37.61), calls),
+            self.provider("Yandex", None, calls),
+            self.provider("Nominatim", (54.72, 20.52), calls),
+        ])
+        from fetch_events import resolve_addr
+        assert resolve_addr("ул. Мира 1") == ([54.72, 20.52], "Nominatim")
+        assert calls == ["ArcGIS", "Yandex", "Nominatim"]
+
+    def test_abandoned_attempt_stops_retrying(self, monkeypatch, hedged):
+        """Проигравшая попытка после отмены не повторяет запрос и не пишет в лог и статистику."""
+        import geopy.exc
+        from fetch_events import rate_limited, resolve_addr
+        calls, geolog, stats, m = [], {}, ProviderStats(), RunMetrics()
+
+        def failing(addr):
+            calls.append("ArcGIS")
+            hedged.wait(5)
+            raise geopy.exc.GeocoderServiceError("503")
+        monkeypatch.setattr("fetch_events.GEOCODERS", [
+            {"name": "ArcGIS", "func": rate_limited(failing, TokenBucket.from_delay(0))},
+            self.provider("Yandex", (54.71, 20.51), calls),
+        ])
+        monkeypatch.setattr("fetch_events.GEOCODE_ERROR_WAIT", 5.0)
+        monkeypatch.setattr("fetch_events.metrics", m)
+        monkeypatch.setattr("fetch_events.provider_stats", stats)
+        monkeypatch.setattr("fetch_events.geolog", geolog)
+        assert resolve_addr("ул. Мира 1") == ([54.71, 20.51], "Yandex")
+        hedged.set()
+        key = ("provider_calls_total", (("outcome", "cancelled"), ("provider", "ArcGIS")))
+        deadline = time.monotonic() + 2
+        while key not in m.counters and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert m.counters.get(key) == 1
+        assert calls == ["ArcGIS", "Yandex"]
+        assert list(geolog["ул. Мира 1"]) == ["Yandex"]
+        assert "ArcGIS" not in stats.data[ProviderStats.ALL]
+
+
+class TestCircuitBreaker:
+    """Тесты автомата отключения провайдеров."""
+
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        """Автоматы с управляемыми часами: порог 3 ошибки, пауза 60 с."""
+        monkeypatch.setattr("fetch_events.GEOCODE_BREAKER_FAILURES", 3)
+        monkeypatch.setattr("fetch_events.GEOCODE_BREAKER_COOLDOWN", 60)
+        now = [1000.0]
+        monkeypatch.setattr("fetch_events.breakers", CircuitBreakers(clock=lambda: now[0]))
+        return now
+
+    def cascade(self, monkeypatch, arcgis):
+        """Каскад ArcGIS → Yandex, где Yandex всегда отвечает; вернуть список вызовов."""
+        calls = []
+
+        def first(addr):
+            calls.append("ArcGIS")
+            return arcgis()
+
+        def second(addr):
+            calls.append("Yandex")
+            return MagicMock(latitude=54.7, longitude=20.5)
+        monkeypatch.setattr("fetch_events.GEOCODERS", [{"name": "ArcGIS", "func": first},
+                                                        {"name": "Yandex", "func": second}])
+        return calls
+
+    def test_opens_after_consecutive_failures(self, monkeypatch, clock):
+        """После порога ошибок провайдер пропускается, «нет результата» ошибкой не считается."""
+        import geopy.exc
+        from fetch_events import resolve_addr
+        outcomes = iter([None, geopy.exc.GeocoderUnavailable("down")] + [geopy.exc.GeocoderTimedOut("slow")] * 2)
+
+        def arcgis():
+            outcome = next(outcomes)
+            if outcome:
+                raise outcome
+        calls = self.cascade(monkeypatch, arcgis)
+        for i in range(6):
+            assert resolve_addr(f"ул. Мира {i}") == ([54.7, 20.5], "Yandex")
+        assert calls.count("ArcGIS") == 4
+
+    def test_quota_opens_immediately_and_probe(self, monkeypatch, clock):
+        """Квота размыкает сразу; после паузы — один пробный вызов, неудача удваивает паузу."""
+        import geopy.exc
+        from fetch_events import resolve_addr, breakers
+        failing = [True]
+
+        def arcgis():
+            if failing[0]:
+                raise geopy.exc.GeocoderQuotaExceeded("quota")
+            return MagicMock(latitude=54.71, longitude=20.51)
+        calls = self.cascade(monkeypatch, arcgis)
+        resolve_addr("ул. Мира 1")
+        resolve_addr("ул. Мира 2")
+        assert calls.count("ArcGIS") == 1
+
+        clock[0] += 61
+        resolve_addr("ул. Мира 3")
+        resolve_addr("ул. Мира 4")
+        assert calls.count("ArcGIS") == 2
+        assert breakers.data["ArcGIS"]["cooldown"] == 120
+
+        clock[0] += 121
+        failing[0] = False
+        assert resolve_addr("ул. Мира 5") == ([54.71, 20.51], "ArcGIS")
+        assert "ArcGIS" not in breakers.data
+
+    def test_state_survives_restart(self, monkeypatch, clock, tmp_path):
+        """Разомкнутый автомат сохраняется: новый прогон сразу пропускает провайдера."""
+        import geopy.exc
+        from fetch_events import breakers, resolve_addr
+        breakers.record("ArcGIS", False, fatal=True)
+        breakers.save(tmp_path / "breakers.json")
+
+        restored = CircuitBreakers.load(tmp_path / "breakers.json")
+        restored._clock = lambda: clock[0] + 30
+        monkeypatch.setattr("fetch_events.breakers", restored)
+        calls = self.cascade(monkeypatch, lambda: (_ for _ in ()).throw(geopy.exc.GeocoderUnavailable("down")))
+        assert resolve_addr("ул. Мира 1") == ([54.7, 20.5], "Yandex")
+        assert calls == ["Yandex"]
+
+    def test_open_circuits_not_cached_negative(self, monkeypatch, clock, store):
+        """Все автоматы разомкнуты или провайдеры упали — адрес не откладывается отрицательной записью."""
+        import geopy.exc
+        from fetch_events import breakers
+        monkeypatch.setattr("fetch_events.geocache", store)
+
+        def down(addr):
+            raise geopy.exc.GeocoderUnavailable("down")
+        monkeypatch.setattr("fetch_events.GEOCODERS", [{"name": "ArcGIS", "func": down}, {"name": "Yandex", "func": down}])
+        assert geocode_addr("ул. Мира 2") == (None, None)
+        assert store.lookup("ул. Мира 2") is None
+
+        calls = self.cascade(monkeypatch, lambda: None)
+        breakers.record("ArcGIS", False, fatal=True)
+        breakers.record("Yandex", False, fatal=True)
+        assert geocode_addr("ул. Мира 1") == (None, None)
+        assert calls == [] and store.lookup("ул. Мира 1") is None
+
+        breakers.data.pop("Yandex")
+        monkeypatch.setattr("fetch_events.GEOCODERS", [{"name": "Yandex", "func": lambda addr: None}])
+        assert geocode_addr("ул. Мира 1") == (None, None)
+        assert store.lookup("ул. Мира 1")["failures"] == 1
+
+    def test_quota_error_not_retried(self, monkeypatch):
+        """rate_limited не повторяет ошибку квоты с паузой GEOCODE_ERROR_WAIT."""
+        import geopy.exc
+        from fetch_events import rate_limited
+        monkeypatch.setattr("fetch_events.GEOCODE_ERROR_WAIT", 0.0)
+        calls = []
+
+        def geocode(addr):
+            calls.append(addr)
+            raise geopy.exc.GeocoderQuotaExceeded("quota")
+        with pytest.raises(geopy.exc.GeocoderQuotaExceeded):
+            rate_limited(geocode, TokenBucket(float("inf")))("ул. Мира 1")
+        assert calls == ["ул. Мира 1"]
+
+
+class TestGazetteer:
+    """Тесты локального газеттира."""
+
+    @pytest.fixture
+    def gaz(self):
+        g = Gazetteer()
+        g.add("Пармезан, Карла Маркса 18, Калининград", 54.7287, 20.4808)
+        g.add("Лондон, Мира 33, Калининград", 54.7204, 20.4831)
+        g.add("Янтарь Холл, Светлогорск, ул. Ленина, 11", 54.9443, 20.1488)
+        return g
+
+    def test_near_match_with_confidence(self, gaz):
+        """Другое написание известного адреса находится без сети, с уверенностью ниже 1."""
+        coords, confidence, key = gaz.match("Бар Пармезан, ул Карла Маркса, 18")
+        assert coords == [54.7287, 20.4808] and key == "parmezan, karla marksa 18"
+        assert 0.8 <= confidence < 1.0
+        assert gaz.match("Лондон, Мира 33")[1] == 1.0
+
+    def test_house_and_town_guard(self, gaz):
+        """Другой номер дома или другой город — не совпадение."""
+        assert gaz.match("Лондон, Мира 35") is None
+        assert gaz.match("Янтарь Холл, Зеленоградск, Ленина 11") is None
+
+    def test_serialized_index(self, gaz, tmp_path):
+        """Сохранённый индекс загружается только с той же сигнатурой и ищет так же."""
+        gaz.save(tmp_path / "g.pickle", "osm:1")
+        assert Gazetteer.load(tmp_path / "g.pickle", "osm:2") is None
+        loaded = Gazetteer.load(tmp_path / "g.pickle", "osm:1")
+        assert loaded.match("Пармезан, К. Маркса 18") == gaz.match("Пармезан, К. Маркса 18")
+
+    def test_osm_extract(self, tmp_path):
+        """Выгрузка OSM в GeoJSON Lines: адрес и название площадки."""
+        path = tmp_path / "osm.geojsonl"
+        features = [
+            {"type": "Feature", "geometry": {"type": "Point", "coordinates": [20.51, 54.71]},
+             "properties": {"addr:street": "улица Мира", "addr:housenumber": "5", "name": "Дом искусств"}},
+            {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [[[20.49, 54.72], [20.5, 54.72]]]},
+             "properties": {"addr:street": "Гвардейский проспект", "addr:housenumber": "51А"}},
+        ]
+        path.write_text("\n".join(json.dumps(f, ensure_ascii=False) for f in features), encoding="utf-8")
+        gaz = Gazetteer.from_osm(path)
+        assert gaz.match("Гвардейский пр-т, 51а")[0] == [54.72, 20.49]
+        assert gaz.match("Дом искусств, Мира 5")[0] == [54.71, 20.51]
+
+    def test_geocode_uses_gazetteer_first(self, store, gaz, monkeypatch):
+        """Близкое написание разрешается газеттиром, провайдеры не вызываются, результат кэшируется."""
+        provider = MagicMock()
+        monkeypatch.setattr("fetch_events.GEOCODERS", [{"name": "ArcGIS", "func": provider}])
+        monkeypatch.setattr("fetch_events.geocache", store)
+        monkeypatch.setattr("fetch_events.gazetteer", gaz)
+        assert geocode_addr("Пармезан, К. Маркса 18") == (54.7287, 20.4808)
+        provider.assert_not_called()
+        assert store.lookup("Пармезан, К. Маркса 18")["provider"] == "gazetteer"
+
+
+class TestEventTimes:
+    """Тесты начала, конца и возраста события, года по дате поста."""
+
+    @staticmethod
+    def posted(day: str) -> int:
+        from datetime import datetime
+        return int(datetime.strptime(day, "%Y-%m-%d").replace(hour=12, tzinfo=EVENT_TZ).timestamp())
+
+    def test_year_rollover_by_post_date(self):
+        """Декабрьский анонс «05.01» — январь следующего года, недавний отчёт — тот же год."""
+        assert event_year(1, 5, self.posted("2025-12-20")) == 2026
+        assert event_year(12, 28, self.posted("2026-01-03")) == 2025
+        assert event_year(6, 1, self.posted("2025-05-20")) == 2025
+        assert event_year(6, 1) == 2025  # без даты поста — YEAR_DEFAULT
+        result = extract("📍 Бар\n05.01 | Ёлка", posted=self.posted("2025-12-20"))
+        assert result["date"] == "2026-01-05"
+        assert event_details(result["date"], result["text"])["start"] == "2026-01-05T00:00:00+02:00"
+
+    def test_time_range_and_overnight(self):
+        """«17:00 - 21:00» — часы в тот же день, конец раньше начала — следующие сутки."""
+        assert event_details("2025-10-11", "11.10 | Концерт\n17:00 - 21:00") == {
+            "start": "2025-10-11T17:00:00+02:00", "end": "2025-10-11T21:00:00+02:00", "age": None}
+        night = event_details("2025-12-31", "31.12 | Вечеринка\n22:00 - 04:00")
+        assert night["end"] == "2026-01-01T04:00:00+02:00"
+        single = event_details("2025-10-11", "11.10 | Лекция\nНачало в 19:30")
+        assert single["start"] == "2025-10-11T19:30:00+02:00" and single["end"] == "2025-10-11T23:59:59+02:00"
+
+    def test_date_ranges(self):
+        """«17-18.10» и «31.12 - 02.01» задают первый и последний день, дата события не меняется."""
+        fest = extract("📍 Парк\n17-18.10 | Фестиваль\n12:00 - 20:00")
+        assert fest["date"] == "2025-10-18"
+        fest = event_details(fest["date"], fest["text"])
+        assert (fest["start"], fest["end"]) == ("2025-10-17T12:00:00+02:00", "2025-10-18T20:00:00+02:00")
+        holidays = event_details("2025-12-31", "31.12 - 02.01 | Каникулы")
+        assert (holidays["start"], holidays["end"]) == ("2025-12-31T00:00:00+02:00", "2026-01-02T23:59:59+02:00")
+        # Диапазон не у первой даты и неверные даты не трогают границы
+        assert event_details("2025-10-05", "05.10 | Выставка, а 10-12.11 — другое")["end"] == "2025-10-05T23:59:59+02:00"
+        invalid = extract("📍 Бар\n30-31.02 | ?")
+        assert event_details(invalid["date"], invalid["text"])["start"] is None
+
+    def test_age_marking(self):
+        """Возраст — наибольшая маркировка «N+», числа вроде «30+ лет» и «+7» не считаются."""
+        assert event_details("2025-10-11", "Концерт\n16+\nДетям 6+")["age"] == 16
+        assert event_details("2025-10-11", "Для тех, кому 30+ лет, тел. +7 900 000-00-00")["age"] is None
+        assert event_details("2025-10-11", "Вход 0+")["age"] == 0
+
+    def test_store_and_index_carry_fields(self, tmp_path):
+        """Старые записи журнала и импорт events.json получают поля при чтении, индекс их выгружает."""
+        path = tmp_path / "events.jsonl"
+        old = {"title": "Концерт", "date": "2025-06-01", "location": "Мира 1, Калининград",
+               "lat": 54.7, "lon": 20.5, "text": "01.06 | Концерт 18+\n19:00 - 21:30\n📍 Мира 1"}
+        path.write_text(json.dumps({"key": "g:1", "hash": "x", "seq": 0, "event": old}, ensure_ascii=False) + "\n",
+                        encoding="utf-8")
+        event = EventStore(path).get("g:1")
+        assert (event["start"], event["end"], event["age"]) == (
+            "2025-06-01T19:00:00+02:00", "2025-06-01T21:30:00+02:00", 18)
+        entry = write_partitioned([old], tmp_path / "out")["events"][0]
+        assert (entry["start"], entry["end"], entry["age"]) == (event["start"], event["end"], 18)
+
+    def test_fields_computed_on_store_not_extract(self, tmp_path):
+        """extract() не разбирает время и возраст, их досчитывает запись в хранилище."""
+        event = extract("📍 Мира 1\n01.06 | Концерт 18+\n19:00 - 21:30")
+        assert "start" not in event
+        store = EventStore(tmp_path / "events.jsonl")
+        store.put("g:1", dict(event, lat=54.7, lon=20.5))
+        assert (store.get("g:1")["end"], store.get("g:1")["age"]) == ("2025-06-01T21:30:00+02:00", 18)
+
+
+class TestHttpTransport:
+    """Тесты общего HTTP-транспорта VK и геокодеров."""
+
+    @pytest.fixture
+    def geo_server(self, monkeypatch):
+        """Локальный «Nominatim» с keep-alive и gzip; считает принятые соединения."""
+        import gzip
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        import fetch_events
+
+        accepted = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                accepted.append(self.client_address)
+
+            def do_GET(self):
+                body = json.dumps([{"lat": "54.7", "lon": "20.5", "display_name": "X", "place_id": 1}]).encode()
+                gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+                if gzipped:
+                    body = gzip.compress(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                if self.headers.get("Connection", "").lower() == "close":
+                    self.send_header("Connection", "close")  # как nginx: клиент не переиспользует сокет
+                if gzipped:
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        monkeypatch.setattr(fetch_events, "session", None)
+        monkeypatch.setattr(fetch_events, "metrics", RunMetrics())
+        yield f"127.0.0.1:{srv.server_address[1]}", accepted
+        fetch_events.close_session()
+        srv.shutdown()
+        srv.server_close()
+
+    def nominatim(self, domain):
+        from geopy.geocoders import Nominatim
+        return Nominatim(user_agent="test", domain=domain, scheme="http", timeout=5,
+                         adapter_factory=shared_geopy_adapter())
+
+    def test_geocoder_and_vk_share_pool(self, geo_server):
+        """Геокодер и запросы VK идут через одно соединение; ответы сжаты."""
+        import fetch_events
+        domain, accepted = geo_server
+        geocoder = self.nominatim(domain)
+        assert [geocoder.geocode(f"Мира {i}").latitude for i in range(3)] == [54.7] * 3
+        assert fetch_events.get_session().get(f"http://{domain}/method/wall.get").json()[0]["lat"] == "54.7"
+        assert len(accepted) == 1
+        assert transport_summary() == {"127.0.0.1": {"new": 1, "reused": 3}}
+        assert fetch_events.metrics.counters[("http_client_compressed_total", (("host", "127.0.0.1"),))] == 4
+
+    def test_keepalive_disabled(self, geo_server, monkeypatch):
+        """HTTP_KEEPALIVE=0 — Connection: close и новое соединение на каждый запрос."""
+        monkeypatch.setattr("fetch_events.HTTP_KEEPALIVE", False)
+        domain, accepted = geo_server
+        geocoder = self.nominatim(domain)
+        for i in range(3):
+            geocoder.geocode(f"Мира {i}")
+        assert len(accepted) == 3
+        assert transport_summary() == {"127.0.0.1": {"new": 3, "reused": 0}}
+
+    def test_geocoder_errors_not_retried_by_adapter(self, monkeypatch):
+        """503 геокодера повторяет только rate_limited: GEOCODE_MAX_RETRIES + 1 запросов, а не ×4."""
+        import geopy.exc
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        import fetch_events
+        from fetch_events import rate_limited
+
+        hits = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                hits.append(self.path)
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        for name, value in [("session", None), ("metrics", RunMetrics()),
+                            ("GEOCODE_MAX_RETRIES", 1), ("GEOCODE_ERROR_WAIT", 0.0)]:
+            monkeypatch.setattr(fetch_events, name, value)
+        try:
+            geocode = rate_limited(self.nominatim(f"127.0.0.1:{srv.server_address[1]}").geocode, TokenBucket(float("inf")))
+            with pytest.raises(geopy.exc.GeocoderServiceError):
+                geocode("Мира 1")
+            assert len(hits) == 2
+        finally:
+            fetch_events.close_session()
+            srv.shutdown()
+            srv.server_close()
+
+    def test_host_timeouts(self, monkeypatch):
+        """Таймаут хоста из HTTP_TIMEOUTS важнее таймаута вызова, connect ограничен сверху."""
+        import fetch_events
+        from requests.adapters import HTTPAdapter
+        from requests.models import Response
+
+        assert parse_host_timeouts("A.example=2:15, b.example=3, плохо, c=x:1") == {
+            "a.example": (2.0, 15.0), "b.example": (3.0, 3.0)}
+        seen = []
+
+        def send(self, request, timeout=None, **kwargs):
+            seen.append(timeout)
+            response = Response()
+            response.status_code, response._content = 200, b"{}"
+            return response
+
+        monkeypatch.setattr(HTTPAdapter, "send", send)
+        monkeypatch.setattr(fetch_events, "session", None)
+        monkeypatch.setattr(fetch_events, "HTTP_TIMEOUTS", "slow.example=4:30")
+        monkeypatch.setattr(fetch_events, "HTTP_CONNECT_TIMEOUT", 5.0)
+        http = fetch_events.get_session()
+        http.get("https://slow.example/x", timeout=10)
+        http.get("https://api.vk.ru/method/wall.get", timeout=20)
+        http.get("https://api.vk.ru/method/wall.get", timeout=2)
+        http.get("https://geocode.example/x")
+        assert seen == [(4.0, 30.0), (5.0, 20), (2, 2), (5.0, fetch_events.HTTP_READ_TIMEOUT)]
+        fetch_events.close_session()
+
+
+class TestBatchGeocoding:
+    """Тесты пакетного геокодинга geocode_many."""
+
+    @pytest.fixture
+    def arcgis(self, monkeypatch, store):
+        """Локальный geocodeAddresses: адреса с «Мира» находятся, «Луна» — вне области.
+
+        Возвращает (список пачек из запросов, ответ-ошибку для подмены).
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs
+        import fetch_events
+
+        batches, error = [], {}
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+                records = [r["attributes"] for r in json.loads(form["addresses"][0])["records"]]
+                batches.append([r["SingleLine"] for r in records])
+                locations = []
+                for r in records:
+                    y, x = (10.0, 10.0) if "Луна" in r["SingleLine"] else (54.7, 20.5 + r["OBJECTID"] / 100)
+                    matched = "Мира" in r["SingleLine"] or "Луна" in r["SingleLine"]
+                    locations.append({"location": {"x": x, "y": y}, "score": 100 if matched else 0,
+                                      "attributes": {"ResultID": r["OBJECTID"], "Status": "M" if matched else "U"}})
+                body = json.dumps({"error": dict(error)} if error else {"locations": locations[::-1]}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        monkeypatch.setattr(fetch_events, "ARCGIS_TOKEN", "token")
+        monkeypatch.setattr(fetch_events, "ARCGIS_BATCH_URL", f"http://127.0.0.1:{srv.server_address[1]}/geocodeAddresses")
+        monkeypatch.setattr(fetch_events, "BATCH_GEOCODERS", None)
+        monkeypatch.setattr(fetch_events, "session", None)
+        monkeypatch.setattr(fetch_events, "metrics", RunMetrics())
+        monkeypatch.setattr(fetch_events, "geocache", store)
+        monkeypatch.setattr(fetch_events, "geolog", {})
+        monkeypatch.setattr(fetch_events, "gazetteer", None)
+        monkeypatch.setattr(fetch_events, "provider_stats", None)
+        monkeypatch.setattr(fetch_events, "breakers", CircuitBreakers())
+        monkeypatch.setitem(fetch_events.DEFAULT_DELAYS, "ARCGIS", 0)
+        yield batches, error
+        fetch_events.close_session()
+        srv.shutdown()
+        srv.server_close()
+
+    def cascade(self, monkeypatch):
+        """Одиночный каскад, который находит всё; вернуть список запрошенных адресов."""
+        calls = []
+
+        def nominatim(addr):
+            calls.append(addr)
+            return MagicMock(latitude=54.6, longitude=20.4)
+        monkeypatch.setattr("fetch_events.GEOCODERS", [{"name": "Nominatim", "func": nominatim}])
+        return calls
+
+    def test_batches_and_cascade_fallback(self, arcgis, monkeypatch, store):
+        """Кэшированные адреса не отправляются, промахи идут пачками, ненайденные — каскадом."""
+        import fetch_events
+        batches, _ = arcgis
+        calls = self.cascade(monkeypatch)
+        store.put("Мира 1", [54.0, 20.0], "ArcGIS")
+        addrs = ["Мира 1", "Мира 2", "Мира 2", "Неизвестная 3", "Мира 4", "Мира 5"]
+        result = geocode_many(addrs, chunk_size=2, workers=1)
+
+        assert batches == [["Мира 2", "Неизвестная 3"], ["Мира 4", "Мира 5"]]
+        assert calls == ["Неизвестная 3"]
+        assert result == {"Мира 1": (54.0, 20.0), "Мира 2": (54.7, 20.5), "Неизвестная 3": (54.6, 20.4),
+                          "Мира 4": (54.7, 20.5), "Мира 5": (54.7, 20.51)}
+        assert store.lookup("Мира 5")["provider"] == "ArcGIS batch"
+        counters = fetch_events.metrics.counters
+        assert counters[("geocode_batch_addresses_total", (("provider", "ArcGIS batch"), ("result", "matched")))] == 3
+        assert counters[("geocode_batch_addresses_total", (("provider", "ArcGIS batch"), ("result", "unmatched")))] == 1
+
+    def test_out_of_region_falls_back(self, arcgis, monkeypatch):
+        """Совпадение вне REGION_BBOX не принимается, адрес уходит в каскад."""
+        calls = self.cascade(monkeypatch)
+        assert geocode_many(["Луна 1", "Мира 2"], workers=1) == {"Луна 1": (54.6, 20.4), "Мира 2": (54.7, 20.51)}
+        assert calls == ["Луна 1"]
+
+    def test_token_error_opens_breaker(self, arcgis, monkeypatch):
+        """Отказ токена размыкает автомат «ArcGIS batch»: остальные пачки не шлются, всё идёт каскадом."""
+        import fetch_events
+        batches, error = arcgis
+        error.update(code=498, message="Invalid token")
+        calls = self.cascade(monkeypatch)
+        result = geocode_many([f"Мира {i}" for i in range(4)], chunk_size=2, workers=1)
+
+        assert len(batches) == 1
+        assert calls == [f"Мира {i}" for i in range(4)]
+        assert set(result.values()) == {(54.6, 20.4)}
+        assert fetch_events.breakers.permit("ArcGIS batch") is None
+        assert fetch_events.metrics.counters[
+            ("provider_batch_calls_total", (("outcome", "quota"), ("provider", "ArcGIS batch")))] == 1
+
+        geocode_many(["Мира 9"], workers=1)
+        assert len(batches) == 1
+
+    def test_without_token_equals_geocode_all(self, arcgis, monkeypatch):
+        """Без ARCGIS_TOKEN пакетных провайдеров нет, geocode_many совпадает с geocode_all."""
+        batches, _ = arcgis
+        monkeypatch.setattr("fetch_events.ARCGIS_TOKEN", "")
+        calls = self.cascade(monkeypatch)
+        assert geocode_many(["Мира 1", "Мира 2"], workers=1) == {"Мира 1": (54.6, 20.4), "Мира 2": (54.6, 20.4)}
+        assert batches == [] and calls == ["Мира 1", "Мира 2"]
+
+
 if __name__ == "__main__":
     # Простой запуск без pytest
     import unittest
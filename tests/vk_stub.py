@@ -0,0 +1,96 @@
+"""
+Локальный stub VK API для тестов fetch_events.py.
+Отвечает на wall.get и execute (только вызовы API.wall.get внутри code).
+"""
+
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+RE_WALL_CALL = re.compile(r"API\.wall\.get\((\{.*?\})\)")
+
+
+class VKStub:
+    """Stub VK API на 127.0.0.1 со случайным портом.
+
+    posts — {домен: [посты от новых к старым]}; failing_offsets — смещения,
+    на которых подзапрос внутри execute возвращает false; execute_error —
+    весь execute отвечает ошибкой VK.
+    """
+
+    def __init__(self, posts: dict):
+        self.posts = posts
+        self.failing_offsets = set()
+        self.execute_error = False
+        self.calls = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/method"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def methods(self) -> list:
+        """Имена вызванных методов в порядке поступления."""
+        return [method for method, _ in self.calls]
+
+    def wall_get(self, params: dict) -> dict:
+        items = self.posts.get(params.get("domain"), [])
+        offset, count = int(params.get("offset", 0)), int(params.get("count", 20))
+        return {"count": len(items), "items": items[offset:offset + count]}
+
+    def execute(self, code: str) -> dict:
+        if self.execute_error:
+            return {"error": {"error_code": 13, "error_msg": "Runtime error occurred during code invocation"}}
+        response, errors = [], []
+        for raw in RE_WALL_CALL.findall(code):
+            params = json.loads(raw)
+            if int(params.get("offset", 0)) in self.failing_offsets:
+                response.append(False)
+                errors.append({"method": "wall.get", "error_code": 10, "error_msg": "Internal server error"})
+            else:
+                response.append(self.wall_get(params))
+        data = {"response": response}
+        if errors:
+            data["execute_errors"] = errors
+        return data
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                method = url.path.rsplit("/", 1)[-1]
+                with stub.lock:
+                    stub.calls.append((method, params))
+                if method == "wall.get":
+                    body = {"response": stub.wall_get(params)}
+                elif method == "execute":
+                    body = stub.execute(params.get("code", ""))
+                else:
+                    body = {"error": {"error_code": 3, "error_msg": "Unknown method passed"}}
+                payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler